@@ -0,0 +1,362 @@
+"""Versioned JSON API for the mobile client, under /api/v1.
+
+Reads select plain columns and serialize the rows directly, without loading
+ORM objects. Every list takes:
+
+- `fields`: comma separated fields to return (default: all of them)
+- `include=users`: add a `users` map of the messages' authors, by id, with
+  `user_fields` choosing their fields
+- `cursor` and `limit` (at most MAX_LIMIT): keyset pagination, as on the
+  HTML pages; the response's `next_cursor` fetches the next page
+
+Responses look like `{"data": ..., "next_cursor": ...}`; errors like
+`{"error": "..."}` with the HTTP status. Messages from private accounts are
+only returned to their followers.
+"""
+
+from datetime import datetime
+
+from flask import Blueprint, abort, g, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+from models import db, Follows, Like, Message, User
+from pagination import (MESSAGES_PER_PAGE, USERS_PER_PAGE, Page, make_page,
+                        message_cursor, message_key, paginate_messages,
+                        paginate_users)
+from search import visible_messages
+import live
+import timeline
+import trending
+import writebehind
+
+MAX_LIMIT = 100
+MAX_BATCH = 100
+
+MESSAGE_FIELDS = ('id', 'text', 'timestamp', 'user_id', 'like_count',
+                  'liked')
+USER_FIELDS = ('id', 'username', 'image_url', 'header_image_url', 'bio',
+               'location', 'private', 'messages_count', 'following_count',
+               'followers_count', 'likes_count', 'following')
+CARD_FIELDS = ('id', 'username', 'image_url')
+
+api = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+
+@api.before_request
+def require_login():
+    if not g.user:
+        abort(403)
+
+
+@api.errorhandler(HTTPException)
+def json_error(error):
+    return jsonify({'error': error.description}), error.code
+
+
+def _list_arg(name, allowed=None, default=()):
+    value = request.args.get(name)
+    if value is None:
+        return list(default)
+
+    items = [item for item in value.split(',') if item]
+    if allowed is not None:
+        unknown = set(items) - set(allowed)
+        if unknown:
+            abort(400, f"unknown {name}: {', '.join(sorted(unknown))}")
+    return items
+
+
+def _ids_arg(values, limit=MAX_BATCH):
+    if not isinstance(values, list):
+        abort(400, "ids must be a list")
+    try:
+        ids = [int(value) for value in values]
+    except (TypeError, ValueError):
+        abort(400, "ids must be integers")
+    if len(ids) > limit:
+        abort(400, f"at most {limit} ids at a time")
+    return list(dict.fromkeys(ids))
+
+
+def _limit(default):
+    try:
+        return max(1, min(int(request.args.get('limit', default)), MAX_LIMIT))
+    except ValueError:
+        abort(400, "limit must be an integer")
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _columns(model, fields, always):
+    """Columns of `model` to select for `fields`, plus `always`."""
+
+    names = dict.fromkeys(always)
+    names.update((field, None) for field in fields if hasattr(model, field)
+                 and field not in ('liked', 'following'))
+    return [getattr(model, name) for name in names]
+
+
+def _messages_query(fields):
+    columns = _columns(Message, fields, ('id', 'timestamp', 'user_id'))
+    return visible_messages(g.user).with_entities(*columns)
+
+
+def _users_query(fields):
+    return db.session.query(*_columns(User, fields, ('id',)))
+
+
+def serialize_messages(rows, fields):
+    liked = (g.user.liked_message_ids([row.id for row in rows])
+             if 'liked' in fields else ())
+    return [{field: (row.id in liked if field == 'liked'
+                     else _value(getattr(row, field)))
+             for field in fields}
+            for row in rows]
+
+
+def serialize_users(rows, fields):
+    following = (g.user.following_ids([row.id for row in rows])
+                 if 'following' in fields else ())
+    return [{field: (row.id in following if field == 'following'
+                     else getattr(row, field))
+             for field in fields}
+            for row in rows]
+
+
+def message_list(page):
+    """JSON response for a Page of message rows."""
+
+    return jsonify(message_body(page))
+
+
+def message_body(page):
+    """message_list()'s response body, to add to."""
+
+    fields = _list_arg('fields', MESSAGE_FIELDS, MESSAGE_FIELDS)
+    body = {'data': serialize_messages(page.items, fields),
+            'next_cursor': page.next_cursor}
+
+    if 'users' in _list_arg('include', ('users',)):
+        user_fields = list(dict.fromkeys(
+            ['id'] + _list_arg('user_fields', USER_FIELDS, CARD_FIELDS)))
+        author_ids = list({row.user_id for row in page.items})
+        authors = (_users_query(user_fields)
+                   .filter(User.id.in_(author_ids)).all())
+        body['users'] = {user['id']: user for user in
+                         serialize_users(authors, user_fields)}
+    return body
+
+
+def user_list(page):
+    """JSON response for a Page of user rows."""
+
+    fields = _list_arg('fields', USER_FIELDS, USER_FIELDS)
+    return jsonify({'data': serialize_users(page.items, fields),
+                    'next_cursor': page.next_cursor})
+
+
+def _get_user(user_id):
+    user = (db.session.query(User.id, User.private)
+            .filter(User.id == user_id).first())
+    if user is None:
+        abort(404, "no such user")
+    return user
+
+
+##############################################################################
+# Reads
+
+
+@api.route('/timeline')
+def timeline_view():
+    """The current user's home timeline."""
+
+    limit = _limit(MESSAGES_PER_PAGE)
+    fields = _list_arg('fields', MESSAGE_FIELDS, MESSAGE_FIELDS)
+    columns = _columns(Message, fields, ('id', 'timestamp', 'user_id'))
+
+    rows = timeline.get_timeline(g.user,
+                                 message_cursor(request.args.get('cursor')),
+                                 limit + 1, db.session.query(*columns))
+    return message_list(make_page(rows, limit, message_key))
+
+
+@api.route('/timeline/stream')
+def timeline_stream():
+    """New messages from the current user's follows, as Server-Sent Events.
+
+    Resumes after the Last-Event-ID header, or the `last_event_id` param.
+    """
+
+    last_event_id = (request.headers.get('Last-Event-ID')
+                     or request.args.get('last_event_id'))
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            abort(400, "last_event_id must be an integer")
+    return live.stream(g.user, last_event_id)
+
+
+@api.route('/users/<int:user_id>')
+def user_view(user_id):
+    fields = _list_arg('fields', USER_FIELDS, USER_FIELDS)
+    rows = _users_query(fields).filter(User.id == user_id).all()
+    if not rows:
+        abort(404, "no such user")
+    return jsonify({'data': serialize_users(rows, fields)[0]})
+
+
+@api.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    user = _get_user(user_id)
+    if (user.private and user.id != g.user.id
+            and not g.user.is_following(user)):
+        abort(403, "this account is private")
+
+    fields = _list_arg('fields', MESSAGE_FIELDS, MESSAGE_FIELDS)
+    query = _messages_query(fields).filter(Message.user_id == user.id)
+    return message_list(paginate_messages(query, request.args.get('cursor'),
+                                          _limit(MESSAGES_PER_PAGE)))
+
+
+@api.route('/users/<int:user_id>/likes')
+def user_likes(user_id):
+    _get_user(user_id)
+
+    fields = _list_arg('fields', MESSAGE_FIELDS, MESSAGE_FIELDS)
+    query = (_messages_query(fields)
+             .join(Like, Like.message_id == Message.id)
+             .filter(Like.user_id == user_id))
+    return message_list(paginate_messages(query, request.args.get('cursor'),
+                                          _limit(MESSAGES_PER_PAGE)))
+
+
+@api.route('/users/<int:user_id>/following')
+def user_following(user_id):
+    _get_user(user_id)
+
+    fields = _list_arg('fields', USER_FIELDS, USER_FIELDS)
+    query = (_users_query(fields)
+             .join(Follows, Follows.user_being_followed_id == User.id)
+             .filter(Follows.user_following_id == user_id))
+    return user_list(paginate_users(query, request.args.get('cursor'),
+                                    _limit(USERS_PER_PAGE)))
+
+
+@api.route('/users/<int:user_id>/followers')
+def user_followers(user_id):
+    _get_user(user_id)
+
+    fields = _list_arg('fields', USER_FIELDS, USER_FIELDS)
+    query = (_users_query(fields)
+             .join(Follows, Follows.user_following_id == User.id)
+             .filter(Follows.user_being_followed_id == user_id))
+    return user_list(paginate_users(query, request.args.get('cursor'),
+                                    _limit(USERS_PER_PAGE)))
+
+
+@api.route('/messages/<int:message_id>')
+def message_view(message_id):
+    fields = _list_arg('fields', MESSAGE_FIELDS, MESSAGE_FIELDS)
+    rows = _messages_query(fields).filter(Message.id == message_id).all()
+    if not rows:
+        abort(404, "no such message")
+    return jsonify({'data': serialize_messages(rows, fields)[0]})
+
+
+@api.route('/trending')
+def trending_view():
+    """The hottest messages, each with its `score`, and `hashtags`."""
+
+    limit = _limit(trending.TOP_K)
+    scored = trending.trending_message_ids(limit)
+    fields = _list_arg('fields', MESSAGE_FIELDS, MESSAGE_FIELDS)
+    rows = (_messages_query(fields)
+            .filter(Message.id.in_([message_id for message_id, _ in scored]))
+            .all())
+
+    by_id = {row.id: row for row in rows}
+    rows = [by_id[message_id] for message_id, _ in scored
+            if message_id in by_id]
+    body = message_body(Page(rows, None))
+    scores = dict(scored)
+    for row, message in zip(rows, body['data']):
+        message['score'] = round(scores[row.id], 2)
+
+    body['hashtags'] = [{'tag': tag, 'score': round(score, 2)}
+                        for tag, score in trending.trending_hashtags(limit)]
+    return jsonify(body)
+
+
+##############################################################################
+# Batches
+
+
+@api.route('/messages')
+def messages_batch():
+    """Messages by id: `?ids=1,2,3`, in that order, skipping missing ones."""
+
+    ids = _ids_arg(_list_arg('ids'))
+    fields = _list_arg('fields', MESSAGE_FIELDS, MESSAGE_FIELDS)
+    rows = _messages_query(fields).filter(Message.id.in_(ids)).all()
+
+    by_id = {row.id: row for row in rows}
+    rows = [by_id[message_id] for message_id in ids if message_id in by_id]
+    return message_list(Page(rows, None))
+
+
+@api.route('/users')
+def users_batch():
+    """Users by id: `?ids=1,2,3`, in that order, skipping missing ones."""
+
+    ids = _ids_arg(_list_arg('ids'))
+    fields = _list_arg('fields', USER_FIELDS, USER_FIELDS)
+    rows = _users_query(fields).filter(User.id.in_(ids)).all()
+
+    by_id = {row.id: row for row in rows}
+    return jsonify({'data': serialize_users(
+        [by_id[user_id] for user_id in ids if user_id in by_id], fields)})
+
+
+@api.route('/likes', methods=['POST'])
+def likes_batch():
+    """Like and unlike messages in one call.
+
+    Takes `{"like": [ids], "unlike": [ids]}`; ids that are already in that
+    state, missing or not visible are skipped. Returns the ids now liked and
+    unliked.
+    """
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400, "expected a JSON object")
+
+    like = _ids_arg(body.get('like', []))
+    unlike = _ids_arg(body.get('unlike', []))
+    if set(like) & set(unlike):
+        abort(400, "an id can't be liked and unliked at once")
+
+    already = g.user.liked_message_ids(like + unlike)
+    to_like = [message_id for (message_id,) in
+               visible_messages(g.user)
+               .with_entities(Message.id)
+               .filter(Message.id.in_(set(like) - already))]
+    to_unlike = [message_id for message_id in unlike if message_id in already]
+
+    queue = writebehind.get_queue()
+    if queue is not None:
+        queue.like(g.user.id, to_like)
+        queue.unlike(g.user.id, to_unlike)
+    else:
+        likes = {(g.user.id, message_id): True for message_id in to_like}
+        likes.update({(g.user.id, message_id): False
+                      for message_id in to_unlike})
+        writebehind.apply_likes(likes)
+        db.session.commit()
+    trending.likes_changed(to_like, to_unlike)
+
+    return jsonify({'data': {'liked': sorted(to_like),
+                             'unliked': sorted(to_unlike)}})
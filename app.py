@@ -1,15 +1,47 @@
 import os
 
+import click
 from flask import Flask, render_template, request, flash, redirect, session, g, jsonify
-from flask_debugtoolbar import DebugToolbarExtension
+from flask_migrate import Migrate
 from sqlalchemy.exc import IntegrityError
+from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import wraps
 
 from forms import UserAddForm, LoginForm, MessageForm, EditUserForm, ChangePasswordForm
-from models import db, connect_db, User, Message
+from models import (db, connect_db, remember_follow, User, Message, Follows,
+                    FollowRequest, Like)
+from pagination import (
+    MESSAGES_PER_PAGE, Page, make_page, message_cursor, message_key, page_url,
+    paginate_messages, paginate_requests, paginate_users, render_page)
+from api import api
+import bulk
+import counters
+import deploy
+import follow_requests
+import followgraph
+import fragments
+import httpcache
+import identity
+import live
+import loaders
+from metrics import metrics
+from passwords import HasherBusy, attempt_limiter, hasher
+import search
+import suggestions
+import timeline
+import trending
+import writebehind
 
 CURR_USER_KEY = "curr_user"
 
+# Followers the current user knows, named on profile pages.
+KNOWN_FOLLOWERS_SHOWN = 3
+
+# User columns shown on profile pages, for their ETags.
+PROFILE_COLUMNS = ('username', 'image_url', 'header_image_url', 'bio',
+                   'location', 'private', 'messages_count', 'following_count',
+                   'followers_count', 'likes_count')
+
 app = Flask(__name__)
 
 # Get DB_URI from environ variable (useful for production/testing) or,
@@ -17,13 +49,81 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL_CORRECTED', 'postgresql:///warbler'))
 
+# Pool sizing, timeouts and PgBouncer support; see deploy.py.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = deploy.engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'])
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
-
+app.config['RAISE_ON_LAZY_LOAD'] = False
+app.config['IDENTITY_CACHE_URL'] = os.environ.get('IDENTITY_CACHE_URL')
+app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get('IDENTITY_CACHE_TTL', 60))
+app.config['IDENTITY_CACHE_SIZE'] = int(
+    os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(
+    os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['LOGIN_ATTEMPTS_PER_USERNAME'] = int(
+    os.environ.get('LOGIN_ATTEMPTS_PER_USERNAME', 10))
+app.config['LOGIN_ATTEMPTS_PER_IP'] = int(
+    os.environ.get('LOGIN_ATTEMPTS_PER_IP', 30))
+app.config['SEARCH_BACKEND'] = os.environ.get('SEARCH_BACKEND')
+app.config['FRAGMENT_CACHE_URL'] = os.environ.get('FRAGMENT_CACHE_URL')
+app.config['FRAGMENT_CACHE_TTL'] = int(
+    os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+app.config['FRAGMENT_CACHE_SIZE'] = int(
+    os.environ.get('FRAGMENT_CACHE_SIZE', 50000))
+app.config['RELEASE'] = os.environ.get('RELEASE')
+app.config['WRITE_BEHIND'] = os.environ.get('WRITE_BEHIND') == '1'
+app.config['WRITE_BEHIND_PATH'] = os.environ.get('WRITE_BEHIND_PATH')
+app.config['METRICS_SAMPLE_RATE'] = float(
+    os.environ.get('METRICS_SAMPLE_RATE', 0.1))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['FOLLOW_GRAPH_PATH'] = os.environ.get('FOLLOW_GRAPH_PATH')
+app.config['FOLLOW_GRAPH_MAX_AGE'] = int(
+    os.environ.get('FOLLOW_GRAPH_MAX_AGE', 300))
+app.config['TRENDING_CHECKPOINT_INTERVAL'] = int(
+    os.environ.get('TRENDING_CHECKPOINT_INTERVAL', 60))
+app.config['LIVE_BROKER_URL'] = os.environ.get('LIVE_BROKER_URL')
+app.config['LIVE_HEARTBEAT'] = int(os.environ.get('LIVE_HEARTBEAT', 15))
+app.config['LIVE_STREAM_SECONDS'] = int(
+    os.environ.get('LIVE_STREAM_SECONDS', 300))
+if os.environ.get('LIVE_MAX_STREAMS'):
+    app.config['LIVE_MAX_STREAMS'] = int(os.environ['LIVE_MAX_STREAMS'])
+
+# Number of proxies (e.g. Heroku's router) in front of the app, so
+# request.remote_addr is the client's address for rate limiting.
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+if TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
+
+# The debug toolbar is slow and shows internals, so it's only for local
+# development: on with `flask run` in debug mode or DEBUG_TB_ENABLED=1.
+app.config['DEBUG_TB_ENABLED'] = (
+    os.environ.get('DEBUG_TB_ENABLED', str(int(app.debug))) == '1')
+if app.config['DEBUG_TB_ENABLED']:
+    from flask_debugtoolbar import DebugToolbarExtension
+    toolbar = DebugToolbarExtension(app)
+
+app.jinja_env.globals['page_url'] = page_url
+
+metrics.init_app(app)
 connect_db(app)
+deploy.init_app(app)
+migrate = Migrate(app, db)
+identity.connect_identity_cache(app)
+fragments.connect_fragment_cache(app)
+httpcache.init_app(app)
+writebehind.connect_write_queue(app)
+app.register_blueprint(api)
+hasher.init_app(app)
+attempt_limiter.init_app(app)
+search.connect_search(app)
+followgraph.connect_follow_graph(app)
+trending.connect_trends(app)
+live.connect_live(app)
 
 
 ##############################################################################
@@ -40,17 +140,84 @@ def authenticate(func):
     return wrapper
 
 
+def viewer_context(messages=(), users=()):
+    """Which of `messages` the current user likes and `users` they follow.
+
+    Templates check these id sets instead of walking `g.user`'s
+    relationships once per item.
+    """
+
+    return {
+        'liked_ids': g.user.liked_message_ids([msg.id for msg in messages]),
+        'following_ids': g.user.following_ids([user.id for user in users]),
+    }
+
+
+def social_context(user):
+    """How the current user and `user` are connected, for profile pages.
+
+    Answered from the in-process follow graph (see followgraph.py), so it
+    can lag behind follows made through other workers, and is empty until
+    the graph has loaded.
+    """
+
+    index = followgraph.graph_index()
+    if not index.loaded:
+        return {}
+
+    context = {'mutuals_count': len(index.mutuals(user.id))}
+    if user.id == g.user.id:
+        return context
+
+    known_ids = index.followers_you_know(g.user.id, user.id)
+    shown = known_ids[:KNOWN_FOLLOWERS_SHOWN]
+    names = dict(db.session
+                 .query(User.id, User.username)
+                 .filter(User.id.in_(shown))) if shown else {}
+
+    context['follows_you'] = index.follows(user.id, g.user.id)
+    context['known_followers'] = [(user_id, names[user_id])
+                                  for user_id in shown if user_id in names]
+    context['known_followers_count'] = len(known_ids)
+    return context
+
+
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    This is a cached snapshot (see identity.py); it loads the full User only
+    if a view reads something the snapshot doesn't have.
+    """
     # access g in templates, g only lives for life of request
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = identity.current_user(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+def too_many_attempts(username=None):
+    """Record a password attempt from this client (and for `username`).
+
+    Returns True, and flashes a message, if either is over its limit.
+    """
+
+    if attempt_limiter.allow(request.remote_addr, username):
+        return False
+
+    flash("Too many attempts. Please wait a minute and try again.", 'danger')
+    return True
+
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(error):
+    """Too many password hashes queued: ask the client to retry shortly."""
+
+    return ("Too many logins in progress, please try again shortly.",
+            503, {'Retry-After': '5'})
+
+
 def do_login(user):
     """Log in user."""
 
@@ -78,6 +245,9 @@ def signup():
 
     form = UserAddForm()
     if form.validate_on_submit():
+        if too_many_attempts():
+            return render_template('users/signup.html', form=form), 429
+
         try:
             user = User.signup(
                 username=form.username.data,
@@ -106,10 +276,15 @@ def login():
     form = LoginForm()
 
     if form.validate_on_submit():
+        if too_many_attempts(form.username.data):
+            return render_template('users/login.html', form=form), 429
+
         user = User.authenticate(form.username.data,
                                  form.password.data)
 
         if user:
+            # Saves the password hash if authenticate() upgraded it.
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -136,17 +311,51 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search usernames, bios and
+    locations; search shows the best matches on a single page.
     """
 
-    search = request.args.get('q')
+    query = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
+    if not query:
+        page = paginate_users(loaders.user_cards(User.query),
+                              request.args.get('cursor'))
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = Page(search.find_users(query, loaders.user_cards(User.query)),
+                    None)
 
-    return render_template('users/index.html', users=users)
+    return render_page('users/index.html', 'users/cards.html', page,
+                       **viewer_context(users=page.items))
+
+
+@app.route('/users/suggestions')
+@authenticate
+def users_suggestions():
+    """Accounts followed by people the current user follows."""
+
+    rows = loaders.user_cards(suggestions.suggested_users(g.user)).all()
+    users = [user for user, _ in rows]
+    return render_template('users/suggestions.html',
+                           page=Page(users, None),
+                           scores={user.id: score for user, score in rows},
+                           **viewer_context(users=users))
+
+
+@app.route('/api/users/autocomplete')
+def users_autocomplete():
+    """Users whose username starts with the 'q' param, for the search box."""
+
+    if not g.user:
+        return jsonify({'result': 'fail'}), 403
+
+    users = search.autocomplete_users(
+        request.args.get('q'),
+        db.session.query(User.id, User.username, User.image_url))
+    return jsonify({'result': 'success',
+                    'users': [{'id': user.id,
+                               'username': user.username,
+                               'image_url': user.image_url}
+                              for user in users]})
 
 
 @app.route('/users/<int:user_id>')
@@ -154,10 +363,30 @@ def list_users():
 def users_show(user_id):
     """Show user profile."""
 
-    # check whether private, if private, check whether logged in user following the account
-    user = User.query.get_or_404(user_id)
+    user = loaders.profile(User.query).get_or_404(user_id)
+    following_ids = g.user.following_ids([user.id])
+
+    hidden = (user.private and g.user.id != user.id
+              and user.id not in following_ids)
+    if hidden:
+        page = make_page([], MESSAGES_PER_PAGE, message_key)
+    else:
+        messages = loaders.message_cards(Message.query.filter_by(user_id=user.id))
+        page = paginate_messages(messages, request.args.get('cursor'))
+
+    context = viewer_context(messages=page.items)
+    context['following_ids'] = following_ids
+    social = social_context(user)
 
-    return render_template('users/show.html', user=user)
+    not_modified = httpcache.unchanged(
+        [getattr(user, column) for column in PROFILE_COLUMNS],
+        hidden, following_ids, httpcache.cards(page.items),
+        context['liked_ids'], page.next_cursor, sorted(social.items()))
+    if not_modified:
+        return not_modified
+
+    return render_page('users/show.html', 'messages/list_items.html', page,
+                       user=user, hidden=hidden, **context, **social)
 
 
 @app.route('/users/<int:user_id>/following')
@@ -165,9 +394,17 @@ def users_show(user_id):
 def show_following(user_id):
     """Show list of people this user is following."""
 
+    user = loaders.profile(User.query).get_or_404(user_id)
+    following = (User
+                 .query
+                 .join(Follows, Follows.user_being_followed_id == User.id)
+                 .filter(Follows.user_following_id == user.id))
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    page = paginate_users(loaders.user_cards(following),
+                          request.args.get('cursor'))
+    return render_page('users/following.html', 'users/cards.html', page,
+                       user=user,
+                       **viewer_context(users=page.items + [user]))
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -175,8 +412,17 @@ def show_following(user_id):
 def users_followers(user_id):
     """Show list of followers of this user."""
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = loaders.profile(User.query).get_or_404(user_id)
+    followers = (User
+                 .query
+                 .join(Follows, Follows.user_following_id == User.id)
+                 .filter(Follows.user_being_followed_id == user.id))
+
+    page = paginate_users(loaders.user_cards(followers),
+                          request.args.get('cursor'))
+    return render_page('users/followers.html', 'users/cards.html', page,
+                       user=user,
+                       **viewer_context(users=page.items + [user]))
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -185,60 +431,89 @@ def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
     want_to_follow_user = User.query.get_or_404(follow_id)
+
+    if want_to_follow_user.id in g.user.following_ids([follow_id]):
+        return redirect(f"/users/{g.user.id}/following")
+
     if want_to_follow_user.private:
-        # =========== NEED TO IMPLEMENT ====================
-        # send them a request to follow
-        want_to_follow_user.from_users.append(g.user) 
-        db.session.commit()
+        try:
+            follow_requests.request_follow(g.user.id, want_to_follow_user)
+            db.session.commit()
+        except IntegrityError:
+            # The same request was sent concurrently.
+            db.session.rollback()
         flash("Your request has been sent", "success")
         return redirect(f"/users/{g.user.id}/following")
 
     g.user.following.append(want_to_follow_user)
+    remember_follow(g.user.id, want_to_follow_user.id, True)
+    followgraph.follow_added(g.user.id, want_to_follow_user.id)
+    counters.follow_added(g.user, want_to_follow_user)
+    timeline.follow_added(g.user, want_to_follow_user)
+    suggestions.follows_changed(g.user, [want_to_follow_user.id])
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
-@app.route('/users/approve/<int:made_request_id>/<int:approver_id>')
+
+@app.route('/requests')
 @authenticate
-def approve_follow(made_request_id, approver_id):
-    """Appprove a follow for the currently-logged-in user."""
+def requests_inbox():
+    """Show follow requests to the current user, newest first."""
 
-    if not g.user.id == approver_id:
-        flash("Access unauthorized.", "danger")
-        return redirect("/"), 403
+    status = request.args.get('status', FollowRequest.PENDING)
+    if status not in FollowRequest.STATUSES:
+        status = FollowRequest.PENDING
 
-    wanted_to_follow_user = User.query.get_or_404(made_request_id)
-    g.user.followers.append(wanted_to_follow_user)
-    g.user.from_users.remove(wanted_to_follow_user)
-    db.session.commit()
+    page = paginate_requests(follow_requests.inbox(g.user, status),
+                             request.args.get('cursor'))
+    return render_page('requests/index.html', 'requests/list_items.html',
+                       page, status=status)
 
-    flash(f"Follow request from {wanted_to_follow_user.username} approved.", "success")
-    return redirect(f"/users/{g.user.id}/followers")
 
-@app.route('/users/reject/<int:made_request_id>/<int:approver_id>')
+@app.route('/requests', methods=['POST'])
 @authenticate
-def reject_follow(made_request_id, approver_id):
-    """Reject a follow for the currently-logged-in user."""
-
-    if not g.user.id == approver_id:
-        flash("Access unauthorized.", "danger")
-        return redirect("/"), 403
-
-    wanted_to_follow_user = User.query.get_or_404(made_request_id)
-    g.user.from_users.remove(wanted_to_follow_user)
+def requests_decide():
+    """Approve or reject the selected follow requests, all at once."""
+
+    action = request.form.get('action')
+    if action not in ('approve', 'reject'):
+        flash("Choose to approve or reject.", "danger")
+        return redirect("/requests")
+
+    requester_ids = [int(requester_id) for requester_id
+                     in request.form.getlist('requester_id')
+                     if requester_id.isdigit()]
+    decided = follow_requests.decide(g.user.hydrate(), requester_ids,
+                                     approve=action == 'approve')
     db.session.commit()
-    flash(f"Follow request from {wanted_to_follow_user.username} rejected.", "success")
 
-    return redirect(f"/users/{g.user.id}")
+    verb = "approved" if action == 'approve' else "rejected"
+    flash(f"{len(decided)} follow request{'' if len(decided) == 1 else 's'} "
+          f"{verb}.", "success")
+    return redirect("/requests")
+
 
 @app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 @authenticate
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    followed_user = User.query.get_or_404(follow_id)
+    removed = (Follows
+               .query
+               .filter_by(user_following_id=g.user.id,
+                          user_being_followed_id=followed_user.id)
+               .delete(synchronize_session=False))
+
+    remember_follow(g.user.id, followed_user.id, False)
+
+    if removed:
+        followgraph.follow_removed(g.user.id, followed_user.id)
+        counters.follow_removed(g.user, followed_user)
+        timeline.follow_removed(g.user, followed_user)
+        suggestions.follows_changed(g.user, [followed_user.id])
+        db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -248,18 +523,24 @@ def stop_following(follow_id):
 def profile():
     """Update profile for current user."""
 
-    form = EditUserForm(obj=g.user)
+    user = g.user.hydrate()
+    form = EditUserForm(obj=user)
 
     if form.validate_on_submit():
-        if User.authenticate(g.user.username, form.password.data):
-            g.user.username = form.username.data
-            g.user.email = form.email.data
-            g.user.image_url = form.image_url.data
-            g.user.header_image_url = form.header_image_url.data
-            g.user.bio = form.bio.data
-            g.user.private = form.private.data
+        if too_many_attempts(user.username):
+            return render_template('users/edit.html', user_id=user.id,
+                                   form=form), 429
+
+        if User.authenticate(user.username, form.password.data):
+            user.username = form.username.data
+            user.email = form.email.data
+            user.image_url = form.image_url.data
+            user.header_image_url = form.header_image_url.data
+            user.bio = form.bio.data
+            user.private = form.private.data
             db.session.commit()
-            return redirect(f'/users/{g.user.id}')
+            identity.forget([user.id])
+            return redirect(f'/users/{user.id}')
         flash('Incorrect password', 'danger')
     return render_template('users/edit.html', user_id=g.user.id, form=form)
 
@@ -270,8 +551,11 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    counters.user_removed(g.user)
+    followgraph.user_removed(g.user.id)
+    db.session.delete(g.user.hydrate())
     db.session.commit()
+    identity.forget([g.user.id])
 
     return redirect("/signup")
 
@@ -280,10 +564,17 @@ def delete_user():
 def show_likes(user_id):
     """Show list of user's likes"""
 
+    user = loaders.profile(User.query).get_or_404(user_id)
+    likes = (Message
+             .query
+             .join(Like, Like.message_id == Message.id)
+             .filter(Like.user_id == user.id))
 
-    user = User.query.get_or_404(user_id)
-
-    return render_template('users/likes.html', user=user)
+    page = paginate_messages(loaders.message_cards(likes),
+                             request.args.get('cursor'))
+    return render_page('users/likes.html', 'messages/list_items.html', page,
+                       user=user,
+                       **viewer_context(messages=page.items, users=[user]))
 
 @app.route('/users/<int:user_id>/password', methods=["GET", "POST"])
 @authenticate
@@ -297,8 +588,12 @@ def change_password(user_id):
     form = ChangePasswordForm()
 
     if form.validate_on_submit():
+        if too_many_attempts(g.user.username):
+            return render_template("/users/change_pass.html", form=form), 429
+
         if g.user.validate_change_password(form.cur_pass.data, form.new_pass1.data, form.new_pass2.data):
             db.session.commit()
+            identity.forget([g.user.id])
             flash("Successfully changed password", "success")
             return redirect("/")
 
@@ -309,13 +604,52 @@ def change_password(user_id):
 # Messages routes:
 
 
+@app.route('/messages/search')
+@authenticate
+def messages_search():
+    """Search messages.
+
+    Takes 'q' (words, "a phrase", or prefix*) and 'order' ('recent', the
+    default, or 'rank') in the querystring.
+    """
+
+    query = request.args.get('q', '')
+    order = request.args.get('order', 'recent')
+    page = search.find_messages(query, g.user, order,
+                                request.args.get('cursor'))
+
+    return render_page('messages/search.html', 'messages/list_items.html',
+                       page, query=query, order=order,
+                       **viewer_context(messages=page.items))
+
+
+@app.route('/trending')
+@authenticate
+def trending_page():
+    """Show the hottest warbles and hashtags right now."""
+
+    messages = [msg for msg, _ in trending.trending_messages(g.user)]
+    return render_template('messages/trending.html',
+                           page=Page(messages, None),
+                           hashtags=trending.trending_hashtags(),
+                           **viewer_context(messages=messages))
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
 @authenticate
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = loaders.message_cards(Message.query).get_or_404(message_id)
+    context = viewer_context(messages=[msg], users=[msg.user])
+
+    not_modified = httpcache.unchanged(httpcache.cards([msg]),
+                                       context['liked_ids'],
+                                       context['following_ids'])
+    if not_modified:
+        return not_modified
+
+    return render_template('messages/show.html', message=msg, **context)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -325,11 +659,13 @@ def messages_destroy(message_id):
 
     msg = Message.query.get_or_404(message_id)
 
-    if g.user != msg.user:
+    if g.user.id != msg.user_id:
         flash("Access unauthorized.", "danger")
         return redirect("/"), 403
 
     # Bug Found added 404 Need to check if user is the author
+    counters.message_removed(msg)
+    timeline.message_deleted(msg)
     db.session.delete(msg)
     db.session.commit()
 
@@ -348,15 +684,41 @@ def messages_add():
         flash("Access unauthorized.", "danger")
         return jsonify({'result': 'fail'}), 403
 
+    queue = writebehind.get_queue()
+
     text = request.json["text"]
-    msg = Message(text=text)
-    g.user.messages.append(msg)
+    msg = Message(text=text, user_id=g.user.id)
+    db.session.add(msg)
+    timeline.message_posted(msg, fan_out=queue is None)
+    counters.message_added(msg)
     db.session.commit()
 
+    if queue is not None:
+        queue.fan_out(msg.id)
+    trending.message_posted(msg)
+    live.message_posted(msg)
+
     return jsonify({'result': 'success',
                     'msg': msg.serialize(),
                     'user': g.user.serialize()})
 
+@app.route('/api/messages/search')
+def messages_search_api():
+    """Search messages, as JSON; takes the same params as /messages/search."""
+
+    if not g.user:
+        return jsonify({'result': 'fail'}), 403
+
+    page = search.find_messages(request.args.get('q', ''), g.user,
+                                request.args.get('order', 'recent'),
+                                request.args.get('cursor'))
+
+    return jsonify({'result': 'success',
+                    'messages': [dict(msg.serialize(),
+                                      username=msg.user.username)
+                                 for msg in page.items],
+                    'next_cursor': page.next_cursor})
+
 @app.route('/api/messages/<int:message_id>/like', methods=["POST"])
 def messages_toggle_like(message_id):
     """ Like a message """
@@ -364,15 +726,35 @@ def messages_toggle_like(message_id):
     if not g.user:
         return jsonify({'result': 'fail'}), 403
 
-    msg = Message.query.get_or_404(message_id)
+    Message.query.get_or_404(message_id)
+
+    liked = message_id not in g.user.liked_message_ids([message_id])
+    queue = writebehind.get_queue()
 
-    if msg in g.user.likes:
-        g.user.likes.remove(msg)
+    changed = True
+    if queue is not None:
+        if liked:
+            queue.like(g.user.id, [message_id])
+        else:
+            queue.unlike(g.user.id, [message_id])
+    elif liked:
+        db.session.add(Like(user_id=g.user.id, message_id=message_id))
+        counters.like_added(g.user, message_id)
+        db.session.commit()
     else:
-        g.user.likes.append(msg)
-    db.session.commit()
+        # A repeated unlike may find the like already gone.
+        changed = Like.query.filter_by(user_id=g.user.id,
+                                       message_id=message_id).delete() > 0
+        if changed:
+            counters.like_removed(g.user, message_id)
+        db.session.commit()
+
+    if changed and liked:
+        trending.likes_changed(liked_ids=[message_id])
+    elif changed:
+        trending.likes_changed(unliked_ids=[message_id])
 
-    return jsonify({'result': 'success'}), 200
+    return jsonify({'result': 'success', 'liked': liked}), 200
 
 
 
@@ -385,38 +767,124 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users and logged in user
+    - logged in: most recent messages of followed_users and logged in user,
+      a page at a time
     """
 
     if g.user:
-        # wth going on here?
-        ids_to_pull_from = [fol_user.id for fol_user in g.user.following] + [g.user.id]
-        messages = (Message
-                    .query
-                    # need filter for in and like
-                    # filter_by doesn't need the object passed again
-                    .filter(Message.user_id.in_(ids_to_pull_from))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages)
+        before = message_cursor(request.args.get('cursor'))
+        messages = timeline.get_timeline(g.user, before, MESSAGES_PER_PAGE + 1)
+        page = make_page(messages, MESSAGES_PER_PAGE, message_key)
+        context = viewer_context(messages=page.items)
+
+        not_modified = httpcache.unchanged(httpcache.cards(page.items),
+                                           context['liked_ids'],
+                                           page.next_cursor)
+        if not_modified:
+            return not_modified
+
+        return render_page('home.html', 'messages/list_items.html', page,
+                           **context)
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(response):
-    """Add non-caching headers on every request."""
-
-    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
-    return response
+# Commands
+
+
+@app.cli.command('import-data')
+@click.argument('directory', default='generator')
+@click.option('--chunk-size', default=bulk.CHUNK_SIZE, show_default=True,
+              help="Rows loaded and committed at a time.")
+def import_data_command(directory, chunk_size):
+    """Load users.csv, messages.csv etc. from DIRECTORY.
+
+    Run it again after a failure to resume where it stopped. User counters,
+    message like counts and timelines are rebuilt once everything is
+    loaded.
+    """
+
+    bulk.import_data(directory, chunk_size, echo=click.echo)
+    corrected = counters.reconcile_counters()
+    click.echo(f"Corrected counters for {corrected} users.")
+    corrected = counters.reconcile_like_counts()
+    click.echo(f"Corrected like counts for {corrected} messages.")
+    timeline.rebuild_timelines()
+    click.echo("Rebuilt timelines.")
+
+
+@app.cli.command('export-data')
+@click.argument('directory')
+def export_data_command(directory):
+    """Write every table to DIRECTORY as CSV, in import-data's format."""
+
+    bulk.export_data(directory, echo=click.echo)
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines_command():
+    """Rebuild every home timeline from existing follows and messages."""
+
+    timeline.rebuild_timelines()
+
+
+@app.cli.command('apply-writes')
+def apply_writes_command():
+    """Apply every write queued by WRITE_BEHIND now."""
+
+    queue = writebehind.get_queue()
+    if queue is None:
+        click.echo("WRITE_BEHIND is off; nothing is queued.")
+        return
+    try:
+        click.echo(f"Applied {queue.drain()} queued writes.")
+    except writebehind.LeaseHeld as error:
+        raise click.ClickException(
+            f"Applied {error.applied} queued writes, then stopped: another "
+            f"process is applying them.")
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Recompute drifted message, follow and like counts."""
+
+    corrected = counters.reconcile_counters()
+    click.echo(f"Corrected counters for {corrected} users.")
+    corrected = counters.reconcile_like_counts()
+    click.echo(f"Corrected like counts for {corrected} messages.")
+
+
+@app.cli.command('rebuild-suggestions')
+@click.option('--workers', type=int, default=None,
+              help="processes to score users in (default: one per CPU)")
+def rebuild_suggestions_command(workers):
+    """Recompute every user's "who to follow" suggestions."""
+
+    suggested = suggestions.rebuild_suggestions(workers, echo=click.echo)
+    click.echo(f"{suggested} users have suggestions.")
+
+
+@app.cli.command('snapshot-follow-graph')
+@click.argument('path', required=False)
+def snapshot_follow_graph_command(path):
+    """Write the follow graph to PATH (default: FOLLOW_GRAPH_PATH) for
+    workers to map.
+    """
+
+    path = path or app.config['FOLLOW_GRAPH_PATH']
+    if not path:
+        raise click.UsageError("Give a PATH or set FOLLOW_GRAPH_PATH.")
+
+    follows = followgraph.snapshot(path)
+    click.echo(f"Wrote {follows} follows to {path}.")
+
+
+@app.cli.command('trim-timelines')
+def trim_timelines_command():
+    """Trim every home timeline back to its capped length."""
+
+    timeline.trim_timelines()
+    db.session.commit()
+
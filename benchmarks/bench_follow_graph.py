@@ -0,0 +1,148 @@
+"""Benchmark follow graph queries: the in-process index against SQL.
+
+Times the questions profile pages ask about a viewer and a profile ("does
+this user follow you?", "who follows them that you follow?" and "how many
+mutual follows do they have?") for random pairs of users, answered by a
+followgraph.GraphIndex and by the equivalent SQL against the app's database
+(DATABASE_URL_CORRECTED), and checks both give the same answers. It also
+reports how long the index takes to load from the database and, with
+--snapshot, to write and map a snapshot file.
+
+--seed first fills an empty database with a generated dataset of --users
+users (see benchmarks.bench_routes). Run from the project root like:
+
+    python -m benchmarks.bench_follow_graph --seed --users 10000 \\
+        --snapshot /tmp/warbler.graph
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+
+def percentiles(timings):
+    cuts = statistics.quantiles(timings, n=100)
+    return cuts[49], cuts[94], cuts[98]
+
+
+def run(label, func, pairs):
+    """Time `func(viewer id, user id)` over `pairs`; return its answers."""
+
+    timings = []
+    answers = []
+    for viewer_id, user_id in pairs:
+        start = time.perf_counter()
+        answers.append(func(viewer_id, user_id))
+        timings.append((time.perf_counter() - start) * 1000000)
+
+    p50, p95, p99 = percentiles(timings)
+    print(f"{label:>26}: p50 {p50:9.1f} us  p95 {p95:9.1f} us  "
+          f"p99 {p99:9.1f} us")
+    return answers
+
+
+def sql_queries(db, Follows):
+    """SQL equivalents of the index's queries, by name."""
+
+    def follows(viewer_id, user_id):
+        return db.session.query(
+            Follows.query
+            .filter_by(user_following_id=user_id,
+                       user_being_followed_id=viewer_id)
+            .exists()).scalar()
+
+    def followers_you_know(viewer_id, user_id):
+        mine = db.aliased(Follows)
+        theirs = db.aliased(Follows)
+        rows = (db.session
+                .query(mine.user_being_followed_id)
+                .join(theirs, theirs.user_following_id
+                      == mine.user_being_followed_id)
+                .filter(mine.user_following_id == viewer_id)
+                .filter(theirs.user_being_followed_id == user_id)
+                .order_by(mine.user_being_followed_id))
+        return [user_id for (user_id,) in rows]
+
+    def mutuals_count(viewer_id, user_id):
+        out = db.aliased(Follows)
+        back = db.aliased(Follows)
+        return (db.session
+                .query(db.func.count())
+                .select_from(out)
+                .join(back, db.and_(
+                    back.user_following_id == out.user_being_followed_id,
+                    back.user_being_followed_id == out.user_following_id))
+                .filter(out.user_following_id == user_id)
+                .scalar())
+
+    return {'follows you': follows,
+            'followers you know': followers_you_know,
+            'mutuals count': mutuals_count}
+
+
+def index_queries(index):
+    return {'follows you': lambda viewer_id, user_id:
+            index.follows(user_id, viewer_id),
+            'followers you know': index.followers_you_know,
+            'mutuals count': lambda viewer_id, user_id:
+            len(index.mutuals(user_id))}
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"{label:>26}: {(time.perf_counter() - start) * 1000:9.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seed', action='store_true',
+                        help="fill an empty database with generated data")
+    parser.add_argument('--users', type=int, default=1000,
+                        help="users to seed")
+    parser.add_argument('--pairs', type=int, default=1000,
+                        help="viewer and profile pairs to query")
+    parser.add_argument('--snapshot', help="also time a snapshot at this path")
+    parser.add_argument('--random-seed', type=int, default=0)
+    options = parser.parse_args()
+
+    if options.seed:
+        from benchmarks.bench_routes import seed
+        seed(options)
+
+    from app import app
+    from followgraph import FollowGraph, GraphIndex, read_snapshot, snapshot
+    from models import db, Follows, User
+
+    with app.app_context():
+        user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+        follows = db.session.query(db.func.count()).select_from(
+            Follows).scalar()
+        print(f"{len(user_ids)} users and {follows} follows in "
+              f"{db.engine.url.database}")
+
+        rng = random.Random(options.random_seed)
+        pairs = [(rng.choice(user_ids), rng.choice(user_ids))
+                 for _ in range(options.pairs)]
+
+        index = GraphIndex()
+        timed("load from database", lambda: index.load(
+            FollowGraph.from_database(),
+            FollowGraph.from_database(reverse=True)))
+        if options.snapshot:
+            timed("write snapshot", lambda: snapshot(options.snapshot))
+            timed("map snapshot", lambda: index.load(
+                *read_snapshot(options.snapshot)))
+
+        sql = sql_queries(db, Follows)
+        for name, query in index_queries(index).items():
+            expected = run(f"{name} (sql)", sql[name], pairs)
+            answers = run(f"{name} (index)", query, pairs)
+            if answers != expected:
+                raise SystemExit(f"{name}: index and SQL disagree")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Benchmark password checks (logins) per second by hashing worker count.
+
+Runs many concurrent checks through passwords.PasswordHasher, as a threaded
+gunicorn worker would, for each worker count, and prints logins/sec. It needs
+no database.
+
+Run from the project root like:
+
+    python -m benchmarks.bench_logins --workers 0 1 2 4 --logins 200
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passwords import PasswordHasher, DEFAULT_ROUNDS
+
+
+def logins_per_second(workers, logins, threads, rounds):
+    """Time `logins` concurrent password checks with `workers` processes."""
+
+    hasher = PasswordHasher(rounds=rounds, workers=workers, queue=threads)
+    hashed = hasher.hash("password")
+
+    # Warm up the pool so process start-up isn't timed.
+    hasher.check(hashed, "password")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as requests:
+        list(requests.map(lambda _: hasher.check(hashed, "password"),
+                          range(logins)))
+    return logins / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4],
+                        help="hashing process counts to try (0 = inline)")
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=16,
+                        help="concurrent requests")
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS,
+                        help="bcrypt cost factor")
+    args = parser.parse_args()
+
+    print(f"bcrypt cost {args.rounds}, {args.logins} logins, "
+          f"{args.threads} concurrent requests")
+    for workers in args.workers:
+        rate = logins_per_second(workers, args.logins, args.threads,
+                                 args.rounds)
+        print(f"{workers:>3} workers: {rate:8.1f} logins/sec")
+
+
+if __name__ == '__main__':
+    main()
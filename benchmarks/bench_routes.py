@@ -0,0 +1,329 @@
+"""Benchmark Warbler's main routes under a realistic request mix.
+
+Drives `/`, `/users`, `/users/<id>`, `/users/<id>/followers`,
+`/api/messages/new` and `/api/messages/<id>/like`, picked at random with the
+weights in MIX, as users picked at random. It reports p50/p95/p99 latency,
+throughput and SQL queries per request for each route, and can save the
+results as JSON and fail if they regressed against a saved baseline.
+
+Requests go through Flask's test client in this process by default. With
+--url they go over HTTP to a running server instead (e.g. `gunicorn
+app:app`), using sessions signed with this app's SECRET_KEY, so run both
+with the same environment; query counts then come from the Server-Timing
+header, so set METRICS_SAMPLE_RATE=1 on the server to get them for every
+request.
+
+--seed first fills an empty database (DATABASE_URL_CORRECTED) with a
+generated dataset of the given size. Run from the project root like:
+
+    python -m benchmarks.bench_routes --seed --users 10000 --requests 2000 \\
+        --output after.json --baseline before.json
+"""
+
+import argparse
+import json
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from sqlalchemy import event
+
+# Route label: (weight, method)
+MIX = {
+    '/': (40, 'GET'),
+    '/users': (10, 'GET'),
+    '/users/<id>': (20, 'GET'),
+    '/users/<id>/followers': (10, 'GET'),
+    '/api/messages/new': (10, 'POST'),
+    '/api/messages/<id>/like': (10, 'POST'),
+}
+
+DEFAULT_MAX_REGRESSION = 0.2
+# Latency changes smaller than this are noise, whatever the ratio.
+MIN_REGRESSION_MS = 2.0
+QUERY_TOLERANCE = 0.5
+
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def seed(options):
+    """Load a generated dataset into an empty database."""
+
+    from flask_migrate import upgrade
+
+    from app import app
+    from bulk import import_data
+    from counters import reconcile_counters, reconcile_like_counts
+    from models import User
+    from timeline import rebuild_timelines
+
+    with app.app_context():
+        upgrade()
+        if User.query.first() is not None:
+            raise SystemExit("--seed needs an empty database")
+
+        with tempfile.TemporaryDirectory() as out:
+            subprocess.run(
+                [sys.executable, 'generator/create_csvs.py', '--out', out,
+                 '--users', str(options.users),
+                 '--messages', str(options.users * 10),
+                 '--follows', str(options.users * 20),
+                 '--likes', str(options.users * 10),
+                 '--requests', str(options.users // 10)],
+                check=True, stdout=subprocess.DEVNULL)
+            import_data(out, echo=lambda line: None)
+
+        reconcile_counters()
+        reconcile_like_counts()
+        rebuild_timelines()
+
+
+def pick_request(rng, users, messages):
+    """Return (label, method, path, json body) for one request."""
+
+    labels = list(MIX)
+    label = rng.choices(labels, weights=[MIX[l][0] for l in labels])[0]
+    method = MIX[label][1]
+    path = (label.replace('<id>', str(rng.randint(1, messages)))
+            if 'messages' in label
+            else label.replace('<id>', str(rng.randint(1, users))))
+    body = ({'text': f"benchmark warble {rng.random():.6f}"}
+            if label == '/api/messages/new' else None)
+    return label, method, path, body
+
+
+class TestClientDriver:
+    """Sends requests through the Flask test client, counting queries."""
+
+    def __init__(self):
+        from app import app, db, CURR_USER_KEY
+
+        self.app = app
+        self.db = db
+        self.session_key = CURR_USER_KEY
+        self.client = app.test_client()
+        self.queries = 0
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.queries += 1
+
+    def send(self, user_id, method, path, body):
+        with self.client.session_transaction() as sess:
+            sess[self.session_key] = user_id
+
+        self.queries = 0
+        start = time.perf_counter()
+        resp = self.client.open(path, method=method, json=body)
+        elapsed = time.perf_counter() - start
+        return resp.status_code, elapsed, self.queries
+
+
+class HTTPDriver:
+    """Sends requests over HTTP to a running server."""
+
+    def __init__(self, url):
+        from app import app, CURR_USER_KEY
+
+        self.url = url.rstrip('/')
+        self.cookie_name = app.session_cookie_name
+        self.serializer = app.session_interface.get_signing_serializer(app)
+        self.session_key = CURR_USER_KEY
+
+    def send(self, user_id, method, path, body):
+        cookie = self.serializer.dumps({self.session_key: user_id})
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(
+            self.url + path, data=data, method=method,
+            headers={'Cookie': f"{self.cookie_name}={cookie}",
+                     'Content-Type': 'application/json'})
+
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as resp:
+                resp.read()
+                status, headers = resp.status, resp.headers
+        except urllib.error.HTTPError as error:
+            status, headers = error.code, error.headers
+        elapsed = time.perf_counter() - start
+
+        match = SERVER_TIMING_QUERIES.search(headers.get('Server-Timing', ''))
+        return status, elapsed, int(match.group(1)) if match else None
+
+
+def percentile(values, pct):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[pct - 1]
+
+
+def summarize(samples, elapsed):
+    """Summarize [(latency secs, queries, ok)] for one route or overall."""
+
+    latencies = [latency * 1000 for latency, _, _ in samples]
+    queries = [count for _, count, _ in samples if count is not None]
+    return {
+        'count': len(samples),
+        'errors': sum(1 for _, _, ok in samples if not ok),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        'queries_per_request': (round(statistics.fmean(queries), 2)
+                                if queries else None),
+    }
+
+
+def run(driver, options):
+    """Send options.requests requests; return the results dict."""
+
+    rng = random.Random(options.random_seed)
+    plan = [(rng.randint(1, options.users),
+             *pick_request(rng, options.users, options.messages))
+            for _ in range(options.requests)]
+
+    samples = defaultdict(list)
+    lock = threading.Lock()
+
+    def send(item):
+        user_id, label, method, path, body = item
+        status, latency, queries = driver.send(user_id, method, path, body)
+        with lock:
+            samples[label].append((latency, queries, status < 400))
+
+    start = time.perf_counter()
+    if options.threads > 1:
+        with ThreadPoolExecutor(max_workers=options.threads) as pool:
+            list(pool.map(send, plan))
+    else:
+        for item in plan:
+            send(item)
+    elapsed = time.perf_counter() - start
+
+    every = [sample for route in samples.values() for sample in route]
+    return {
+        'meta': {
+            'started': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'target': options.url or 'test-client',
+            'requests': options.requests,
+            'threads': options.threads,
+            'users': options.users,
+            'messages': options.messages,
+            'mix': {label: weight for label, (weight, _) in MIX.items()},
+        },
+        'routes': {label: summarize(samples[label], elapsed)
+                   for label in MIX if samples[label]},
+        'overall': summarize(every, elapsed),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, max_regression=DEFAULT_MAX_REGRESSION):
+    """Return descriptions of routes that got slower or run more queries."""
+
+    problems = []
+    for label, now in current['routes'].items():
+        before = baseline['routes'].get(label)
+        if before is None:
+            continue
+
+        for stat in ('p50_ms', 'p95_ms'):
+            limit = max(before[stat] * (1 + max_regression),
+                        before[stat] + MIN_REGRESSION_MS)
+            if now[stat] > limit:
+                problems.append(f"{label}: {stat} {before[stat]} -> "
+                                f"{now[stat]}")
+
+        if (now['queries_per_request'] is not None
+                and before['queries_per_request'] is not None
+                and now['queries_per_request']
+                > before['queries_per_request'] + QUERY_TOLERANCE):
+            problems.append(f"{label}: queries/request "
+                            f"{before['queries_per_request']} -> "
+                            f"{now['queries_per_request']}")
+
+        if now['errors'] > before['errors']:
+            problems.append(f"{label}: errors {before['errors']} -> "
+                            f"{now['errors']}")
+    return problems
+
+
+def print_results(results):
+    print(f"{'route':<26}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'req/s':>9}{'queries':>9}{'errors':>8}")
+    rows = list(results['routes'].items()) + [('overall', results['overall'])]
+    for label, stats in rows:
+        queries = stats['queries_per_request']
+        print(f"{label:<26}{stats['count']:>7}{stats['p50_ms']:>9.2f}"
+              f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}"
+              f"{stats['throughput_rps'] or 0:>9.1f}"
+              f"{'-' if queries is None else queries:>9}"
+              f"{stats['errors']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seed', action='store_true',
+                        help="fill an empty database with generated data")
+    parser.add_argument('--users', type=int, default=1000,
+                        help="users to seed and to pick from")
+    parser.add_argument('--messages', type=int,
+                        help="messages to pick from (default users * 10)")
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=1,
+                        help="concurrent requests (with --url)")
+    parser.add_argument('--url', help="base URL of a running server")
+    parser.add_argument('--random-seed', type=int, default=0)
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--baseline', help="JSON results to compare with")
+    parser.add_argument('--max-regression', type=float,
+                        default=DEFAULT_MAX_REGRESSION,
+                        help="allowed latency increase, as a fraction")
+    options = parser.parse_args()
+    options.messages = options.messages or options.users * 10
+
+    if options.seed:
+        seed(options)
+
+    if options.url:
+        driver = HTTPDriver(options.url)
+    else:
+        options.threads = 1
+        driver = TestClientDriver()
+
+    results = run(driver, options)
+    print_results(results)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            problems = compare(json.load(f), results, options.max_regression)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Benchmark user search and autocomplete latency.
+
+With `--backend memory` (the default) it indexes `--users` synthetic users in
+a search.MemoryUserIndex and needs no database. With `--backend database` it
+times the SQL search against the app's database (DATABASE_URL_CORRECTED),
+which should be PostgreSQL; `--seed` first fills an empty database with
+`--users` synthetic users.
+
+Run from the project root like:
+
+    python -m benchmarks.bench_user_search --users 1000000
+    python -m benchmarks.bench_user_search --backend database --seed
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+WORDS = ("bird", "robin", "crow", "sparrow", "finch", "hawk", "owl", "wren",
+         "lark", "swift", "heron", "jay", "raven", "tern", "kite", "dove")
+PLACES = ("Oakland", "Berkeley", "Austin", "Denver", "Boston", "Portland",
+          "Chicago", "Seattle", "Miami", "Phoenix")
+
+
+def synthetic_users(count, seed=0):
+    """Yield (id, username, bio, location) rows for `count` users."""
+
+    rng = random.Random(seed)
+    for user_id in range(1, count + 1):
+        name = f"{rng.choice(WORDS)}{rng.choice(WORDS)}{user_id}"
+        bio = " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 8)))
+        yield user_id, name, bio, rng.choice(PLACES)
+
+
+def queries(count, seed=1):
+    """Return a mix of short, word and place queries."""
+
+    rng = random.Random(seed)
+    choices = [lambda: rng.choice(WORDS)[:2],
+               lambda: rng.choice(WORDS),
+               lambda: rng.choice(WORDS) + rng.choice(WORDS),
+               lambda: rng.choice(PLACES).lower(),
+               lambda: str(rng.randint(1, 99999))]
+    return [rng.choice(choices)() for _ in range(count)]
+
+
+def percentiles(timings):
+    cuts = statistics.quantiles(timings, n=100)
+    return cuts[49], cuts[94], cuts[98]
+
+
+def run(label, func, qs):
+    timings = []
+    for q in qs:
+        start = time.perf_counter()
+        func(q)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    p50, p95, p99 = percentiles(timings)
+    print(f"{label:>14}: p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  "
+          f"p99 {p99:7.2f} ms")
+
+
+def run_all(index, qs, limit):
+    run("search", lambda q: index.search(q, limit), qs)
+    run("autocomplete", lambda q: index.autocomplete(q[:3]), qs)
+
+
+def seed_database(db, count):
+    """Insert `count` synthetic users into an empty users table."""
+
+    from models import User
+
+    if User.query.first() is not None:
+        raise SystemExit("--seed needs an empty users table")
+
+    batch = []
+    for user_id, name, bio, location in synthetic_users(count):
+        batch.append({'id': user_id, 'username': name, 'bio': bio,
+                      'location': location, 'email': f"{name}@test.com",
+                      'password': "x"})
+        if len(batch) == 10000:
+            db.session.bulk_insert_mappings(User, batch)
+            batch = []
+    db.session.bulk_insert_mappings(User, batch)
+    db.session.commit()
+    db.session.execute("ANALYZE users")
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['memory', 'database'],
+                        default='memory')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--seed', action='store_true',
+                        help="fill an empty database with synthetic users")
+    args = parser.parse_args()
+
+    from search import (DatabaseUserIndex, MemoryUserIndex, SEARCH_LIMIT,
+                        normalize)
+
+    qs = [normalize(q) for q in queries(args.queries)]
+
+    if args.backend == 'memory':
+        index = MemoryUserIndex()
+        start = time.perf_counter()
+        index.load(synthetic_users(args.users))
+        print(f"indexed {args.users} users in "
+              f"{time.perf_counter() - start:.1f}s")
+        run_all(index, qs, SEARCH_LIMIT)
+    else:
+        from app import app, db
+        from models import User
+        with app.app_context():
+            if args.seed:
+                seed_database(db, args.users)
+            count = db.session.query(db.func.count(User.id)).scalar()
+            print(f"{count} users in {db.engine.url.database}")
+            run_all(DatabaseUserIndex(), qs, SEARCH_LIMIT)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""Bulk import and export of Warbler data as CSV files.
+
+`import_data()` loads a directory of CSVs named after their tables
+(users.csv, messages.csv, follows.csv, likes.csv, requests.csv), each with
+a header row naming its columns. Files are streamed in chunks of
+CHUNK_SIZE rows, through COPY on PostgreSQL and batched INSERTs elsewhere,
+so memory use doesn't grow with the file.
+
+Secondary indexes and foreign keys on the loaded tables are dropped before
+loading and recreated afterwards, then id sequences are moved past the
+loaded ids. Progress is recorded in an `import_checkpoints` table in the
+same transaction as each chunk, so an import that fails part way resumes
+where it stopped when run again (with the same files), and the dropped
+indexes and keys are still recreated at the end.
+
+`export_data()` writes every table back out in the same format.
+"""
+
+import csv
+import io
+import os
+import time
+from itertools import islice
+
+from models import db
+
+CHUNK_SIZE = 50000
+
+# Parents before children, so foreign keys hold as each table loads.
+TABLES = ('users', 'messages', 'follows', 'likes', 'requests')
+
+SEQUENCE_TABLES = ('users', 'messages', 'requests')
+
+checkpoints = db.Table(
+    'import_checkpoints',
+    db.MetaData(),
+    db.Column('name', db.Text, primary_key=True),
+    db.Column('position', db.BigInteger, nullable=False),
+    db.Column('statement', db.Text),
+)
+
+
+def _is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def _table(name):
+    return db.metadata.tables[name]
+
+
+def deferrable_ddl(tables):
+    """Return [(drop, create)] DDL for secondary indexes and foreign keys.
+
+    Indexes backing primary keys and unique constraints are kept.
+    """
+
+    statements = []
+
+    if _is_postgres():
+        for table in tables:
+            indexes = db.session.execute(
+                """SELECT indexname, indexdef FROM pg_indexes
+                   WHERE schemaname = current_schema() AND tablename = :table
+                   AND indexname NOT IN (SELECT conname FROM pg_constraint)""",
+                {'table': table})
+            statements.extend((f'DROP INDEX "{name}"', create)
+                              for name, create in indexes)
+
+        for table in tables:
+            keys = db.session.execute(
+                """SELECT conname, pg_get_constraintdef(oid)
+                   FROM pg_constraint
+                   WHERE conrelid = CAST(:table AS regclass)
+                   AND contype = 'f'""",
+                {'table': table})
+            statements.extend(
+                (f'ALTER TABLE {table} DROP CONSTRAINT "{name}"',
+                 f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}')
+                for name, definition in keys)
+
+    elif db.engine.dialect.name == 'sqlite':
+        # SQLite doesn't enforce foreign keys by default; just indexes.
+        for table in tables:
+            indexes = db.session.execute(
+                """SELECT name, sql FROM sqlite_master
+                   WHERE type = 'index' AND tbl_name = :table
+                   AND sql IS NOT NULL""",
+                {'table': table})
+            statements.extend((f'DROP INDEX "{name}"', create)
+                              for name, create in indexes)
+
+    return statements
+
+
+def _chunks(rows, size):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _copy_rows(table, columns, rows):
+    """Load `rows` with COPY, in the session's transaction (PostgreSQL)."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer)
+
+
+def _insert_rows(table, columns, rows):
+    """Load `rows` with one batched INSERT."""
+
+    types = [_table(table).c[column].type for column in columns]
+
+    def convert(value, type_):
+        if value == '':
+            return None
+        if isinstance(type_, db.Boolean):
+            return value.lower() in ('t', 'true', '1')
+        return value
+
+    placeholders = ', '.join('?' for _ in columns)
+    db.session.connection().exec_driver_sql(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+        [tuple(convert(value, type_) for value, type_ in zip(row, types))
+         for row in rows])
+
+
+def _load_file(table, path, done, chunk_size, echo):
+    """Load `path` into `table`, skipping the `done` rows already loaded."""
+
+    load = _copy_rows if _is_postgres() else _insert_rows
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader)
+        unknown = set(columns) - set(_table(table).c.keys())
+        if unknown:
+            raise ValueError(f"{path}: unknown columns {sorted(unknown)}")
+
+        if done:
+            echo(f"{table}: resuming after {done} rows")
+            for _ in islice(reader, done):
+                pass
+
+        loaded = 0
+        start = time.perf_counter()
+        for chunk in _chunks(reader, chunk_size):
+            load(table, columns, chunk)
+            loaded += len(chunk)
+            db.session.execute(
+                checkpoints.update()
+                .where(checkpoints.c.name == table)
+                .values(position=done + loaded))
+            db.session.commit()
+
+    elapsed = time.perf_counter() - start
+    rate = loaded / elapsed if elapsed else 0
+    echo(f"{table}: {loaded} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)")
+    return loaded
+
+
+def reset_sequences():
+    """Move id sequences past the highest loaded id (PostgreSQL)."""
+
+    if not _is_postgres():
+        return
+
+    for table in SEQUENCE_TABLES:
+        db.session.execute(
+            f"""SELECT setval(pg_get_serial_sequence('{table}', 'id'),
+                              COALESCE(MAX(id), 0) + 1, false)
+                FROM {table}""")
+
+
+def import_data(directory, chunk_size=CHUNK_SIZE, echo=print):
+    """Load the CSVs in `directory`, resuming an interrupted import.
+
+    Returns the number of rows loaded.
+    """
+
+    tables = [table for table in TABLES
+              if os.path.exists(os.path.join(directory, f'{table}.csv'))]
+
+    bind = db.session.connection()
+    resuming = bind.dialect.has_table(bind, checkpoints.name)
+
+    if not resuming:
+        checkpoints.create(bind)
+        ddl = deferrable_ddl(tables)
+        for drop, _ in ddl:
+            db.session.execute(drop)
+        db.session.execute(checkpoints.insert(), [
+            {'name': f'restore:{i:04}', 'position': i, 'statement': create}
+            for i, (_, create) in enumerate(ddl)
+        ] + [{'name': table, 'position': 0, 'statement': None}
+             for table in tables])
+        db.session.commit()
+        echo(f"Deferred {len(ddl)} indexes and foreign keys")
+
+    done = dict(db.session.execute(
+        db.select([checkpoints.c.name, checkpoints.c.position])
+        .where(checkpoints.c.statement.is_(None))).fetchall())
+
+    start = time.perf_counter()
+    total = 0
+    for table in tables:
+        total += _load_file(table, os.path.join(directory, f'{table}.csv'),
+                            done.get(table, 0), chunk_size, echo)
+
+    restores = db.session.execute(
+        db.select([checkpoints.c.name, checkpoints.c.statement])
+        .where(checkpoints.c.statement.isnot(None))
+        .order_by(checkpoints.c.position)).fetchall()
+    for name, statement in restores:
+        db.session.execute(statement)
+        db.session.execute(
+            checkpoints.delete().where(checkpoints.c.name == name))
+        db.session.commit()
+
+    reset_sequences()
+    checkpoints.drop(db.session.connection())
+    db.session.commit()
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed else 0
+    echo(f"Loaded {total} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)")
+    return total
+
+
+def _export_table(table, path):
+    columns = list(_table(table).c.keys())
+
+    with open(path, 'w', newline='') as f:
+        if _is_postgres():
+            cursor = db.session.connection().connection.cursor()
+            cursor.copy_expert(
+                f"COPY (SELECT {', '.join(columns)} FROM {table} "
+                f"ORDER BY {', '.join(_table(table).primary_key.columns.keys())}) "
+                f"TO STDOUT WITH (FORMAT csv, HEADER)", f)
+            return cursor.rowcount
+
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        result = (db.session.connection()
+                  .execution_options(stream_results=True)
+                  .execute(db.select([_table(table)])
+                           .order_by(*_table(table).primary_key.columns)))
+        rows = 0
+        for chunk in iter(lambda: result.fetchmany(CHUNK_SIZE), []):
+            writer.writerows(chunk)
+            rows += len(chunk)
+        return rows
+
+
+def export_data(directory, echo=print):
+    """Write each table to `directory` as CSV. Returns the rows written."""
+
+    os.makedirs(directory, exist_ok=True)
+    total = 0
+    for table in TABLES:
+        start = time.perf_counter()
+        rows = _export_table(table, os.path.join(directory, f'{table}.csv'))
+        elapsed = time.perf_counter() - start
+        echo(f"{table}: {rows} rows in {elapsed:.1f}s")
+        total += rows
+    db.session.commit()
+    return total
@@ -0,0 +1,215 @@
+"""Denormalized per-user and per-message counters.
+
+`User.messages_count`, `following_count`, `followers_count`, `likes_count`
+and `pending_requests_count`, and `Message.like_count`, are kept up to date
+by the routes that change the underlying rows, using relative UPDATEs in the
+same transaction so concurrent requests can't lose increments.
+`reconcile_counters()` and `reconcile_like_counts()` recompute them from the
+source tables.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import identity
+from models import db, User, Message, Follows, FollowRequest, Like
+
+RECONCILE_BATCH_SIZE = 10000
+
+FORGET_KEY = 'counters_forget'
+
+
+def adjust(user_ids, column, delta):
+    """Add `delta` to `column` for `user_ids` (a list or select of ids).
+
+    Cached identities are dropped for a list of ids once the transaction
+    commits, so other requests can't cache the old counts again in the
+    meantime; for a select they are left to expire.
+    """
+
+    (User
+        .query
+        .filter(User.id.in_(user_ids))
+        .update({column: column + delta}, synchronize_session=False))
+
+    if isinstance(user_ids, list):
+        db.session.info.setdefault(FORGET_KEY, set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_identities(session):
+    user_ids = session.info.pop(FORGET_KEY, None)
+    if user_ids:
+        identity.forget(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_identities(session):
+    session.info.pop(FORGET_KEY, None)
+
+
+def adjust_like_counts(message_ids, delta):
+    """Add `delta` to `Message.like_count` for `message_ids`."""
+
+    (Message
+        .query
+        .filter(Message.id.in_(message_ids))
+        .update({Message.like_count: Message.like_count + delta},
+                synchronize_session=False))
+
+
+def message_added(msg):
+    adjust([msg.user_id], User.messages_count, 1)
+
+
+def message_removed(msg):
+    """Update counts for a message about to be deleted, and its likes."""
+
+    adjust([msg.user_id], User.messages_count, -1)
+    adjust(db.select([Like.user_id]).where(Like.message_id == msg.id),
+           User.likes_count, -1)
+
+
+def follow_added(follower, followed):
+    adjust([follower.id], User.following_count, 1)
+    adjust([followed.id], User.followers_count, 1)
+
+
+def followers_added(follower_ids, followed):
+    adjust(follower_ids, User.following_count, 1)
+    adjust([followed.id], User.followers_count, len(follower_ids))
+
+
+def follow_removed(follower, followed):
+    adjust([follower.id], User.following_count, -1)
+    adjust([followed.id], User.followers_count, -1)
+
+
+def request_added(user):
+    adjust([user.id], User.pending_requests_count, 1)
+
+
+def requests_decided(user, count):
+    adjust([user.id], User.pending_requests_count, -count)
+
+
+def like_added(user, message_id):
+    adjust([user.id], User.likes_count, 1)
+    adjust_like_counts([message_id], 1)
+
+
+def like_removed(user, message_id):
+    adjust([user.id], User.likes_count, -1)
+    adjust_like_counts([message_id], -1)
+
+
+def user_removed(user):
+    """Update other users' counts for a user about to be deleted."""
+
+    adjust_like_counts(db.select([Like.message_id])
+                       .where(Like.user_id == user.id), -1)
+    adjust(db.select([FollowRequest.from_id])
+           .where(FollowRequest.to_id == user.id)
+           .where(FollowRequest.status == FollowRequest.PENDING),
+           User.pending_requests_count, -1)
+    adjust(db.select([Follows.user_following_id])
+           .where(Follows.user_being_followed_id == user.id),
+           User.following_count, -1)
+    adjust(db.select([Follows.user_being_followed_id])
+           .where(Follows.user_following_id == user.id),
+           User.followers_count, -1)
+
+    likes_on_their_messages = (db.select([db.func.count(Like.message_id)])
+                               .join_from(Like, Message,
+                                          Message.id == Like.message_id)
+                               .where(Message.user_id == user.id)
+                               .where(Like.user_id == User.id)
+                               .scalar_subquery())
+    (User
+        .query
+        .filter(User.id != user.id)
+        .filter(User.id.in_(db.select([Like.user_id])
+                            .join_from(Like, Message,
+                                       Message.id == Like.message_id)
+                            .where(Message.user_id == user.id)))
+        .update({User.likes_count: User.likes_count - likes_on_their_messages},
+                synchronize_session=False))
+
+
+def expected_counts():
+    """Return {column: correlated subquery computing its true value}."""
+
+    def count(column, condition):
+        return (db.select([db.func.count(column)])
+                .where(condition)
+                .scalar_subquery())
+
+    return {
+        User.messages_count:
+            count(Message.id, Message.user_id == User.id),
+        User.following_count:
+            count(Follows.user_being_followed_id,
+                  Follows.user_following_id == User.id),
+        User.followers_count:
+            count(Follows.user_following_id,
+                  Follows.user_being_followed_id == User.id),
+        User.likes_count:
+            count(Like.message_id, Like.user_id == User.id),
+        User.pending_requests_count:
+            count(FollowRequest.id,
+                  db.and_(FollowRequest.from_id == User.id,
+                          FollowRequest.status == FollowRequest.PENDING)),
+    }
+
+
+def reconcile_counters():
+    """Recompute every user's counters from the source tables.
+
+    Works through users in id ranges of RECONCILE_BATCH_SIZE, committing
+    after each, and only rewrites rows that have drifted. Returns the number
+    of users corrected.
+    """
+
+    expected = expected_counts()
+    drifted = db.or_(*(column != value for column, value in expected.items()))
+
+    max_id = db.session.query(db.func.max(User.id)).scalar() or 0
+    corrected = 0
+
+    for start in range(0, max_id + 1, RECONCILE_BATCH_SIZE):
+        corrected += (User
+                      .query
+                      .filter(User.id >= start)
+                      .filter(User.id < start + RECONCILE_BATCH_SIZE)
+                      .filter(drifted)
+                      .update(expected, synchronize_session=False))
+        db.session.commit()
+
+    return corrected
+
+
+def reconcile_like_counts():
+    """Recompute every message's like count from the likes table.
+
+    Works in id ranges like `reconcile_counters()`; returns the number of
+    messages corrected.
+    """
+
+    expected = (db.select([db.func.count(Like.user_id)])
+                .where(Like.message_id == Message.id)
+                .scalar_subquery())
+
+    max_id = db.session.query(db.func.max(Message.id)).scalar() or 0
+    corrected = 0
+
+    for start in range(0, max_id + 1, RECONCILE_BATCH_SIZE):
+        corrected += (Message
+                      .query
+                      .filter(Message.id >= start)
+                      .filter(Message.id < start + RECONCILE_BATCH_SIZE)
+                      .filter(Message.like_count != expected)
+                      .update({Message.like_count: expected},
+                              synchronize_session=False))
+        db.session.commit()
+
+    return corrected
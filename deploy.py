@@ -0,0 +1,194 @@
+"""Database connection pooling for gunicorn deployments.
+
+`engine_options()` builds SQLALCHEMY_ENGINE_OPTIONS from the environment.
+By default each process gets a pool sized to how many requests it serves
+at once, which depends on the gunicorn worker class (see gunicorn.conf.py):
+
+- `sync`: one request per process, so one connection
+- `gthread` (the default): GUNICORN_THREADS requests per process
+- `gevent`: up to GUNICORN_WORKER_CONNECTIONS requests per process, far more
+  than the database should see, so the pool (DB_POOL_SIZE, default 10) is
+  what limits them; the rest wait up to DB_POOL_TIMEOUT for a connection
+
+plus one for the write-behind thread when WRITE_BEHIND is on. Across the
+deployment that's WEB_CONCURRENCY * (pool size + DB_MAX_OVERFLOW)
+connections, which must fit in Postgres' max_connections (or PgBouncer's
+max_client_conn).
+
+With PGBOUNCER=1 the app is behind PgBouncer in transaction pooling mode,
+where consecutive transactions may run on different server connections.
+Nothing session-level may be set then, so DB_STATEMENT_TIMEOUT is applied
+with `SET LOCAL` at the start of each transaction instead of as a
+connection option. (psycopg2 doesn't use server-side prepared statements,
+and the app takes no advisory locks and uses no LISTEN, so nothing else
+depends on keeping a server connection.) Run migrations against Postgres
+directly or through a session-mode pool.
+
+Pools are `TimedQueuePool`s, which count checkouts, time spent waiting for
+them and timeouts; `/metrics` reports those with the pool's size and
+overflow.
+"""
+
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+DEFAULT_WORKER_CLASS = 'gthread'
+DEFAULT_THREADS = 4
+DEFAULT_WORKER_CONNECTIONS = 100
+DEFAULT_GEVENT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 2
+DEFAULT_POOL_TIMEOUT = 10
+DEFAULT_POOL_RECYCLE = 1800
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            # Includes opening a new connection when the pool has none idle.
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds += waited
+                if timed_out:
+                    self.timeouts += 1
+
+
+def _int(environ, name, default):
+    return int(environ.get(name) or default)
+
+
+def worker_class(environ=os.environ):
+    return environ.get('GUNICORN_WORKER_CLASS') or DEFAULT_WORKER_CLASS
+
+
+def worker_concurrency(environ=os.environ):
+    """How many requests one gunicorn worker process serves at once."""
+
+    kind = worker_class(environ)
+    if kind == 'gevent':
+        return _int(environ, 'GUNICORN_WORKER_CONNECTIONS',
+                    DEFAULT_WORKER_CONNECTIONS)
+    if kind == 'gthread':
+        return _int(environ, 'GUNICORN_THREADS', DEFAULT_THREADS)
+    return 1
+
+
+def default_pool_size(environ=os.environ):
+    if worker_class(environ) == 'gevent':
+        size = DEFAULT_GEVENT_POOL_SIZE
+    else:
+        size = worker_concurrency(environ)
+    if environ.get('WRITE_BEHIND') == '1':
+        size += 1
+    return size
+
+
+def engine_options(url, environ=os.environ):
+    """SQLALCHEMY_ENGINE_OPTIONS for the database at `url`."""
+
+    if url.startswith('sqlite'):
+        # SQLite's own pools; none of this applies.
+        return {}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': _int(environ, 'DB_POOL_SIZE',
+                          default_pool_size(environ)),
+        'max_overflow': _int(environ, 'DB_MAX_OVERFLOW',
+                             DEFAULT_MAX_OVERFLOW),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT')
+                              or DEFAULT_POOL_TIMEOUT),
+        'pool_recycle': _int(environ, 'DB_POOL_RECYCLE',
+                             DEFAULT_POOL_RECYCLE),
+        'pool_pre_ping': environ.get('DB_POOL_PRE_PING', '1') == '1',
+    }
+
+    timeout = environ.get('DB_STATEMENT_TIMEOUT')
+    if timeout and environ.get('PGBOUNCER') != '1':
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={int(timeout)}'}
+    return options
+
+
+def _set_local_timeout(timeout):
+    def begin(conn):
+        # psycopg2 opens the transaction with this statement, so it lasts
+        # exactly as long as the transaction does.
+        cursor = conn.connection.cursor()
+        cursor.execute('SET LOCAL statement_timeout = %s', (timeout,))
+        cursor.close()
+    return begin
+
+
+def init_app(app, environ=os.environ):
+    """Apply per-transaction settings and report pool metrics for `app`."""
+
+    # Imported here so gunicorn.conf.py can size workers without loading
+    # the app into gunicorn's master process.
+    from metrics import metrics
+    from models import db
+
+    timeout = environ.get('DB_STATEMENT_TIMEOUT')
+    if (timeout and environ.get('PGBOUNCER') == '1'
+            and not app.config['SQLALCHEMY_DATABASE_URI'].startswith(
+                'sqlite')):
+        event.listen(db.get_engine(app), 'begin',
+                     _set_local_timeout(int(timeout)))
+
+    def collect():
+        return pool_metrics(db.get_engine(app).pool)
+
+    metrics.add_collector(collect)
+
+
+def _number(value):
+    return str(value) if isinstance(value, int) else f'{value:.6f}'
+
+
+def pool_metrics(pool):
+    """Prometheus lines describing `pool`."""
+
+    if not isinstance(pool, TimedQueuePool):
+        return []
+
+    lines = []
+    for name, kind, help_text, value in (
+            ('db_pool_size', 'gauge',
+             'Connections the pool keeps open.', pool.size()),
+            ('db_pool_checked_out', 'gauge',
+             'Connections in use.', pool.checkedout()),
+            ('db_pool_overflow', 'gauge',
+             'Connections open beyond the pool size.',
+             max(pool.overflow(), 0)),
+            ('db_pool_checkouts_total', 'counter',
+             'Connections checked out.', pool.checkouts),
+            ('db_pool_wait_seconds_total', 'counter',
+             'Time spent waiting to check out a connection.',
+             pool.wait_seconds),
+            ('db_pool_timeouts_total', 'counter',
+             'Checkouts that gave up after DB_POOL_TIMEOUT.',
+             pool.timeouts)):
+        lines += [f'# HELP warbler_{name} {help_text}',
+                  f'# TYPE warbler_{name} {kind}',
+                  f'warbler_{name} {_number(value)}']
+    return lines
@@ -0,0 +1,108 @@
+"""Requests to follow private accounts.
+
+Requests are stored against the user being asked (`FollowRequest.from_id`),
+with the requester in `to_id`, and keep their status and timestamps once
+decided, so the inbox at /requests can list approved and rejected ones too.
+Asking again after a rejection reopens the same request.
+
+Users' pending counts are kept in `User.pending_requests_count` (see
+counters.py), so the badge in the nav bar comes from the cached identity
+instead of a query. Approving or rejecting a batch of requests is one
+transaction, with one statement per table rather than one per request.
+"""
+
+from datetime import datetime
+
+import counters
+import followgraph
+from models import db, remember_follow, Follows, FollowRequest, User
+import suggestions
+import timeline
+
+MAX_DECISIONS = 500
+
+
+def request_follow(requester_id, user):
+    """Ask `user` to let `requester_id` follow them.
+
+    Returns False if a request is already pending.
+    """
+
+    existing = (FollowRequest
+                .query
+                .filter_by(from_id=user.id, to_id=requester_id)
+                .first())
+    if existing is None:
+        db.session.add(FollowRequest(from_id=user.id, to_id=requester_id))
+    elif existing.status == FollowRequest.PENDING:
+        return False
+    else:
+        existing.status = FollowRequest.PENDING
+        existing.created_at = datetime.utcnow()
+        existing.decided_at = None
+
+    counters.request_added(user)
+    return True
+
+
+def inbox(user, status=FollowRequest.PENDING):
+    """Query of (FollowRequest, requester) pairs for `user` with `status`."""
+
+    return (db.session
+            .query(FollowRequest, User)
+            .join(User, User.id == FollowRequest.to_id)
+            .filter(FollowRequest.from_id == user.id)
+            .filter(FollowRequest.status == status))
+
+
+def decide(user, requester_ids, approve):
+    """Approve or reject `user`'s pending requests from `requester_ids`.
+
+    `user` must be a full User, not the cached identity. Ids without a
+    pending request are skipped. Returns the ids decided.
+    """
+
+    requester_ids = list(requester_ids)[:MAX_DECISIONS]
+    if not requester_ids:
+        return []
+
+    pending = (db.session
+               .query(FollowRequest.to_id)
+               .filter(FollowRequest.from_id == user.id)
+               .filter(FollowRequest.to_id.in_(requester_ids))
+               .filter(FollowRequest.status == FollowRequest.PENDING)
+               .with_for_update())
+    decided = [requester_id for (requester_id,) in pending]
+    if not decided:
+        return []
+
+    (FollowRequest
+        .query
+        .filter(FollowRequest.from_id == user.id)
+        .filter(FollowRequest.to_id.in_(decided))
+        .update({FollowRequest.status: (FollowRequest.APPROVED if approve
+                                        else FollowRequest.REJECTED),
+                 FollowRequest.decided_at: datetime.utcnow()},
+                synchronize_session=False))
+    counters.requests_decided(user, len(decided))
+
+    if approve:
+        following = {follower_id for (follower_id,) in
+                     db.session.query(Follows.user_following_id)
+                     .filter(Follows.user_being_followed_id == user.id)
+                     .filter(Follows.user_following_id.in_(decided))}
+        followers = [requester_id for requester_id in decided
+                     if requester_id not in following]
+        if followers:
+            db.session.execute(Follows.__table__.insert(), [
+                {'user_following_id': follower_id,
+                 'user_being_followed_id': user.id}
+                for follower_id in followers])
+            for follower_id in followers:
+                remember_follow(follower_id, user.id, True)
+            followgraph.followers_added(followers, user.id)
+            counters.followers_added(followers, user)
+            timeline.followers_added(followers, user)
+            suggestions.drop(followers, user.id)
+
+    return decided
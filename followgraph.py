@@ -0,0 +1,401 @@
+"""Compact, array-backed copies of the follow graph.
+
+`FollowGraph` holds who each user follows in compressed sparse row (CSR)
+form: two flat integer arrays, `targets` holding every followed id grouped
+by follower and sorted within each group, and `offsets`, indexed by user
+id, saying where each follower's group starts. A user's follows are then
+one slice, and the whole graph costs about 4 bytes per follow plus 4 per
+user, instead of a Python object per edge.
+
+`GraphIndex` keeps one of these per direction (who users follow and who
+follows them) in each worker and answers the questions profile pages ask,
+like "does this user follow you?" and "who follows them that you follow?",
+by bisecting and intersecting sorted arrays instead of querying.
+
+A background thread in each worker loads it from a snapshot file
+(FOLLOW_GRAPH_PATH, written by `flask snapshot-follow-graph`) if there is
+one, else from the follows table, so requests only ever read an index
+that's already built; until the first load finishes, profile pages go
+without the hints. Snapshots are memory-mapped rather than read, so workers
+on one machine share a single copy in the page cache and load one in
+milliseconds. Follows made through this process are applied to its index
+when their transaction commits, via the hooks at the bottom of this module.
+Changes made by other workers are picked up when the thread reloads the
+index: when the snapshot file is replaced (checked every
+FOLLOW_GRAPH_MAX_AGE seconds), or, without a snapshot, every
+FOLLOW_GRAPH_MAX_AGE seconds from the database. Until then they can be
+missing, which is fine for the hints the index is used for; follow buttons
+and privacy checks still ask the database.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Follows
+
+log = logging.getLogger(__name__)
+
+TYPECODE = 'i'
+FETCH_SIZE = 100000
+DEFAULT_MAX_AGE = 300
+
+# Snapshot header: magic, format version, then the lengths of the following
+# offsets and targets and the followers offsets and targets. Arrays follow
+# in that order, in native byte order.
+SNAPSHOT_MAGIC = b'WBLGRAPH'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('=8sIQQQQ')
+
+# Intersect by bisecting the longer list once it's this many times longer.
+BISECT_RATIO = 16
+
+CHANGES_KEY = 'follow_graph_changes'
+
+
+class FollowGraph:
+    """Who follows whom, as CSR arrays indexed by user id."""
+
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_edges(cls, edges, max_id=None):
+        """Build from (follower id, followed id) pairs sorted by both."""
+
+        targets = array(TYPECODE)
+        degrees = {}
+        for follower_id, followed_id in edges:
+            targets.append(followed_id)
+            degrees[follower_id] = degrees.get(follower_id, 0) + 1
+
+        if max_id is None:
+            max_id = max(degrees, default=0)
+        counts = array(TYPECODE, bytes(array(TYPECODE).itemsize
+                                       * (max_id + 2)))
+        for follower_id, degree in degrees.items():
+            counts[follower_id + 1] = degree
+        return cls(array(TYPECODE, accumulate(counts)), targets)
+
+    @classmethod
+    def from_database(cls, reverse=False):
+        """Build from the follows table, streamed in index order.
+
+        With `reverse`, maps each user to their followers instead.
+        """
+
+        source, target = (Follows.user_following_id,
+                          Follows.user_being_followed_id)
+        if reverse:
+            source, target = target, source
+
+        edges = (db.session
+                 .query(source, target)
+                 .order_by(source, target)
+                 .yield_per(FETCH_SIZE))
+        return cls.from_edges(edges)
+
+    @property
+    def max_id(self):
+        return len(self.offsets) - 2
+
+    def __len__(self):
+        return len(self.targets)
+
+    def following(self, user_id):
+        """Sorted ids `user_id` follows."""
+
+        if not 0 <= user_id <= self.max_id:
+            return array(TYPECODE)
+        return self.targets[self.offsets[user_id]:self.offsets[user_id + 1]]
+
+    def active_ids(self):
+        """Ids of users who follow anyone, ascending."""
+
+        return [user_id for user_id in range(self.max_id + 1)
+                if self.offsets[user_id + 1] > self.offsets[user_id]]
+
+
+def write_snapshot(path, following, followers):
+    """Write both directions of the graph to `path`, replacing it atomically
+    so workers mapping the old file keep a consistent copy.
+    """
+
+    arrays = [array(TYPECODE, values) for values in
+              (following.offsets, following.targets,
+               followers.offsets, followers.targets)]
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as snapshot:
+        snapshot.write(SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION, *map(len, arrays)))
+        for values in arrays:
+            values.tofile(snapshot)
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path):
+    """Map the snapshot at `path`; return (following, followers) graphs
+    whose arrays are views of the mapped file.
+    """
+
+    with open(path, 'rb') as snapshot:
+        mapped = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, *lengths = SNAPSHOT_HEADER.unpack_from(mapped)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f"{path} is not a follow graph snapshot")
+
+    views = []
+    start = SNAPSHOT_HEADER.size
+    itemsize = array(TYPECODE).itemsize
+    for length in lengths:
+        end = start + length * itemsize
+        views.append(memoryview(mapped)[start:end].cast(TYPECODE))
+        start = end
+
+    return FollowGraph(*views[:2]), FollowGraph(*views[2:])
+
+
+def contains(ids, user_id):
+    """Is `user_id` in the sorted sequence `ids`?"""
+
+    i = bisect_left(ids, user_id)
+    return i < len(ids) and ids[i] == user_id
+
+
+def intersect(a, b):
+    """Sorted ids in both sorted sequences `a` and `b`."""
+
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return []
+    if len(a) * BISECT_RATIO < len(b):
+        return [user_id for user_id in a if contains(b, user_id)]
+    return sorted(set(a).intersection(b))
+
+
+class GraphIndex:
+    """Both directions of the follow graph, queried in memory."""
+
+    def __init__(self, path=None, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.loaded_at = None
+        self._snapshot_mtime = None
+        self._following = self._followers = FollowGraph(array(TYPECODE),
+                                                        array(TYPECODE))
+        # Sorted ids of users whose follows changed since loading, by user.
+        self._following_changed = {}
+        self._followers_changed = {}
+        self._lock = threading.RLock()
+        self._worker_pid = None
+
+    @property
+    def loaded(self):
+        return self.loaded_at is not None
+
+    def load(self, following=None, followers=None):
+        """Replace the index with `following` and `followers` graphs, or
+        else the snapshot at `path` if there is one, or else the database.
+        """
+
+        mtime = None
+        if following is None:
+            if self.path and os.path.exists(self.path):
+                mtime = os.stat(self.path).st_mtime_ns
+                following, followers = read_snapshot(self.path)
+            else:
+                following = FollowGraph.from_database()
+                followers = FollowGraph.from_database(reverse=True)
+
+        with self._lock:
+            self._following, self._followers = following, followers
+            self._following_changed = {}
+            self._followers_changed = {}
+            self._snapshot_mtime = mtime
+            self.loaded_at = time.monotonic()
+
+    def refresh(self):
+        """Load the index if it's missing, its snapshot has been replaced,
+        or, without a snapshot, it's more than `max_age` seconds old.
+        """
+
+        if self.path and os.path.exists(self.path):
+            if os.stat(self.path).st_mtime_ns != self._snapshot_mtime:
+                self.load()
+        elif (not self.loaded or self._snapshot_mtime is not None
+                or time.monotonic() - self.loaded_at >= self.max_age):
+            self.load()
+
+    def start_worker(self):
+        """Start this process's loading thread, once per process."""
+
+        if (self._worker_pid == os.getpid() or not has_app_context()
+                or current_app.testing):
+            return
+
+        with self._lock:
+            if self._worker_pid != os.getpid():
+                self._worker_pid = os.getpid()
+                threading.Thread(
+                    target=self._work,
+                    args=(current_app._get_current_object(),),
+                    name='follow-graph', daemon=True).start()
+
+    def _work(self, app):
+        while True:
+            try:
+                with app.app_context():
+                    self.refresh()
+            except Exception:
+                log.exception("Loading the follow graph failed")
+            time.sleep(self.max_age)
+
+    def following(self, user_id):
+        """Sorted ids `user_id` follows; none until loaded."""
+
+        return self._out(user_id)
+
+    def followers(self, user_id):
+        """Sorted ids of `user_id`'s followers; none until loaded."""
+
+        return self._in(user_id)
+
+    def _out(self, user_id):
+        ids = self._following_changed.get(user_id)
+        return self._following.following(user_id) if ids is None else ids
+
+    def _in(self, user_id):
+        ids = self._followers_changed.get(user_id)
+        return self._followers.following(user_id) if ids is None else ids
+
+    def follows(self, follower_id, followed_id):
+        """Does `follower_id` follow `followed_id`?"""
+
+        return contains(self.following(follower_id), followed_id)
+
+    def mutuals(self, user_id):
+        """Sorted ids of users who follow `user_id` and are followed back."""
+
+        return intersect(self.following(user_id), self.followers(user_id))
+
+    def followers_you_know(self, viewer_id, user_id):
+        """Sorted ids of `user_id`'s followers that `viewer_id` follows."""
+
+        return intersect(self.following(viewer_id), self.followers(user_id))
+
+    def apply(self, edges, removed_user_ids=()):
+        """Apply committed (follower id, followed id, following) changes,
+        then drop `removed_user_ids` from the graph entirely.
+
+        Doesn't reload or query, so it's safe to call after a commit.
+        """
+
+        with self._lock:
+            for follower_id, followed_id, following in edges:
+                self._set_edge(follower_id, followed_id, following)
+
+            for user_id in removed_user_ids:
+                for followed_id in list(self._out(user_id)):
+                    self._set_edge(user_id, followed_id, False)
+                for follower_id in list(self._in(user_id)):
+                    self._set_edge(follower_id, user_id, False)
+
+    def _set_edge(self, follower_id, followed_id, following):
+        _update(self._following_changed, self._out(follower_id),
+                follower_id, followed_id, following)
+        _update(self._followers_changed, self._in(followed_id),
+                followed_id, follower_id, following)
+
+
+def _update(changed, ids, user_id, other_id, present):
+    """Store a copy of `ids` with `other_id` added or removed in `changed`.
+
+    Readers holding the old list keep seeing it unchanged.
+    """
+
+    ids = array(TYPECODE, ids)
+    i = bisect_left(ids, other_id)
+    found = i < len(ids) and ids[i] == other_id
+    if present and not found:
+        ids.insert(i, other_id)
+    elif not present and found:
+        del ids[i]
+    changed[user_id] = ids
+
+
+def connect_follow_graph(app):
+    """Set up the in-process follow graph index for `app`."""
+
+    index = GraphIndex(app.config.get('FOLLOW_GRAPH_PATH'),
+                       app.config.get('FOLLOW_GRAPH_MAX_AGE', DEFAULT_MAX_AGE))
+    app.extensions['follow_graph'] = index
+    app.before_request(index.start_worker)
+
+
+def graph_index():
+    return current_app.extensions['follow_graph']
+
+
+def snapshot(path):
+    """Write a snapshot of the follows table to `path`; return its size in
+    follows.
+    """
+
+    following = FollowGraph.from_database()
+    followers = FollowGraph.from_database(reverse=True)
+    write_snapshot(path, following, followers)
+    return len(following)
+
+
+##############################################################################
+# Change hooks: call these alongside the writes, before committing.
+
+
+def _changes():
+    return db.session.info.setdefault(CHANGES_KEY, ([], set()))
+
+
+def follow_added(follower_id, followed_id):
+    _changes()[0].append((follower_id, followed_id, True))
+
+
+def followers_added(follower_ids, followed_id):
+    _changes()[0].extend((follower_id, followed_id, True)
+                         for follower_id in follower_ids)
+
+
+def follow_removed(follower_id, followed_id):
+    _changes()[0].append((follower_id, followed_id, False))
+
+
+def user_removed(user_id):
+    _changes()[1].add(user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changes = session.info.pop(CHANGES_KEY, None)
+    if changes is None or not has_app_context():
+        return
+
+    index = current_app.extensions.get('follow_graph')
+    if index is not None and index.loaded:
+        index.apply(*changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop(CHANGES_KEY, None)
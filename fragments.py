@@ -0,0 +1,119 @@
+"""Cached markup for message and user cards.
+
+Timelines, profiles and user lists render the same cards over and over, so
+each card's markup is cached by id. Entries carry a version, the author's
+(or user's) `updated_at`, and a cached card whose version doesn't match is
+rendered again; editing a user bumps `updated_at` (see `_bump_version`), so
+every worker sees the change even though only this process's cache is
+evicted directly.
+
+Cached cards leave out anything that depends on who is looking. They are
+rendered with a VIEWER_SLOT marker where the like button or follow form
+goes, and `message_card()` / `user_card()` return the markup before and
+after it for the template to fill in around the viewer's own state.
+
+The cache is an in-process LRU by default, or Redis with
+FRAGMENT_CACHE_URL, as for the identity cache.
+"""
+
+from datetime import datetime
+
+from flask import current_app, has_app_context
+from markupsafe import Markup
+from sqlalchemy import event
+
+from identity import MemoryCache, RedisCache
+from models import db, Message, User
+
+DEFAULT_TTL = 3600
+DEFAULT_MAX_ENTRIES = 50000
+
+VIEWER_SLOT = '<!-- viewer -->'
+
+# User columns rendered on user cards or, for authors, message cards.
+CARD_FIELDS = ('username', 'image_url', 'header_image_url', 'bio')
+
+
+def connect_fragment_cache(app):
+    """Set up the fragment cache for `app` and its template helpers."""
+
+    ttl = app.config.get('FRAGMENT_CACHE_TTL', DEFAULT_TTL)
+    url = app.config.get('FRAGMENT_CACHE_URL')
+
+    if url:
+        cache = RedisCache(url, ttl=ttl, prefix='warbler:fragments:')
+    else:
+        cache = MemoryCache(
+            ttl=ttl,
+            max_entries=app.config.get('FRAGMENT_CACHE_SIZE',
+                                       DEFAULT_MAX_ENTRIES))
+
+    app.extensions['fragment_cache'] = cache
+    app.jinja_env.globals['message_card'] = message_card
+    app.jinja_env.globals['user_card'] = user_card
+
+
+def get_cache():
+    return current_app.extensions['fragment_cache']
+
+
+def _version(user):
+    return user.updated_at.isoformat()
+
+
+def _render(key, version, template, **context):
+    """Return the cached markup for `key`, rendering it on a miss."""
+
+    cache = get_cache()
+    entry = cache.get(key)
+    if entry is not None and entry[0] == version:
+        html = entry[1]
+    else:
+        html = current_app.jinja_env.get_template(template).render(**context)
+        cache.set(key, (version, html))
+
+    before, _, after = html.partition(VIEWER_SLOT)
+    return Markup(before), Markup(after)
+
+
+def message_card(msg):
+    """(before, after) markup around the like button for `msg`'s card."""
+
+    return _render(f'message:{msg.id}', _version(msg.user),
+                   'messages/card.html', msg=msg)
+
+
+def user_card(user):
+    """(before, after) markup around the follow form for `user`'s card."""
+
+    return _render(f'user:{user.id}', _version(user), 'users/card.html',
+                   user=user)
+
+
+def forget(keys):
+    if not has_app_context():
+        return
+
+    cache = get_cache()
+    for key in keys:
+        cache.delete(key)
+
+
+@event.listens_for(User, 'before_update')
+def _bump_version(mapper, connection, user):
+    state = db.inspect(user)
+    if any(state.attrs[field].history.has_changes()
+           for field in CARD_FIELDS):
+        user.updated_at = datetime.utcnow()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, user):
+    forget([f'user:{user.id}'])
+
+
+@event.listens_for(Message, 'after_update')
+@event.listens_for(Message, 'after_delete')
+def _message_changed(mapper, connection, msg):
+    forget([f'message:{msg.id}'])
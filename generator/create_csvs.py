@@ -2,76 +2,237 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for load testing:
+
+    python generator/create_csvs.py --users 1000000 --messages 10000000 \\
+        --follows 50000000 --likes 20000000 --workers 8 --out /tmp/warbler
+
+The output is the same for a given --seed and --shard-size however many
+--workers run it: rows are made in fixed-size shards, each with its own
+random generator, written to part files and then joined in order. Each shard
+holds only its own rows' working state, so memory use doesn't grow with the
+dataset.
+
+Popularity and activity follow power laws: a few users get most of the
+follows and likes, and a few post and follow far more than most. Load the
+result with `flask import-data DIR`.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+import random
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from helpers import lomax, Ranking, sentence, words
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio',
+                     'header_image_url', 'location', 'private']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
+REQUESTS_CSV_HEADERS = ['from_id', 'to_id']
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
-
-fake = Faker()
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-# Generate random profile image URLs to use for users
-
-image_urls = [
+# Built from a pattern rather than looked up, so generating needs no network.
+IMAGE_URLS = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
-
-# Generate random header image URLs to use for users
-
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
-
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+HEADER_IMAGE_URL = "/static/images/warbler-hero.jpg"
+
+PRIVATE_SHARE = 0.05
+HISTORY = timedelta(days=730)
+
+# Heavy-tailed per-user activity: how many follows and likes each user
+# makes. Shape 2 keeps the mean finite with a long tail of heavy users.
+ACTIVITY_SHAPE = 2.0
+
+# Popularity offsets (see helpers.Ranking): smaller concentrates more of the
+# follows, likes and messages on the top few users and messages.
+FOLLOWED_OFFSET = 1
+LIKED_OFFSET = 10
+AUTHOR_OFFSET = 10
+
+SHARD_SIZE = 10000
+
+
+def rng_for(seed, table, shard):
+    return random.Random(f"{seed}:{table}:{shard}")
+
+
+def degree(rng, mean, limit):
+    """Draw how many rows a user makes, heavy tailed around `mean`."""
+
+    # A Lomax draw with shape 2 has a mean equal to its scale.
+    return min(round(lomax(rng, ACTIVITY_SHAPE, mean)), limit)
+
+
+def make_users(options, shard, start, end):
+    rng = rng_for(options.seed, 'users', shard)
+    for user_id in range(start, end):
+        first, second = words(rng, 2)
+        username = f"{first}{second}{user_id}"
+        yield [user_id,
+               f"{username}@example.com",
+               username,
+               rng.choice(IMAGE_URLS),
+               PASSWORD,
+               sentence(rng),
+               HEADER_IMAGE_URL,
+               words(rng, 1)[0].title() + " City",
+               rng.random() < PRIVATE_SHARE]
+
+
+def make_messages(options, shard, start, end):
+    rng = rng_for(options.seed, 'messages', shard)
+    authors = Ranking(options.users, options.seed + 1)
+    step = HISTORY / max(options.messages, 1)
+    first = options.now - HISTORY
+
+    for message_id in range(start, end):
+        # Ids increase with time, as they would in a live database.
+        timestamp = first + step * (message_id - 1 + rng.random())
+        yield [message_id,
+               sentence(rng, MAX_WARBLER_LENGTH),
+               timestamp.isoformat(sep=' '),
+               authors.pick(rng, AUTHOR_OFFSET)]
+
+
+def make_follows(options, shard, start, end):
+    rng = rng_for(options.seed, 'follows', shard)
+    popular = Ranking(options.users, options.seed + 2)
+    mean = options.follows / options.users
+
+    for follower in range(start, end):
+        followed = set()
+        wanted = degree(rng, mean, options.users - 1)
+        while len(followed) < wanted:
+            user_id = popular.pick(rng, FOLLOWED_OFFSET)
+            if user_id != follower:
+                followed.add(user_id)
+        for user_id in sorted(followed):
+            yield [user_id, follower]
+
+
+def make_likes(options, shard, start, end):
+    rng = rng_for(options.seed, 'likes', shard)
+    popular = Ranking(options.messages, options.seed + 3)
+    mean = options.likes / options.users
+
+    for user_id in range(start, end):
+        liked = set()
+        wanted = degree(rng, mean, options.messages)
+        while len(liked) < wanted:
+            liked.add(popular.pick(rng, LIKED_OFFSET))
+        for message_id in sorted(liked):
+            yield [user_id, message_id]
+
+
+def make_requests(options, shard, start, end):
+    # Requests to private users; `from_id` is the user being asked, as in
+    # User.from_users.
+    users = make_users(options, shard, start, end)
+    rng = rng_for(options.seed, 'requests', shard)
+    mean = options.requests / max(options.users * PRIVATE_SHARE, 1)
+
+    for user in users:
+        user_id, private = user[0], user[-1]
+        if not private:
+            continue
+        requesters = set()
+        wanted = degree(rng, mean, options.users - 1)
+        while len(requesters) < wanted:
+            requester = rng.randint(1, options.users)
+            if requester != user_id:
+                requesters.add(requester)
+        for requester in sorted(requesters):
+            yield [user_id, requester]
+
+
+TABLES = {
+    'users': (USERS_CSV_HEADERS, make_users, 'users'),
+    'messages': (MESSAGES_CSV_HEADERS, make_messages, 'messages'),
+    'follows': (FOLLOWS_CSV_HEADERS, make_follows, 'users'),
+    'likes': (LIKES_CSV_HEADERS, make_likes, 'users'),
+    'requests': (REQUESTS_CSV_HEADERS, make_requests, 'users'),
+}
+
+
+def part_path(options, table, shard):
+    return os.path.join(options.out, f"{table}.part-{shard:05}.csv")
+
+
+def write_shard(options, table, shard, start, end):
+    """Write rows for ids [start, end) of `table` to a part file."""
+
+    _, make_rows, _ = TABLES[table]
+    with open(part_path(options, table, shard), 'w', newline='') as f:
+        csv.writer(f).writerows(make_rows(options, shard, start, end))
+
+
+def join_parts(options, table, shards):
+    """Concatenate a table's part files, in order, under its header."""
+
+    headers, _, _ = TABLES[table]
+    with open(os.path.join(options.out, f"{table}.csv"), 'w',
+              newline='') as out:
+        csv.writer(out).writerow(headers)
+        for shard in range(shards):
+            path = part_path(options, table, shard)
+            with open(path, newline='') as part:
+                shutil.copyfileobj(part, out)
+            os.remove(path)
+
+
+def generate(options):
+    os.makedirs(options.out, exist_ok=True)
+
+    jobs = []
+    for table, (_, _, keyed_by) in TABLES.items():
+        count = getattr(options, keyed_by)
+        shards = range(0, count, options.shard_size)
+        jobs.append((table, len(shards),
+                     [(table, shard, start + 1,
+                       min(start + options.shard_size, count) + 1)
+                      for shard, start in enumerate(shards)]))
+
+    with ProcessPoolExecutor(max_workers=options.workers) as pool:
+        futures = [pool.submit(write_shard, options, *args)
+                   for _, _, shards in jobs for args in shards]
+        for future in futures:
+            future.result()
+
+    for table, shards, _ in jobs:
+        join_parts(options, table, shards)
+        print(f"Wrote {table}.csv")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=5000,
+                        help="about how many follows to make")
+    parser.add_argument('--likes', type=int, default=3000,
+                        help="about how many likes to make")
+    parser.add_argument('--requests', type=int, default=50,
+                        help="about how many follow requests to make")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    parser.add_argument('--out', default='generator')
+    parser.add_argument('--now', type=datetime.fromisoformat,
+                        default=datetime(2021, 4, 1),
+                        help="timestamp of the newest message")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    generate(parse_args())
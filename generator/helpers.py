@@ -1,14 +1,91 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+WORDS = """
+    able about above across act add afternoon again against air all almost
+    along already also always among animal answer any appear apple area arm
+    around art ask away baby back bad bag ball bank bar base be bear beat
+    bed before begin behind believe best better between big bird black blue
+    boat body book both box boy bring brother build burn business buy call
+    camera car card care carry case cat catch cause center chair chance
+    change check child choose city class clear close cloud coast cold color
+    come common community computer could country course cover cup cut dance
+    dark day deal deep describe design detail dinner direction discover dog
+    door down draw dream drive drop during early east easy eat edge effort
+    eight energy enjoy enough evening every example eye face fact fall
+    family far farm fast father feel field fight film find fine fire first
+    fish five floor flower fly follow food foot forest forget form forward
+    four free friend front full fun game garden gather gift girl give glass
+    go gold good green ground group grow guess hair half hand happy hard hat
+    have head hear heart heavy help here high hill history hold home hope
+    horse hot hour house idea imagine inside island job join journey jump
+    keep key kind king kitchen know lake land language large last late
+    laugh learn leave left letter life light likely line listen little live
+    long look love low machine make many map mark market meet memory middle
+    mind minute miss moment money month moon morning mother mountain move
+    music name nature near need never new news next night north note
+    nothing notice number ocean offer office often old open order other
+    outside own page paint paper park part party pass past path pay people
+    person picture piece place plan plant play point pool poor power
+    present pretty problem pull push question quick quiet race rain reach
+    read ready real reason red remember rest rich ride right river road rock
+    room round rule run sail salt same sand save say school science sea
+    season seat second see seed sell send serve set seven shape share ship
+    shoe short show side sign simple sing sister sit six size skill sky
+    sleep slow small smile snow soft song soon sound south space speak
+    special spring square stand star start station stay step still stone
+    stop store story street strong study summer sun support sure surprise
+    table take talk tall teach team tell ten test thank thing think three
+    through time today together tomorrow tonight town track trade travel
+    tree trip true try turn two under until up use usual valley very view
+    village visit voice wait walk wall want warm watch water wave way
+    weather week welcome west wheel white whole wide wild wind window winter
+    wish without wonder wood word work world write year yellow young
+""".split()
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def words(rng, count):
+    """Pick `count` random words."""
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    return [rng.choice(WORDS) for _ in range(count)]
 
-    return datetime.fromtimestamp(random_timestamp)
+
+def sentence(rng, max_length=None):
+    """Make a random sentence or few, at most `max_length` characters."""
+
+    text = " ".join(
+        " ".join(words(rng, rng.randint(3, 10))).capitalize() + "."
+        for _ in range(rng.randint(1, 3)))
+    return text[:max_length] if max_length else text
+
+
+def lomax(rng, shape, scale):
+    """Draw from a Lomax (shifted Pareto) distribution: heavy tailed, >= 0.
+
+    With `shape` above 1 the mean is scale / (shape - 1).
+    """
+
+    return scale * (rng.paretovariate(shape) - 1)
+
+
+class Ranking:
+    """Ids 1..n in a fixed shuffled order, picked by Zipf-like popularity.
+
+    The rank r item (from 0) is picked with probability roughly proportional
+    to 1 / (r + offset); the shuffle is a modular bijection, so it needs no
+    memory however large n is.
+    """
+
+    PRIMES = (1000003, 998244353)
+
+    def __init__(self, n, seed):
+        self.n = n
+        self.step = next(p for p in self.PRIMES if n % p)
+        self.shift = seed % n
+
+    def id_at(self, rank):
+        return (rank * self.step + self.shift) % self.n + 1
+
+    def pick(self, rng, offset):
+        # Inverse CDF of the continuous 1 / (r + offset) density on [0, n).
+        rank = offset * ((1 + self.n / offset) ** rng.random() - 1)
+        return self.id_at(min(int(rank), self.n - 1))
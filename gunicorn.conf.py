@@ -0,0 +1,24 @@
+"""gunicorn settings, read from the environment (see deploy.py).
+
+gunicorn loads this file from the working directory, so the Procfile's
+`gunicorn app:app` picks it up. WEB_CONCURRENCY sets the number of worker
+processes, as gunicorn does by default.
+"""
+
+import os
+
+import deploy
+
+worker_class = deploy.worker_class()
+threads = deploy.worker_concurrency() if worker_class == 'gthread' else 1
+worker_connections = deploy.worker_concurrency()
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # psycopg2 blocks the whole process on queries unless it's told to
+        # yield to other greenlets (needs the psycogreen package).
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
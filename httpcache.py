@@ -0,0 +1,128 @@
+"""HTTP caching policy.
+
+Static files are served with a content hash in their URL (`url_for('static',
+...)` adds `?v=<hash>`), so a URL always means the same bytes and can be
+cached for a year as immutable. Static URLs without the current hash (old
+pages, image URLs stored in the database) get an hour.
+
+Timeline, profile and message pages get weak ETags from what they show: the
+ids and versions (`updated_at`, counters) of the items on the page, the
+viewer's cached snapshot and the release. A view calls `unchanged()` once it
+has loaded its page, before rendering; if the client already has that
+version it gets a 304 and nothing is rendered. These pages are
+`private, no-cache` and vary on the session cookie, so only the viewer's
+browser stores them, and it revalidates each time.
+
+Everything else stays `no-store`, as before.
+"""
+
+import hashlib
+import os
+
+from flask import current_app, g, request, session
+from werkzeug.security import safe_join
+
+from identity import SNAPSHOT_FIELDS
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+UNVERSIONED_STATIC_MAX_AGE = 60 * 60
+
+_fingerprints = {}
+
+
+def fingerprint(app, filename):
+    """Short content hash of a static file, or None if it doesn't exist."""
+
+    path = safe_join(app.static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except (OSError, TypeError):
+        return None
+
+    key = (path, mtime)
+    if key not in _fingerprints:
+        with open(path, 'rb') as f:
+            _fingerprints[key] = hashlib.sha256(f.read()).hexdigest()[:12]
+    return _fingerprints[key]
+
+
+def release_version(app):
+    """Hash of the templates, so a deploy that changes them resets ETags."""
+
+    digest = hashlib.sha256()
+    for root, dirs, files in sorted(os.walk(app.jinja_loader.searchpath[0])):
+        dirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(name.encode() + f.read())
+    return digest.hexdigest()[:12]
+
+
+def init_app(app):
+    release = app.config.get('RELEASE') or release_version(app)
+    app.extensions['release'] = release
+
+    @app.url_defaults
+    def add_static_version(endpoint, values):
+        if endpoint == 'static' and 'v' not in values:
+            version = fingerprint(app, values.get('filename', ''))
+            if version:
+                values['v'] = version
+
+    @app.after_request
+    def set_cache_headers(response):
+        if (request.endpoint == 'static'
+                and response.status_code in (200, 304)):
+            version = fingerprint(app, request.view_args['filename'])
+            if version and request.args.get('v') == version:
+                response.cache_control.max_age = STATIC_MAX_AGE
+                response.cache_control.public = True
+                response.cache_control.immutable = True
+            else:
+                response.cache_control.max_age = UNVERSIONED_STATIC_MAX_AGE
+                response.cache_control.public = True
+
+        elif g.get('etag'):
+            response.set_etag(g.etag, weak=True)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+
+        else:
+            # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
+            response.cache_control.no_store = True
+        return response
+
+
+def cards(messages):
+    """Validator parts for a list of message cards."""
+
+    return [(msg.id, msg.user_id, msg.user.updated_at, msg.like_count)
+            for msg in messages]
+
+
+def unchanged(*parts):
+    """Return a 304 response if the client has this version of the page.
+
+    `parts` describe everything the page shows besides the viewer. Returns
+    None otherwise, and the response gets the ETag (see `init_app()`).
+    """
+
+    if session.get('_flashes'):
+        # The page will show flashed messages, once.
+        return None
+    queue = current_app.extensions.get('write_queue')
+    if g.user and queue is not None and queue.has_pending(g.user.id):
+        # The viewer's likes aren't in their counters yet (writebehind.py).
+        return None
+
+    viewer = ([getattr(g.user, field) for field in SNAPSHOT_FIELDS]
+              if g.user else None)
+    digest = hashlib.sha256(repr(
+        (current_app.extensions['release'], request.full_path, viewer, parts)
+    ).encode()).hexdigest()[:32]
+    g.etag = digest
+
+    if request.if_none_match.contains_weak(digest):
+        return current_app.response_class(status=304)
+    return None
@@ -0,0 +1,200 @@
+"""Cached identity for the logged-in user.
+
+Every request needs a little about the current user (their id, name, avatar
+and counts for the nav bar and home page) and most need nothing else. Rather
+than loading the full User row, password hash included, on each request,
+`add_user_to_g()` puts a `CurrentUser` in `g.user`: a small snapshot read
+from a cache with a TTL. Reading anything not in the snapshot, or calling
+`hydrate()`, loads the real User for the rest of the request.
+
+The cache is an in-process LRU by default. Set IDENTITY_CACHE_URL to a
+redis:// URL to share it between gunicorn workers; that needs the `redis`
+package, and the LRU bound is then the Redis server's maxmemory policy.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+from models import db, User
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_ENTRIES = 10000
+
+SNAPSHOT_FIELDS = (
+    'id',
+    'username',
+    'image_url',
+    'header_image_url',
+    'private',
+    'messages_count',
+    'following_count',
+    'followers_count',
+    'likes_count',
+    'pending_requests_count',
+)
+
+
+class MemoryCache:
+    """In-process cache with a per-entry TTL and an LRU size bound."""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCache:
+    """Cache stored in Redis (or anything speaking its protocol)."""
+
+    def __init__(self, url, ttl=DEFAULT_TTL, prefix='warbler:identity:'):
+        if redis is None:
+            raise RuntimeError(
+                "IDENTITY_CACHE_URL is set but the redis package is not "
+                "installed.")
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(self.prefix + str(key))
+        return None if value is None else tuple(json.loads(value))
+
+    def set(self, key, value):
+        self._client.setex(self.prefix + str(key), self.ttl, json.dumps(value))
+
+    def delete(self, key):
+        self._client.delete(self.prefix + str(key))
+
+    def clear(self):
+        keys = list(self._client.scan_iter(self.prefix + '*'))
+        if keys:
+            self._client.delete(*keys)
+
+
+class CurrentUser:
+    """The logged-in user, as a snapshot that loads the full User on demand."""
+
+    __slots__ = SNAPSHOT_FIELDS + ('_user',)
+
+    # User methods that only need the id work on the snapshot as they are.
+    is_following = User.is_following
+    is_followed_by = User.is_followed_by
+    following_ids = User.following_ids
+    liked_message_ids = User.liked_message_ids
+
+    def __init__(self, values):
+        for field, value in zip(SNAPSHOT_FIELDS, values):
+            setattr(self, field, value)
+        self._user = None
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+    def __eq__(self, other):
+        if isinstance(other, (User, CurrentUser)):
+            return self.id == other.id
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __getattr__(self, name):
+        # Only called for names that aren't snapshot fields.
+        return getattr(self.hydrate(), name)
+
+    def hydrate(self):
+        """Return the full User row for this user, loading it once."""
+
+        if self._user is None:
+            self._user = User.query.get(self.id)
+        return self._user
+
+
+def connect_identity_cache(app):
+    """Set up the identity cache for `app` from its config."""
+
+    ttl = app.config.get('IDENTITY_CACHE_TTL', DEFAULT_TTL)
+    url = app.config.get('IDENTITY_CACHE_URL')
+
+    if url:
+        cache = RedisCache(url, ttl=ttl)
+    else:
+        cache = MemoryCache(
+            ttl=ttl,
+            max_entries=app.config.get('IDENTITY_CACHE_SIZE',
+                                       DEFAULT_MAX_ENTRIES))
+
+    app.extensions['identity_cache'] = cache
+
+
+def get_cache():
+    return current_app.extensions['identity_cache']
+
+
+def current_user(user_id):
+    """Return a CurrentUser for `user_id`, or None if there is no such user."""
+
+    cache = get_cache()
+    values = cache.get(user_id)
+
+    if values is None:
+        columns = [getattr(User, field) for field in SNAPSHOT_FIELDS]
+        row = db.session.query(*columns).filter(User.id == user_id).first()
+        if row is None:
+            return None
+
+        values = tuple(row)
+        cache.set(user_id, values)
+
+    return CurrentUser(values)
+
+
+def forget(user_ids):
+    """Drop cached snapshots for `user_ids` after their data changes."""
+
+    if not has_app_context():
+        return
+
+    cache = get_cache()
+    for user_id in user_ids:
+        cache.delete(user_id)
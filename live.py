@@ -0,0 +1,317 @@
+"""Live timeline updates over Server-Sent Events.
+
+The homepage opens /api/v1/timeline/stream, which pushes each new message
+from the accounts the viewer follows as it's posted, so nobody has to
+reload the page (and re-run the timeline query) to see them. Each event's
+id is the message id and its data is JSON with the `message`, its author
+(`user`) and the card's `html`. A comment is sent every LIVE_HEARTBEAT
+seconds so proxies keep idle streams open, and streams end after
+LIVE_STREAM_SECONDS; browsers then reconnect with a Last-Event-ID header,
+and the messages posted since that id are sent before any new ones. The
+homepage passes the newest message it shows as `last_event_id`, so nothing
+posted between rendering the page and connecting is lost. Who the viewer
+follows is read when the stream opens.
+
+New messages are published to a broker that hands them to the streams
+subscribed to their author. The default `MemoryBroker` only reaches streams
+in the same process. With more than one gunicorn worker, set
+LIVE_BROKER_URL to a redis:// URL (usually a Redis server on the same
+machine); `RedisBroker` then relays every message to every worker through
+Redis pub/sub. That needs the `redis` package.
+
+An open stream holds no database connection, but it does hold a thread
+under the default gthread workers, so each worker only serves
+LIVE_MAX_STREAMS at once (by default half its threads) and answers 503
+past that. Run gunicorn with GUNICORN_WORKER_CLASS=gevent to hold thousands
+of idle streams cheaply; the default limit is then most of its
+GUNICORN_WORKER_CONNECTIONS.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, abort, current_app, render_template
+
+import deploy
+from fragments import message_card
+import loaders
+from models import db, Follows, Message
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+log = logging.getLogger(__name__)
+
+DEFAULT_HEARTBEAT = 15
+DEFAULT_STREAM_SECONDS = 300
+RETRY_MILLISECONDS = 5000
+QUEUE_SIZE = 100
+RESUME_LIMIT = 50
+CHANNEL = 'warbler:live'
+SUBSCRIBERS_KEY = 'warbler:live:subscribers'
+
+
+class Subscription:
+    """One stream's queue of events from the authors it follows."""
+
+    def __init__(self, broker, author_ids):
+        self.broker = broker
+        self.author_ids = set(author_ids)
+        self.events = queue.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # The client isn't keeping up; end its stream, and it resumes
+            # from its last event.
+            self.overflowed = True
+
+    def get(self, timeout):
+        """The next event, or None after `timeout` seconds without one."""
+
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class MemoryBroker:
+    """Hands events published in this process to its subscriptions."""
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, author_ids):
+        subscription = Subscription(self, author_ids)
+        with self._lock:
+            for author_id in subscription.author_ids:
+                self._subscriptions[author_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for author_id in subscription.author_ids:
+                subscriptions = self._subscriptions.get(author_id)
+                if subscriptions is not None:
+                    subscriptions.discard(subscription)
+                    if not subscriptions:
+                        del self._subscriptions[author_id]
+
+    def subscribed(self, author_id):
+        """How many subscriptions follow `author_id`."""
+
+        with self._lock:
+            return len(self._subscriptions.get(author_id, ()))
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(event['author_id'],
+                                                         ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+
+class RedisBroker(MemoryBroker):
+    """Relays events to every process through Redis pub/sub.
+
+    Every process's subscriptions per author are also counted in a Redis
+    hash, so `subscribed()` answers for all of them. A worker that dies
+    leaves its counts behind, which only costs rendering events nobody gets.
+    """
+
+    def __init__(self, url, channel=CHANNEL, key=SUBSCRIBERS_KEY):
+        if redis is None:
+            raise RuntimeError("LIVE_BROKER_URL needs the redis package")
+        super().__init__()
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self.key = key
+        self._listener_pid = None
+
+    def subscribe(self, author_ids):
+        self._start_listener()
+        subscription = super().subscribe(author_ids)
+        self._count(subscription.author_ids, 1)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        super().unsubscribe(subscription)
+        self._count(subscription.author_ids, -1)
+
+    def _count(self, author_ids, change):
+        if not author_ids:
+            return
+        pipeline = self.client.pipeline(transaction=False)
+        for author_id in author_ids:
+            pipeline.hincrby(self.key, author_id, change)
+        pipeline.execute()
+
+    def subscribed(self, author_id):
+        return max(int(self.client.hget(self.key, author_id) or 0), 0)
+
+    def publish(self, event):
+        self.client.publish(self.channel, json.dumps(event))
+
+    def _start_listener(self):
+        """Start this process's listener thread, once per process."""
+
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+
+        threading.Thread(target=self._listen, name='live-broker',
+                         daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self.deliver(json.loads(message['data']))
+            except Exception:
+                log.exception("Listening for live updates failed")
+                time.sleep(1)
+
+
+def default_max_streams(environ=os.environ):
+    """Streams one worker process may hold open, for its worker class."""
+
+    if deploy.worker_class(environ) == 'gevent':
+        return deploy.worker_concurrency(environ) * 9 // 10
+    return deploy.worker_concurrency(environ) // 2
+
+
+def connect_live(app):
+    """Set up the live update broker and stream limit for `app`."""
+
+    url = app.config.get('LIVE_BROKER_URL')
+    app.extensions['live_broker'] = RedisBroker(url) if url else MemoryBroker()
+
+    max_streams = app.config.get('LIVE_MAX_STREAMS')
+    if max_streams is None:
+        max_streams = default_max_streams()
+    app.extensions['live_streams'] = threading.BoundedSemaphore(
+        max_streams) if max_streams > 0 else None
+
+
+def get_broker():
+    return current_app.extensions['live_broker']
+
+
+def _event_data(msg):
+    """JSON for `msg`'s event, with its card as followers see it."""
+
+    before, after = message_card(msg)
+    button = render_template('messages/like_button.html', msg=msg,
+                             liked=False)
+    return json.dumps({
+        'message': msg.serialize(),
+        'user': {'id': msg.user.id, 'username': msg.user.username,
+                 'image_url': msg.user.image_url},
+        'html': before + button + after,
+    })
+
+
+def message_posted(msg):
+    """Push a newly committed message to its author's followers' streams,
+    if any are open.
+    """
+
+    broker = get_broker()
+    if not broker.subscribed(msg.user_id):
+        return
+    broker.publish({'id': msg.id, 'author_id': msg.user_id,
+                    'data': _event_data(msg)})
+
+
+def _format(event):
+    return f"id: {event['id']}\nevent: message\ndata: {event['data']}\n\n"
+
+
+def missed_events(author_ids, last_event_id, limit=RESUME_LIMIT):
+    """Events for the newest `limit` messages by `author_ids` after
+    `last_event_id`, oldest first.
+    """
+
+    messages = (loaders.message_cards(Message.query)
+                .filter(Message.user_id.in_(author_ids))
+                .filter(Message.id > last_event_id)
+                .order_by(Message.id.desc())
+                .limit(limit)
+                .all())
+    return [{'id': msg.id, 'author_id': msg.user_id,
+             'data': _event_data(msg)}
+            for msg in reversed(messages)]
+
+
+def _events(subscription, backlog, last_id, heartbeat, seconds):
+    yield f"retry: {RETRY_MILLISECONDS}\n\n"
+    for event in backlog:
+        last_id = event['id']
+        yield _format(event)
+
+    deadline = time.monotonic() + seconds
+    while not subscription.overflowed:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        event = subscription.get(min(heartbeat, remaining))
+        if event is None:
+            yield ": heartbeat\n\n"
+        elif event['id'] > last_id:
+            last_id = event['id']
+            yield _format(event)
+
+
+def stream(user, last_event_id=None):
+    """An event stream of new messages from the accounts `user` follows.
+
+    `last_event_id` resumes after that message id.
+    """
+
+    streams = current_app.extensions['live_streams']
+    if streams is None or not streams.acquire(blocking=False):
+        abort(503, "too many live streams; try again later")
+
+    try:
+        author_ids = [author_id for (author_id,) in
+                      db.session.query(Follows.user_being_followed_id)
+                      .filter(Follows.user_following_id == user.id)]
+        subscription = get_broker().subscribe(author_ids)
+        backlog = (missed_events(author_ids, last_event_id)
+                   if last_event_id is not None and author_ids else [])
+    except Exception:
+        streams.release()
+        raise
+
+    def close():
+        subscription.close()
+        streams.release()
+
+    response = Response(
+        _events(subscription, backlog, last_event_id or 0,
+                current_app.config.get('LIVE_HEARTBEAT', DEFAULT_HEARTBEAT),
+                current_app.config.get('LIVE_STREAM_SECONDS',
+                                       DEFAULT_STREAM_SECONDS)),
+        mimetype='text/event-stream',
+        headers={'X-Accel-Buffering': 'no'})
+    response.call_on_close(close)
+    return response
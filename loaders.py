@@ -0,0 +1,47 @@
+"""Per-view loader options for Warbler's queries.
+
+Each rendered list states up front which relationships its template uses, so
+a page is a fixed number of queries however many items it shows. Anything the
+template needs about the viewer (likes, follows) is passed in as id sets from
+`User.liked_message_ids()` and `User.following_ids()` instead of being read
+through relationships per item.
+
+With RAISE_ON_LAZY_LOAD set (as the tests do), every other relationship on
+the objects a view lists raises on access, so an unplanned per-item lazy load
+fails loudly. Related objects loaded alongside them (message authors) are left
+alone, since they are often the current user.
+"""
+
+from flask import current_app, has_app_context
+
+from models import db, Message, User
+
+
+def _strict():
+    return (has_app_context()
+            and current_app.config.get('RAISE_ON_LAZY_LOAD', False))
+
+
+def message_cards(query):
+    """Messages rendered as cards: with their authors, nothing else."""
+
+    author = db.joinedload(Message.user)
+    if _strict():
+        return query.options(author, db.Load(Message).raiseload('*'))
+    return query.options(author)
+
+
+def user_cards(query):
+    """Users rendered as cards: columns only."""
+
+    if _strict():
+        return query.options(db.Load(User).raiseload('*'))
+    return query
+
+
+def profile(query):
+    """The user a profile page is about."""
+
+    if _strict():
+        return query.options(db.Load(User).raiseload('*'))
+    return query
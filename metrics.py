@@ -0,0 +1,281 @@
+"""Per-request SQL and timing metrics.
+
+Every request is counted, with its duration, per endpoint. A sample of
+requests (METRICS_SAMPLE_RATE, default 0.1) is also instrumented in detail:
+SQL queries are counted and timed through SQLAlchemy's cursor events, and
+template rendering is timed through Flask's template signals. Sampled
+responses carry a `Server-Timing` header, so the numbers show up in the
+browser's network panel.
+
+`/metrics` serves the totals in Prometheus' text format, along with the
+slowest statements seen per endpoint. Set METRICS_TOKEN to require it as a
+bearer token; without one, `/metrics` only answers requests from the local
+machine. Totals are kept per process, so scrape each gunicorn worker (or
+compare workers' totals as a sample of the whole).
+"""
+
+import heapq
+import random
+import threading
+import time
+from collections import defaultdict
+
+from flask import (Response, abort, before_render_template, g,
+                   has_request_context, request, template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_SAMPLE_RATE = 0.1
+SLOW_STATEMENTS = 5
+STATEMENT_LENGTH = 200
+
+# Request duration histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestTimings:
+    """What one sampled request spent on SQL and templates."""
+
+    __slots__ = ('queries', 'db_seconds', 'template_seconds',
+                 'template_start', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_start = None
+        self.statements = []
+
+
+class EndpointStats:
+    """Totals for one endpoint."""
+
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.buckets = [0] * len(BUCKETS)
+        self.seconds = 0.0
+        self.sampled = 0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        # Min-heap of (seconds, statement), the slowest SLOW_STATEMENTS.
+        self.slowest = []
+
+    def add_slow(self, seconds, statement):
+        for i, (_, seen) in enumerate(self.slowest):
+            if seen == statement:
+                if seconds > self.slowest[i][0]:
+                    self.slowest[i] = (seconds, statement)
+                    heapq.heapify(self.slowest)
+                return
+
+        if len(self.slowest) < SLOW_STATEMENTS:
+            heapq.heappush(self.slowest, (seconds, statement))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, statement))
+
+
+def _label(value):
+    value = ' '.join(str(value).split())
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _number(value):
+    return str(value) if isinstance(value, int) else f'{value:.6f}'
+
+
+class RequestMetrics:
+    """Collects request, SQL and template timings for an app."""
+
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.token = None
+        self._stats = defaultdict(EndpointStats)
+        self._lock = threading.Lock()
+        self._collectors = []
+
+    def init_app(self, app):
+        self.sample_rate = app.config.get('METRICS_SAMPLE_RATE',
+                                          DEFAULT_SAMPLE_RATE)
+        self.token = app.config.get('METRICS_TOKEN')
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+        before_render_template.connect(self._start_template, app)
+        template_rendered.connect(self._finish_template, app)
+
+        # Listening on Engine covers every engine, including ones made later.
+        if not event.contains(Engine, 'before_cursor_execute',
+                              self._start_query):
+            event.listen(Engine, 'before_cursor_execute', self._start_query)
+            event.listen(Engine, 'after_cursor_execute', self._finish_query)
+
+    def add_collector(self, collect):
+        """Add `collect()`'s Prometheus lines to every scrape."""
+
+        self._collectors.append(collect)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    # Request hooks
+
+    def _start_request(self):
+        g.request_start = time.perf_counter()
+        g.request_timings = (RequestTimings()
+                             if random.random() < self.sample_rate else None)
+
+    def _finish_request(self, response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+
+        seconds = time.perf_counter() - start
+        timings = g.get('request_timings')
+        endpoint = request.endpoint or 'unknown'
+
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats.requests[(request.method, response.status_code)] += 1
+            stats.seconds += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+                    break
+
+            if timings is not None:
+                stats.sampled += 1
+                stats.queries += timings.queries
+                stats.db_seconds += timings.db_seconds
+                stats.template_seconds += timings.template_seconds
+                for query_seconds, statement in timings.statements:
+                    stats.add_slow(query_seconds, statement)
+
+        if timings is not None:
+            response.headers['Server-Timing'] = (
+                f'db;dur={timings.db_seconds * 1000:.1f};'
+                f'desc="{timings.queries} queries", '
+                f'tpl;dur={timings.template_seconds * 1000:.1f}, '
+                f'total;dur={seconds * 1000:.1f}')
+        return response
+
+    def _start_template(self, sender, template, context, **extra):
+        timings = g.get('request_timings')
+        if timings is not None:
+            timings.template_start = time.perf_counter()
+
+    def _finish_template(self, sender, template, context, **extra):
+        timings = g.get('request_timings')
+        if timings is not None and timings.template_start is not None:
+            timings.template_seconds += (time.perf_counter()
+                                         - timings.template_start)
+            timings.template_start = None
+
+    # SQLAlchemy hooks
+
+    def _timings(self):
+        return g.get('request_timings') if has_request_context() else None
+
+    def _start_query(self, conn, cursor, statement, parameters, context,
+                     executemany):
+        if self._timings() is not None:
+            conn.info.setdefault('query_start', []).append(
+                time.perf_counter())
+
+    def _finish_query(self, conn, cursor, statement, parameters, context,
+                      executemany):
+        timings = self._timings()
+        starts = conn.info.get('query_start')
+        if timings is None or not starts:
+            return
+
+        seconds = time.perf_counter() - starts.pop()
+        timings.queries += 1
+        timings.db_seconds += seconds
+        timings.statements.append((seconds, statement[:STATEMENT_LENGTH]))
+
+    # Exposition
+
+    def metrics_view(self):
+        """Serve the totals in Prometheus' text format."""
+
+        if self.token:
+            if request.headers.get('Authorization') != f'Bearer {self.token}':
+                abort(403)
+        elif request.remote_addr not in ('127.0.0.1', '::1'):
+            abort(403)
+
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def render(self):
+        lines = [
+            '# HELP warbler_requests_total Requests handled.',
+            '# TYPE warbler_requests_total counter',
+        ]
+        with self._lock:
+            stats = sorted(self._stats.items())
+
+            for endpoint, stat in stats:
+                for (method, status), count in sorted(stat.requests.items()):
+                    lines.append(
+                        f'warbler_requests_total{{endpoint="{endpoint}",'
+                        f'method="{method}",status="{status}"}} {count}')
+
+            lines += [
+                '# HELP warbler_request_duration_seconds Request durations.',
+                '# TYPE warbler_request_duration_seconds histogram',
+            ]
+            for endpoint, stat in stats:
+                total = sum(stat.requests.values())
+                cumulative = 0
+                for bound, count in zip(BUCKETS, stat.buckets):
+                    cumulative += count
+                    lines.append(
+                        f'warbler_request_duration_seconds_bucket'
+                        f'{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines += [
+                    f'warbler_request_duration_seconds_bucket'
+                    f'{{endpoint="{endpoint}",le="+Inf"}} {total}',
+                    f'warbler_request_duration_seconds_sum'
+                    f'{{endpoint="{endpoint}"}} {stat.seconds:.6f}',
+                    f'warbler_request_duration_seconds_count'
+                    f'{{endpoint="{endpoint}"}} {total}',
+                ]
+
+            for name, kind, help_text, attr in (
+                    ('sampled_requests_total', 'counter',
+                     'Requests instrumented in detail.', 'sampled'),
+                    ('db_queries_total', 'counter',
+                     'SQL queries run by sampled requests.', 'queries'),
+                    ('db_seconds_total', 'counter',
+                     'Time sampled requests spent in SQL.', 'db_seconds'),
+                    ('template_seconds_total', 'counter',
+                     'Time sampled requests spent rendering templates.',
+                     'template_seconds')):
+                lines += [f'# HELP warbler_{name} {help_text}',
+                          f'# TYPE warbler_{name} {kind}']
+                for endpoint, stat in stats:
+                    lines.append(f'warbler_{name}{{endpoint="{endpoint}"}} '
+                                 f'{_number(getattr(stat, attr))}')
+
+            lines += [
+                '# HELP warbler_slow_query_seconds Slowest statements seen '
+                'per endpoint.',
+                '# TYPE warbler_slow_query_seconds gauge',
+            ]
+            for endpoint, stat in stats:
+                for seconds, statement in sorted(stat.slowest, reverse=True):
+                    lines.append(
+                        f'warbler_slow_query_seconds{{endpoint="{endpoint}",'
+                        f'statement="{_label(statement)}"}} {seconds:.6f}')
+
+        for collect in self._collectors:
+            lines += collect()
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = RequestMetrics()
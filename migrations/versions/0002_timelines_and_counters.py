@@ -0,0 +1,58 @@
+"""Home timelines and denormalized user counters.
+
+After upgrading, run `flask reconcile-counters` and `flask rebuild-timelines`
+to fill in the new columns and table from existing data.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 07:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+COUNTERS = ('messages_count', 'following_count', 'followers_count',
+            'likes_count')
+
+
+def upgrade():
+    op.add_column('users', sa.Column('fanout_on_read', sa.Boolean(),
+                                     nullable=True))
+    for name in COUNTERS:
+        op.add_column('users', sa.Column(name, sa.Integer(), nullable=False,
+                                         server_default='0'))
+
+    op.create_table(
+        'timelines',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('author_id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['author_id'], ['users.id'],
+                                ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['message_id'], ['messages.id'],
+                                ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'message_id'),
+    )
+    op.create_index('ix_timelines_user_id_timestamp', 'timelines',
+                    ['user_id', 'timestamp'])
+
+
+def downgrade():
+    op.drop_index('ix_timelines_user_id_timestamp', table_name='timelines')
+    op.drop_table('timelines')
+
+    with op.batch_alter_table('users') as batch_op:
+        for name in COUNTERS:
+            batch_op.drop_column(name)
+        batch_op.drop_column('fanout_on_read')
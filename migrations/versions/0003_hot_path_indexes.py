@@ -0,0 +1,72 @@
+"""Indexes for the hot query paths and unique follow requests.
+
+Duplicate follow requests are removed, keeping the oldest of each. On
+PostgreSQL the indexes are built CONCURRENTLY, outside a transaction, so
+existing tables stay writable while they build.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 07:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_messages_user_id_timestamp_id', 'messages',
+     ['user_id', 'timestamp', 'id']),
+    ('ix_follows_user_following_id', 'follows',
+     ['user_following_id', 'user_being_followed_id']),
+    ('ix_likes_message_id', 'likes', ['message_id']),
+    ('ix_requests_to_id', 'requests', ['to_id']),
+    ('ix_timelines_user_id_timestamp_message_id', 'timelines',
+     ['user_id', 'timestamp', 'message_id']),
+)
+
+
+def upgrade():
+    op.execute("""
+        DELETE FROM requests
+        WHERE id NOT IN (SELECT MIN(id) FROM requests
+                         GROUP BY from_id, to_id)
+    """)
+
+    postgres = op.get_bind().dialect.name == 'postgresql'
+
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns,
+                            postgresql_concurrently=True)
+
+        if postgres:
+            op.create_index('uq_requests_from_id_to_id', 'requests',
+                            ['from_id', 'to_id'], unique=True,
+                            postgresql_concurrently=True)
+
+    if postgres:
+        op.execute("ALTER TABLE requests ADD CONSTRAINT "
+                   "uq_requests_from_id_to_id UNIQUE USING INDEX "
+                   "uq_requests_from_id_to_id")
+    else:
+        with op.batch_alter_table('requests') as batch_op:
+            batch_op.create_unique_constraint('uq_requests_from_id_to_id',
+                                              ['from_id', 'to_id'])
+
+    op.drop_index('ix_timelines_user_id_timestamp', table_name='timelines')
+
+
+def downgrade():
+    op.create_index('ix_timelines_user_id_timestamp', 'timelines',
+                    ['user_id', 'timestamp'])
+
+    with op.batch_alter_table('requests') as batch_op:
+        batch_op.drop_constraint('uq_requests_from_id_to_id', type_='unique')
+
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
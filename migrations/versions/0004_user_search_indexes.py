@@ -0,0 +1,44 @@
+"""Trigram and prefix indexes for user search.
+
+On PostgreSQL this enables pg_trgm and builds the indexes CONCURRENTLY.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 08:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+TRIGRAM_COLUMNS = ('username', 'bio', 'location')
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    if postgres:
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    prefix = 'lower(username) text_pattern_ops' if postgres else 'lower(username)'
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_username_prefix', 'users',
+                        [sa.text(prefix)], postgresql_concurrently=True)
+
+        for column in TRIGRAM_COLUMNS:
+            op.create_index(f'ix_users_{column}_trgm', 'users', [column],
+                            postgresql_using='gin',
+                            postgresql_ops={column: 'gin_trgm_ops'},
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    for column in reversed(TRIGRAM_COLUMNS):
+        op.drop_index(f'ix_users_{column}_trgm', table_name='users')
+    op.drop_index('ix_users_username_prefix', table_name='users')
@@ -0,0 +1,36 @@
+"""Full-text index for message search.
+
+PostgreSQL only; other databases search messages in process.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_messages_text_search', 'messages',
+                        [sa.text("to_tsvector('english', text)")],
+                        postgresql_using='gin',
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_messages_text_search', table_name='messages')
@@ -0,0 +1,28 @@
+"""Version users' card markup with an updated_at column.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('updated_at', sa.DateTime(),
+                                     nullable=False,
+                                     server_default=sa.func.now()))
+
+
+def downgrade():
+    # Not batch mode: rebuilding users on SQLite would lose the expression
+    # index from 0004. SQLite has had DROP COLUMN since 3.35.
+    op.drop_column('users', 'updated_at')
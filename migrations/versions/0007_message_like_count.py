@@ -0,0 +1,28 @@
+"""Denormalized like count on messages.
+
+After upgrading, run `flask reconcile-counters` to fill it in from existing
+likes.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('messages', sa.Column('like_count', sa.Integer(),
+                                        nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('messages', 'like_count')
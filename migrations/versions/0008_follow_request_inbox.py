@@ -0,0 +1,49 @@
+"""Follow request status, timestamps and pending counts.
+
+After upgrading, run `flask reconcile-counters` to fill in users' pending
+request counts. On PostgreSQL the inbox index is built CONCURRENTLY, as in
+0003.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('requests', sa.Column('status', sa.String(length=10),
+                                        nullable=False,
+                                        server_default='pending'))
+    op.add_column('requests', sa.Column('created_at', sa.DateTime(),
+                                        nullable=False,
+                                        server_default=sa.func.now()))
+    op.add_column('requests', sa.Column('decided_at', sa.DateTime(),
+                                        nullable=True))
+    op.add_column('users', sa.Column('pending_requests_count', sa.Integer(),
+                                     nullable=False, server_default='0'))
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_requests_from_id_status_created_at_id',
+                        'requests', ['from_id', 'status', 'created_at', 'id'],
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    # Not batch mode, as in 0006.
+    op.drop_column('users', 'pending_requests_count')
+
+    op.drop_index('ix_requests_from_id_status_created_at_id',
+                  table_name='requests')
+    op.drop_column('requests', 'decided_at')
+    op.drop_column('requests', 'created_at')
+    op.drop_column('requests', 'status')
@@ -0,0 +1,39 @@
+"""Precomputed who-to-follow suggestions.
+
+After upgrading, run `flask rebuild-suggestions` to fill the table.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'suggestions',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('suggested_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['suggested_id'], ['users.id'],
+                                ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'suggested_id'),
+    )
+    op.create_index('ix_suggestions_user_id_score', 'suggestions',
+                    ['user_id', 'score'])
+
+
+def downgrade():
+    op.drop_index('ix_suggestions_user_id_score', table_name='suggestions')
+    op.drop_table('suggestions')
@@ -0,0 +1,31 @@
+"""Checkpointed counts for trending messages and hashtags.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'trend_counts',
+        sa.Column('kind', sa.Text(), nullable=False),
+        sa.Column('bucket', sa.Integer(), nullable=False),
+        sa.Column('key', sa.Text(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'bucket', 'key'),
+    )
+
+
+def downgrade():
+    op.drop_table('trend_counts')
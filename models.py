@@ -2,13 +2,33 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
+from flask import current_app, g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 
-bcrypt = Bcrypt()
+from passwords import hasher
+
 db = SQLAlchemy()
 
 
+def _follow_edges():
+    """Follow edges looked up during this request.
+
+    Maps (follower id, followed id) to whether that follow exists, so a
+    request never asks the database about the same pair twice. Outside an
+    app context nothing is cached.
+    """
+
+    if has_app_context():
+        return g.setdefault('follow_edges', {})
+    return {}
+
+
+def remember_follow(follower_id, followed_id, following):
+    """Record a follow change made during this request."""
+
+    _follow_edges()[(follower_id, followed_id)] = following
+
+
 class Follows(db.Model):
     """Connection of a follower <-> followed_user."""
 
@@ -26,10 +46,22 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key covers "who follows X"; this covers "who does X follow".
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
 class FollowRequest(db.Model):
+    """A request to follow a private account; see follow_requests.py."""
 
     __tablename__ = 'requests'
 
+    PENDING = 'pending'
+    APPROVED = 'approved'
+    REJECTED = 'rejected'
+    STATUSES = (PENDING, APPROVED, REJECTED)
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -46,6 +78,31 @@ class FollowRequest(db.Model):
         db.ForeignKey('users.id', ondelete='CASCADE')
     )
 
+    status = db.Column(
+        db.String(10),
+        nullable=False,
+        default=PENDING,
+        server_default=PENDING,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    decided_at = db.Column(db.DateTime)
+
+    # The inbox pages a user's requests by status, newest first.
+    __table_args__ = (
+        db.UniqueConstraint('from_id', 'to_id',
+                            name='uq_requests_from_id_to_id'),
+        db.Index('ix_requests_to_id', 'to_id'),
+        db.Index('ix_requests_from_id_status_created_at_id',
+                 'from_id', 'status', 'created_at', 'id'),
+    )
+
 class User(db.Model):
     """User in the system."""
 
@@ -93,16 +150,64 @@ class User(db.Model):
 
     private = db.Column(db.Boolean, default=False)
 
-    messages = db.relationship('Message', order_by='Message.timestamp.desc()')
+    # Denormalized counts, maintained by counters.py.
+    messages_count = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
+
+    following_count = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
+
+    followers_count = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
+
+    likes_count = db.Column(db.Integer, nullable=False, default=0,
+                            server_default='0')
+
+    pending_requests_count = db.Column(db.Integer, nullable=False, default=0,
+                                       server_default='0')
+
+    # Set for accounts with too many followers to fan out on write; their
+    # messages are merged into timelines at read time instead.
+    fanout_on_read = db.Column(db.Boolean, default=False)
+
+    # Bumped when anything shown on the user's cards changes; versions the
+    # cached card markup in fragments.py.
+    updated_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow,
+                           server_default=db.func.now())
+
+    # Indexes for search.py: trigram indexes for substring matches and a
+    # prefix index for autocomplete. Only useful on PostgreSQL.
+    __table_args__ = (
+        db.Index('ix_users_username_prefix',
+                 db.func.lower(username).label('username_lower'),
+                 postgresql_ops={'username_lower': 'text_pattern_ops'}),
+        db.Index('ix_users_username_trgm', username,
+                 postgresql_using='gin',
+                 postgresql_ops={'username': 'gin_trgm_ops'}),
+        db.Index('ix_users_bio_trgm', bio,
+                 postgresql_using='gin',
+                 postgresql_ops={'bio': 'gin_trgm_ops'}),
+        db.Index('ix_users_location_trgm', location,
+                 postgresql_using='gin',
+                 postgresql_ops={'location': 'gin_trgm_ops'}),
+    )
+
+    messages = db.relationship('Message', order_by='Message.timestamp.desc()',
+                               passive_deletes=True)
 
     likes = db.relationship('Message', secondary='likes')
 
+    # Pending requests to follow this user. Read-only: follow_requests.py
+    # makes and decides requests, keeping pending_requests_count in step.
     from_users = db.relationship(
         'User',
         secondary='requests',
-        primaryjoin=(FollowRequest.from_id == id),
+        primaryjoin=db.and_(FollowRequest.from_id == id,
+                            FollowRequest.status == FollowRequest.PENDING),
         secondaryjoin=(FollowRequest.to_id == id),
-        backref='to_users'
+        backref=db.backref('to_users', viewonly=True),
+        viewonly=True,
     )
 
     # to_users = db.relationship(
@@ -132,14 +237,71 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.is_following(self)
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_user`?"""
+
+        edges = _follow_edges()
+        key = (self.id, other_user.id)
+
+        if key not in edges:
+            edges[key] = db.session.query(
+                Follows
+                .query
+                .filter_by(user_following_id=self.id,
+                           user_being_followed_id=other_user.id)
+                .exists()
+            ).scalar()
+        return edges[key]
+
+    def following_ids(self, user_ids):
+        """Which of `user_ids` is this user following?
+
+        Answers for any number of ids with at most one query, sharing
+        results with `is_following()` for the rest of the request.
+        """
+
+        edges = _follow_edges()
+        unknown = {user_id for user_id in user_ids
+                   if (self.id, user_id) not in edges}
+
+        if unknown:
+            rows = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == self.id)
+                    .filter(Follows.user_being_followed_id.in_(unknown)))
+            found = {user_id for (user_id,) in rows}
+            for user_id in unknown:
+                edges[(self.id, user_id)] = user_id in found
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return {user_id for user_id in user_ids if edges[(self.id, user_id)]}
+
+    def liked_message_ids(self, message_ids):
+        """Which of `message_ids` has this user liked?
+
+        Includes likes and unlikes still queued by writebehind.py.
+        """
+
+        if not message_ids:
+            return set()
+
+        rows = (db.session
+                .query(Like.message_id)
+                .filter(Like.user_id == self.id)
+                .filter(Like.message_id.in_(message_ids)))
+        liked = {message_id for (message_id,) in rows}
+
+        queue = (current_app.extensions.get('write_queue')
+                 if has_app_context() else None)
+        if queue is not None:
+            for message_id, pending in queue.pending_likes(
+                    self.id, list(message_ids)).items():
+                if pending:
+                    liked.add(message_id)
+                else:
+                    liked.discard(message_id)
+        return liked
 
     def serialize(self):
         return {"id": self.id,
@@ -149,13 +311,12 @@ class User(db.Model):
                 "header_image_url": self.header_image_url,
                 "bio": self.bio,
                 "location": self.location,
-                "password": self.password
                 }
 
     def validate_change_password(self, old_pass, new_pass1, new_pass2):
-        if not bcrypt.check_password_hash(self.password, old_pass):
+        if not hasher.check(self.password, old_pass):
             return False
-        self.password = bcrypt.generate_password_hash(new_pass1).decode('UTF-8')
+        self.password = hasher.hash(new_pass1)
         return True
 
 
@@ -165,7 +326,7 @@ class User(db.Model):
 
         Hashes password and adds user to system.
         """
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -185,13 +346,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made with a different bcrypt cost than is now
+        configured, it is replaced; the caller commits the change.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -224,9 +390,19 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Kept up to date by counters.py.
+    like_count = db.Column(db.Integer, nullable=False, default=0,
+                           server_default='0')
+
     user = db.relationship('User')
     liked_by = db.relationship('User', secondary='likes')
 
+    # Profile pages and timeline rebuilds page a user's messages newest first.
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp_id',
+                 'user_id', 'timestamp', 'id'),
+    )
+
     def __repr__(self):
         return f"<Message #{self.id}: {self.text}, {self.user_id}>"
 
@@ -234,7 +410,105 @@ class Message(db.Model):
         return {"id": self.id,
                 "text": self.text,
                 "timestamp": self.timestamp.strftime('%d %B %Y'),
-                "user_id": self.user_id}
+                "user_id": self.user_id,
+                "like_count": self.like_count}
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into a follower's home timeline."""
+
+    __tablename__ = 'timelines'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=True
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        nullable=False
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False
+    )
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id'),
+        db.Index('ix_timelines_user_id_timestamp_message_id',
+                 'user_id', 'timestamp', 'message_id'),
+    )
+
+
+class Suggestion(db.Model):
+    """A precomputed account for a user to follow; see suggestions.py."""
+
+    __tablename__ = 'suggestions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    suggested_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    # How many of the accounts `user_id` follows follow `suggested_id`.
+    score = db.Column(
+        db.Integer,
+        nullable=False
+    )
+
+    __table_args__ = (
+        db.Index('ix_suggestions_user_id_score', 'user_id', 'score'),
+    )
+
+
+class TrendCount(db.Model):
+    """Events counted for trending.py in one time bucket."""
+
+    __tablename__ = 'trend_counts'
+
+    # 'message' (likes of a message id) or 'hashtag' (posts using a tag).
+    kind = db.Column(
+        db.Text,
+        primary_key=True
+    )
+
+    # Seconds since the epoch divided by the bucket width.
+    bucket = db.Column(
+        db.Integer,
+        primary_key=True
+    )
+
+    key = db.Column(
+        db.Text,
+        primary_key=True
+    )
+
+    count = db.Column(
+        db.Integer,
+        nullable=False
+    )
 
 
 class Like(db.Model):
@@ -253,6 +527,25 @@ class Like(db.Model):
         primary_key=True
     )
 
+    __table_args__ = (
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
+
+
+# The trigram indexes on users need pg_trgm.
+db.event.listen(
+    User.__table__, 'before_create',
+    db.DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    .execute_if(dialect='postgresql'))
+
+# Full-text index for message search (see search.py); the expression must
+# match the one search.py queries with.
+db.event.listen(
+    Message.__table__, 'after_create',
+    db.DDL("CREATE INDEX ix_messages_text_search ON messages "
+           "USING gin (to_tsvector('english', text))")
+    .execute_if(dialect='postgresql'))
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -0,0 +1,169 @@
+"""Keyset (cursor) pagination for Warbler's list views.
+
+Message lists are ordered newest first and keyed on (timestamp, id), and
+follow requests likewise on (created_at, id); user lists are ordered by id.
+Cursors are opaque url-safe tokens encoding the key of the last item on the
+previous page, so each page is one indexed range scan no matter how deep it
+is.
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort, jsonify, render_template, request, url_for
+
+from models import db, FollowRequest, Message, User
+
+MESSAGES_PER_PAGE = 20
+USERS_PER_PAGE = 24
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_cursor(*key):
+    """Encode a sort key as an opaque cursor token."""
+
+    values = [value.isoformat() if isinstance(value, datetime) else value
+              for value in key]
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a cursor token into its list of key values.
+
+    Aborts with a 400 if the token is malformed.
+    """
+
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        abort(400)
+
+    if not isinstance(values, list):
+        abort(400)
+    return values
+
+
+def message_cursor(token):
+    """Decode a message cursor into a (timestamp, id) tuple, or None."""
+
+    if not token:
+        return None
+
+    values = decode_cursor(token)
+    try:
+        timestamp, message_id = values
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, TypeError, OverflowError):
+        abort(400)
+
+
+def user_cursor(token):
+    """Decode a user cursor into a user id, or None."""
+
+    if not token:
+        return None
+
+    values = decode_cursor(token)
+    try:
+        (user_id,) = values
+        return int(user_id)
+    except (ValueError, TypeError, OverflowError):
+        abort(400)
+
+
+def make_page(items, per_page, key):
+    """Build a Page from up to `per_page + 1` fetched items.
+
+    The extra item only tells us whether there is another page.
+    """
+
+    if len(items) > per_page:
+        items = items[:per_page]
+        return Page(items, encode_cursor(*key(items[-1])))
+    return Page(items, None)
+
+
+def message_key(msg):
+    return msg.timestamp, msg.id
+
+
+def user_key(user):
+    return (user.id,)
+
+
+def request_key(row):
+    follow_request = row[0]
+    return follow_request.created_at, follow_request.id
+
+
+def paginate_messages(query, cursor=None, per_page=MESSAGES_PER_PAGE):
+    """Return a Page of messages from `query`, newest first."""
+
+    before = message_cursor(cursor)
+    if before:
+        query = query.filter(
+            db.tuple_(Message.timestamp, Message.id) < before)
+
+    messages = (query
+                .order_by(Message.timestamp.desc(), Message.id.desc())
+                .limit(per_page + 1)
+                .all())
+    return make_page(messages, per_page, message_key)
+
+
+def paginate_users(query, cursor=None, per_page=USERS_PER_PAGE):
+    """Return a Page of users from `query`, ordered by id."""
+
+    after = user_cursor(cursor)
+    if after is not None:
+        query = query.filter(User.id > after)
+
+    users = query.order_by(User.id).limit(per_page + 1).all()
+    return make_page(users, per_page, user_key)
+
+
+def paginate_requests(query, cursor=None, per_page=USERS_PER_PAGE):
+    """Return a Page of (FollowRequest, ...) rows from `query`, newest first."""
+
+    # Same (timestamp, id) shape as a message cursor.
+    before = message_cursor(cursor)
+    if before:
+        query = query.filter(
+            db.tuple_(FollowRequest.created_at, FollowRequest.id) < before)
+
+    rows = (query
+            .order_by(FollowRequest.created_at.desc(),
+                      FollowRequest.id.desc())
+            .limit(per_page + 1)
+            .all())
+    return make_page(rows, per_page, request_key)
+
+
+def page_url(cursor):
+    """URL of the current view with `cursor` in place of the current one."""
+
+    args = request.args.to_dict()
+    args.pop('format', None)
+    args['cursor'] = cursor
+    return url_for(request.endpoint, **request.view_args, **args)
+
+
+def render_page(template, partial, page, **context):
+    """Render a paginated view.
+
+    With `?format=json`, return only the `partial` items plus the next
+    cursor, for infinite scrolling from static/script.js.
+    """
+
+    if request.args.get('format') == 'json':
+        next_url = page_url(page.next_cursor) if page.next_cursor else None
+        return jsonify({'html': render_template(partial, page=page, **context),
+                        'next_cursor': page.next_cursor,
+                        'next_url': next_url})
+
+    return render_template(template, page=page, **context)
@@ -0,0 +1,165 @@
+"""Password hashing and login rate limiting.
+
+bcrypt is deliberately slow, so hashing runs in a small process pool per
+worker instead of on the request thread: CPU use for hashing is bounded by
+PASSWORD_HASH_WORKERS however many requests are logging in, and when more
+than PASSWORD_HASH_QUEUE hashes are already waiting, requests fail fast
+with HasherBusy rather than stalling every other request on the worker.
+With PASSWORD_HASH_WORKERS set to 0 hashing runs inline.
+
+The cost factor comes from BCRYPT_LOG_ROUNDS. Hashes made with another cost
+are replaced on the next successful login (see `User.authenticate`).
+
+`attempt_limiter` caps password attempts per username and per client IP so
+the hash cost can't be used to tie up the server. Its counts are kept per
+process.
+"""
+
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+DEFAULT_ROUNDS = 12
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE = 32
+
+
+class HasherBusy(Exception):
+    """Raised when too many password hashes are already waiting."""
+
+
+class PasswordHasher:
+    """bcrypt hashing, offloaded to a bounded process pool."""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=0, queue=DEFAULT_QUEUE):
+        self.rounds = rounds
+        self.workers = workers
+        self.queue = queue
+        self._pool = None
+        self._pool_pid = None
+        self._slots = threading.BoundedSemaphore(queue)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS)
+        self.queue = app.config.get('PASSWORD_HASH_QUEUE', DEFAULT_QUEUE)
+        self._slots = threading.BoundedSemaphore(self.queue)
+
+    def _get_pool(self):
+        # Pools don't survive a fork, so each gunicorn worker makes its own.
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            return self._get_pool().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        """Return a bcrypt hash of `password` at the configured cost."""
+
+        salt = bcrypt.gensalt(self.rounds)
+        hashed = self._run(bcrypt.hashpw, password.encode('utf-8'), salt)
+        return hashed.decode('utf-8')
+
+    def check(self, hashed, password):
+        """Does `password` match `hashed`?"""
+
+        return self._run(bcrypt.checkpw,
+                         password.encode('utf-8'),
+                         hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different cost than is configured?"""
+
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+class RateLimiter:
+    """Sliding-window limit of `limit` hits per `window` seconds per key.
+
+    Keys with no recent hits are swept out once more than `max_keys` are
+    being tracked.
+    """
+
+    def __init__(self, limit, window, max_keys=100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._hits = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """Record a hit for `key`; return False if it is over the limit."""
+
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits[key]
+            while hits and hits[0] <= now - self.window:
+                hits.popleft()
+
+            if len(hits) >= self.limit:
+                return False
+
+            hits.append(now)
+            if len(self._hits) > self.max_keys:
+                self._sweep(now)
+            return True
+
+    def _sweep(self, now):
+        stale = [key for key, hits in self._hits.items()
+                 if hits[-1] <= now - self.window]
+        for key in stale:
+            del self._hits[key]
+
+    def reset(self):
+        with self._lock:
+            self._hits.clear()
+
+
+class AttemptLimiter:
+    """Password attempt limits per username and per client IP."""
+
+    def __init__(self, per_username=10, per_ip=30, window=60):
+        self.usernames = RateLimiter(per_username, window)
+        self.ips = RateLimiter(per_ip, window)
+
+    def init_app(self, app):
+        window = app.config.get('LOGIN_ATTEMPT_WINDOW', 60)
+        self.usernames = RateLimiter(
+            app.config.get('LOGIN_ATTEMPTS_PER_USERNAME', 10), window)
+        self.ips = RateLimiter(app.config.get('LOGIN_ATTEMPTS_PER_IP', 30),
+                               window)
+
+    def allow(self, ip, username=None):
+        """Record an attempt; return False if either limit is exceeded."""
+
+        allowed = self.ips.hit(ip)
+        if username is not None:
+            allowed = self.usernames.hit(username.lower()) and allowed
+        return allowed
+
+    def reset(self):
+        self.usernames.reset()
+        self.ips.reset()
+
+
+hasher = PasswordHasher()
+attempt_limiter = AttemptLimiter()
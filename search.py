@@ -0,0 +1,550 @@
+"""User and message search.
+
+`find_users()` matches a query anywhere in a user's username, bio or
+location and returns the best SEARCH_LIMIT matches: exact usernames first,
+then usernames starting with the query, then other username matches, then
+bio and location matches. Queries shorter than three characters only match
+username prefixes, as `autocomplete_users()` does.
+
+`find_messages()` is full-text search over message text. Queries are words
+that must all appear; "quoted words" must appear together as a phrase and
+a trailing * matches any word starting with what precedes it. Results are
+newest first, a page at a time, or the best SEARCH_LIMIT by rank, and only
+include messages the viewer is allowed to see.
+
+On PostgreSQL both run against indexes in the database: pg_trgm trigram
+indexes for users and a GIN index on to_tsvector(text) for messages.
+Elsewhere (SQLite in tests) they use in-process indexes, `MemoryUserIndex`
+and `MemoryMessageIndex`, loaded from the database on first use and kept up
+to date by mapper events; bulk inserts that skip the ORM aren't seen until
+the process restarts. The in-process message index doesn't stem words or
+drop stop words, and newest-first results stop after the MAX_MATCHES
+newest matches. SEARCH_BACKEND ("database" or "memory") overrides the
+choice.
+"""
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from heapq import nsmallest
+
+from sqlalchemy import event
+
+import loaders
+from models import db, User, Message, Follows
+from pagination import Page, paginate_messages
+
+SEARCH_LIMIT = 50
+AUTOCOMPLETE_LIMIT = 10
+MIN_TRIGRAM_QUERY = 3
+# Ids the in-process message index puts in one IN list; SQLite limits how
+# many parameters a statement may have (999 before 3.32).
+MAX_MATCHES = 900
+TEXT_SEARCH_CONFIG = 'english'
+
+WORD = re.compile(r'\w+')
+TERM = re.compile(r'"([^"]*)"?|(\w+)(\*?)')
+
+
+def trigrams(text):
+    """Return the set of 3-character substrings of `text`."""
+
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(a, b):
+    """Share of trigrams `a` and `b` have in common, from 0 to 1."""
+
+    a, b = trigrams(a), trigrams(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def escape_like(text):
+    """Escape LIKE wildcards in `text` (for use with escape='\\')."""
+
+    return (text.replace('\\', '\\\\')
+                .replace('%', '\\%')
+                .replace('_', '\\_'))
+
+
+def normalize(query):
+    return ' '.join((query or '').split()).lower()
+
+
+def parse_terms(query):
+    """Parse a message search query into (kind, value) terms.
+
+    Kinds are 'word', 'prefix' (from word*) and 'phrase' (from "quoted
+    words", with a tuple of words as the value).
+    """
+
+    terms = []
+    for phrase, word, star in TERM.findall((query or '').lower()):
+        if word:
+            terms.append(('prefix' if star else 'word', word))
+            continue
+
+        words = tuple(WORD.findall(phrase))
+        if len(words) > 1:
+            terms.append(('phrase', words))
+        elif words:
+            terms.append(('word', words[0]))
+    return terms
+
+
+def tsquery_text(terms):
+    """Write `terms` in PostgreSQL's to_tsquery syntax."""
+
+    parts = []
+    for kind, value in terms:
+        if kind == 'phrase':
+            parts.append('(' + ' <-> '.join(value) + ')')
+        elif kind == 'prefix':
+            parts.append(value + ':*')
+        else:
+            parts.append(value)
+    return ' & '.join(parts)
+
+
+class DatabaseUserIndex:
+    """User search run as SQL against trigram indexes (PostgreSQL)."""
+
+    def autocomplete(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """Return ids of users whose username starts with `prefix`."""
+
+        name = db.func.lower(User.username)
+        rows = (db.session
+                .query(User.id)
+                .filter(name.like(escape_like(prefix) + '%', escape='\\'))
+                .order_by(name, User.id)
+                .limit(limit))
+        return [user_id for user_id, in rows]
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Return ids of users matching `query`, best first."""
+
+        if len(query) < MIN_TRIGRAM_QUERY:
+            return self.autocomplete(query, limit)
+
+        pattern = '%' + escape_like(query) + '%'
+        name = db.func.lower(User.username)
+        rank = db.case(
+            (name == query, 0),
+            (name.like(escape_like(query) + '%', escape='\\'), 1),
+            (User.username.ilike(pattern, escape='\\'), 2),
+            else_=3)
+
+        rows = (db.session
+                .query(User.id)
+                .filter(db.or_(User.username.ilike(pattern, escape='\\'),
+                               User.bio.ilike(pattern, escape='\\'),
+                               User.location.ilike(pattern, escape='\\')))
+                .order_by(rank,
+                          db.func.similarity(User.username, query).desc(),
+                          User.id)
+                .limit(limit))
+        return [user_id for user_id, in rows]
+
+
+class MemoryUserIndex:
+    """In-process trigram index over usernames, bios and locations."""
+
+    def __init__(self):
+        self.loaded = False
+        self._docs = {}
+        self._postings = defaultdict(set)
+        self._names = []
+        self._lock = threading.RLock()
+
+    def load(self, rows=None):
+        """Index `rows` of (id, username, bio, location), replacing what was
+        indexed. Loads every user from the database by default.
+        """
+
+        if rows is None:
+            rows = db.session.query(User.id, User.username, User.bio,
+                                    User.location).all()
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._names = []
+            for user_id, *fields in rows:
+                self._names.append((self._index(user_id, fields), user_id))
+            self._names.sort()
+            self.loaded = True
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def _index(self, user_id, fields):
+        doc = tuple(normalize(field) for field in fields)
+        self._docs[user_id] = doc
+        for gram in set().union(*map(trigrams, doc)):
+            self._postings[gram].add(user_id)
+        return doc[0]
+
+    def add(self, user_id, username, bio=None, location=None):
+        """Index (or re-index) a user."""
+
+        with self._lock:
+            self.remove(user_id)
+            username = self._index(user_id, (username, bio, location))
+            insort(self._names, (username, user_id))
+
+    def remove(self, user_id):
+        with self._lock:
+            doc = self._docs.pop(user_id, None)
+            if doc is None:
+                return
+
+            for gram in set().union(*map(trigrams, doc)):
+                self._postings[gram].discard(user_id)
+                if not self._postings[gram]:
+                    del self._postings[gram]
+
+            i = bisect_left(self._names, (doc[0], user_id))
+            del self._names[i]
+
+    def autocomplete(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """Return ids of users whose username starts with `prefix`."""
+
+        self._ensure_loaded()
+        with self._lock:
+            ids = []
+            i = bisect_left(self._names, (prefix,))
+            while (len(ids) < limit and i < len(self._names)
+                   and self._names[i][0].startswith(prefix)):
+                ids.append(self._names[i][1])
+                i += 1
+            return ids
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Return ids of users matching `query`, best first."""
+
+        if len(query) < MIN_TRIGRAM_QUERY:
+            return self.autocomplete(query, limit)
+
+        self._ensure_loaded()
+        with self._lock:
+            postings = sorted((self._postings.get(gram, set())
+                               for gram in trigrams(query)), key=len)
+            candidates = set.intersection(*postings)
+
+            ranked = []
+            for user_id in candidates:
+                username, bio, location = self._docs[user_id]
+                if username == query:
+                    rank = 0
+                elif username.startswith(query):
+                    rank = 1
+                elif query in username:
+                    rank = 2
+                elif query in bio or query in location:
+                    ranked.append((3, 0, user_id))
+                    continue
+                else:
+                    continue
+                ranked.append((rank, -similarity(username, query), user_id))
+
+        return [user_id for *_, user_id in nsmallest(limit, ranked)]
+
+
+class DatabaseMessageIndex:
+    """Message search run as SQL against a full-text index (PostgreSQL)."""
+
+    def _config(self):
+        # Inlined so queries match the indexed to_tsvector() expression.
+        return db.literal_column(f"'{TEXT_SEARCH_CONFIG}'")
+
+    def _vector(self):
+        return db.func.to_tsvector(self._config(), Message.text)
+
+    def _tsquery(self, terms):
+        return db.func.to_tsquery(self._config(), tsquery_text(terms))
+
+    def matching(self, terms):
+        """Return a filter for messages matching `terms`."""
+
+        return self._vector().op('@@')(self._tsquery(terms))
+
+    def best(self, terms, messages, limit=SEARCH_LIMIT):
+        """Return ids of the best `limit` matches in `messages`."""
+
+        rank = db.func.ts_rank(self._vector(), self._tsquery(terms))
+        rows = (messages
+                .with_entities(Message.id)
+                .filter(self.matching(terms))
+                .order_by(rank.desc(), Message.timestamp.desc(),
+                          Message.id.desc())
+                .limit(limit))
+        return [message_id for message_id, in rows]
+
+
+class MemoryMessageIndex:
+    """In-process positional inverted index over message text."""
+
+    def __init__(self):
+        self.loaded = False
+        self._docs = {}
+        self._postings = defaultdict(dict)
+        self._vocabulary = []
+        self._lock = threading.RLock()
+
+    def load(self, rows=None):
+        """Index `rows` of (id, text), replacing what was indexed. Loads
+        every message from the database by default.
+        """
+
+        if rows is None:
+            rows = db.session.query(Message.id, Message.text).all()
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            for message_id, text in rows:
+                self._index(message_id, text)
+            self._vocabulary = sorted(self._postings)
+            self.loaded = True
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def _index(self, message_id, text):
+        """Index a message; return the words that are new to the index."""
+
+        words = WORD.findall(text.lower())
+        self._docs[message_id] = words
+
+        new = []
+        for position, word in enumerate(words):
+            if word not in self._postings:
+                new.append(word)
+            self._postings[word].setdefault(message_id, []).append(position)
+        return new
+
+    def add(self, message_id, text):
+        """Index (or re-index) a message."""
+
+        with self._lock:
+            self.remove(message_id)
+            for word in self._index(message_id, text):
+                insort(self._vocabulary, word)
+
+    def remove(self, message_id):
+        with self._lock:
+            words = self._docs.pop(message_id, None)
+            if words is None:
+                return
+
+            for word in set(words):
+                postings = self._postings[word]
+                del postings[message_id]
+                if not postings:
+                    del self._postings[word]
+                    del self._vocabulary[bisect_left(self._vocabulary, word)]
+
+    def _words_starting(self, prefix):
+        i = bisect_left(self._vocabulary, prefix)
+        while (i < len(self._vocabulary)
+               and self._vocabulary[i].startswith(prefix)):
+            yield self._vocabulary[i]
+            i += 1
+
+    def _occurrences(self, kind, value):
+        """Return {message id: times it matches} for one term."""
+
+        if kind == 'word':
+            return {message_id: len(positions) for message_id, positions
+                    in self._postings.get(value, {}).items()}
+
+        if kind == 'prefix':
+            found = defaultdict(int)
+            for word in self._words_starting(value):
+                for message_id, positions in self._postings[word].items():
+                    found[message_id] += len(positions)
+            return found
+
+        postings = [self._postings.get(word, {}) for word in value]
+        found = {}
+        for message_id, starts in postings[0].items():
+            count = sum(
+                all(start + offset in postings[offset].get(message_id, ())
+                    for offset in range(1, len(value)))
+                for start in starts)
+            if count:
+                found[message_id] = count
+        return found
+
+    def scores(self, terms):
+        """Return {message id: score} for messages matching all `terms`."""
+
+        self._ensure_loaded()
+        with self._lock:
+            matches = None
+            for term in terms:
+                found = self._occurrences(*term)
+                if matches is None:
+                    matches = dict(found)
+                else:
+                    matches = {message_id: count + found[message_id]
+                               for message_id, count in matches.items()
+                               if message_id in found}
+                if not matches:
+                    return {}
+
+            return {message_id: count / math.sqrt(len(self._docs[message_id]))
+                    for message_id, count in (matches or {}).items()}
+
+    def matching(self, terms):
+        """Return a filter for the newest MAX_MATCHES messages matching
+        `terms`.
+        """
+
+        return Message.id.in_(
+            sorted(self.scores(terms), reverse=True)[:MAX_MATCHES])
+
+    def best(self, terms, messages, limit=SEARCH_LIMIT):
+        """Return ids of the best `limit` matches in `messages`."""
+
+        scores = self.scores(terms)
+        ranked = sorted(scores, key=lambda message_id: (-scores[message_id],
+                                                         -message_id))
+        found = []
+        for start in range(0, len(ranked), MAX_MATCHES):
+            batch = ranked[start:start + MAX_MATCHES]
+            visible = {message_id for message_id, in messages
+                       .with_entities(Message.id)
+                       .filter(Message.id.in_(batch))}
+            found.extend(message_id for message_id in batch
+                         if message_id in visible)
+            if len(found) >= limit:
+                break
+        return found[:limit]
+
+
+def connect_search(app):
+    """Set up the user and message search indexes for `app`."""
+
+    backend = app.config.get('SEARCH_BACKEND')
+    if backend is None:
+        dialect = db.get_engine(app).dialect.name
+        backend = 'database' if dialect == 'postgresql' else 'memory'
+
+    if backend == 'memory':
+        app.extensions['user_search'] = MemoryUserIndex()
+        app.extensions['message_search'] = MemoryMessageIndex()
+    else:
+        app.extensions['user_search'] = DatabaseUserIndex()
+        app.extensions['message_search'] = DatabaseMessageIndex()
+
+
+def user_index():
+    return db.get_app().extensions.get('user_search')
+
+
+def message_index():
+    return db.get_app().extensions.get('message_search')
+
+
+def by_ids(query, ids, model=User):
+    """Load `ids` from `query` (all of `model` by default), in that order."""
+
+    if not ids:
+        return []
+    if query is None:
+        query = model.query
+
+    found = {row.id: row for row in query.filter(model.id.in_(ids))}
+    return [found[i] for i in ids if i in found]
+
+
+def find_users(query, users=None, limit=SEARCH_LIMIT):
+    """Return users matching `query`, best first.
+
+    `users` is the query to load them with, e.g. with loader options or
+    only some columns; it must select `User.id`.
+    """
+
+    query = normalize(query)
+    ids = user_index().search(query, limit) if query else []
+    return by_ids(users, ids)
+
+
+def autocomplete_users(prefix, users=None, limit=AUTOCOMPLETE_LIMIT):
+    """Return users whose username starts with `prefix`, alphabetically."""
+
+    prefix = normalize(prefix)
+    ids = user_index().autocomplete(prefix, limit) if prefix else []
+    return by_ids(users, ids)
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _user_saved(mapper, connection, user):
+    index = user_index()
+    if isinstance(index, MemoryUserIndex) and index.loaded:
+        index.add(user.id, user.username, user.bio, user.location)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, user):
+    index = user_index()
+    if isinstance(index, MemoryUserIndex):
+        index.remove(user.id)
+
+
+def visible_messages(viewer):
+    """Messages `viewer` may see: from public accounts, their own, and from
+    private accounts they follow.
+    """
+
+    followed = (db.select([Follows.user_being_followed_id])
+                .where(Follows.user_following_id == viewer.id))
+    return (Message.query
+            .join(User, User.id == Message.user_id)
+            .filter(db.or_(User.private.isnot(True),
+                           Message.user_id == viewer.id,
+                           Message.user_id.in_(followed))))
+
+
+def find_messages(query, viewer, order='recent', cursor=None,
+                  limit=SEARCH_LIMIT):
+    """Return a Page of messages matching `query` that `viewer` can see.
+
+    Ordered newest first and paginated by `cursor`, or, with `order` 'rank',
+    the best `limit` matches on one page.
+    """
+
+    terms = parse_terms(query)
+    if not terms:
+        return Page([], None)
+
+    index = message_index()
+    messages = visible_messages(viewer)
+
+    if order == 'rank':
+        ids = index.best(terms, messages, limit)
+        return Page(by_ids(loaders.message_cards(Message.query), ids,
+                           Message), None)
+
+    return paginate_messages(
+        loaders.message_cards(messages.filter(index.matching(terms))), cursor)
+
+
+@event.listens_for(Message, 'after_insert')
+@event.listens_for(Message, 'after_update')
+def _message_saved(mapper, connection, msg):
+    index = message_index()
+    if isinstance(index, MemoryMessageIndex) and index.loaded:
+        index.add(msg.id, msg.text)
+
+
+@event.listens_for(Message, 'after_delete')
+def _message_deleted(mapper, connection, msg):
+    index = message_index()
+    if isinstance(index, MemoryMessageIndex):
+        index.remove(msg.id)
@@ -1,18 +1,17 @@
 """Seed database with sample data from CSV Files."""
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+from flask_migrate import upgrade
 
-db.create_all()
+from app import app
+from bulk import import_data
+from counters import reconcile_counters, reconcile_like_counts
+from suggestions import rebuild_suggestions
+from timeline import rebuild_timelines
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
-
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
-
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
-
-db.session.commit()
+with app.app_context():
+    upgrade()
+    import_data('generator')
+    reconcile_counters()
+    reconcile_like_counts()
+    rebuild_timelines()
+    rebuild_suggestions()
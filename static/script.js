@@ -14,6 +14,83 @@ async function toggleLike(e){
     );
     if(resp.data.result === 'success'){
         $icon.toggleClass('fas far');
+        let $count = $(e.currentTarget).find('.like-count');
+        $count.text(Number($count.text()) + (resp.data.liked ? 1 : -1));
+    }
+}
+
+if($MESSAGE_AREA.data('stream')) streamMessages($MESSAGE_AREA.data('stream'));
+
+/** Prepend new messages from followed users as the server pushes them. */
+
+function streamMessages(url, seen = new Set()){
+    let source = new EventSource(url);
+    source.addEventListener('message', e => {
+        let {message, html} = JSON.parse(e.data);
+        if(seen.has(message.id)) return;
+        seen.add(message.id);
+        $MESSAGE_AREA.prepend(html);
+    });
+    // The browser retries dropped streams itself, but gives up when the
+    // server refuses one (e.g. too many open); try again later, from the
+    // newest message shown.
+    source.addEventListener('error', () => {
+        if(source.readyState !== EventSource.CLOSED) return;
+        let resume = new URL(url, window.location);
+        if(seen.size) resume.searchParams.set('last_event_id', Math.max(...seen));
+        setTimeout(() => streamMessages(resume.toString(), seen), 30000);
+    });
+}
+
+$('.container').on('click', '.load-more', loadMore);
+$(window).on('scroll', loadMoreOnScroll);
+
+/** Fetch the next page of a list as JSON and append it in place. */
+
+async function loadMore(e){
+    e.preventDefault();
+    let $button = $(e.currentTarget);
+    if($button.data('loading')) return;
+    $button.data('loading', true);
+
+    let resp = await axios.get($button.attr('href'), {params: {format: 'json'}});
+    $($button.data('target')).append(resp.data.html);
+    if(resp.data.next_url){
+        $button.attr('href', resp.data.next_url);
+        $button.data('loading', false);
+    } else {
+        $button.remove();
+    }
+}
+
+/** Load the next page once the "Load more" button scrolls into view. */
+
+function loadMoreOnScroll(){
+    let $button = $('.load-more').first();
+    if($button.length === 0) return;
+    let viewportBottom = $(window).scrollTop() + $(window).height();
+    if($button.offset().top < viewportBottom + 200){
+        $button.trigger('click');
+    }
+}
+
+$('#search').on('input', suggestUsers);
+
+/** Offer usernames starting with what's typed in the search box. */
+
+async function suggestUsers(e){
+    let q = $(e.currentTarget).val().trim();
+    if(!q) return;
+    let resp;
+    try {
+        resp = await axios.get('/api/users/autocomplete', {params: {q}});
+    } catch(err) {
+        return;
+    }
+    if($(e.currentTarget).val().trim() !== q) return;
+    let $list = $('#search-suggestions').empty();
+    for(let user of resp.data.users){
+        $list.append($('<option>').val(user.username));
     }
 }
 
@@ -0,0 +1,193 @@
+"""Precomputed "who to follow" suggestions.
+
+Accounts are suggested to a user when the people they follow follow them
+too: a candidate's score is how many of the user's follows follow it, and
+each user keeps their TOP_K best candidates in the `suggestions` table,
+which /users/suggestions reads with one indexed query.
+
+`rebuild_suggestions()` (`flask rebuild-suggestions`) recomputes every user
+from a `FollowGraph` built once from the follows table. Scoring a user
+walks the follow lists of the accounts they follow, counting candidates
+with `Counter`, which counts in C, and keeps the best TOP_K with a heap.
+Users are scored in chunks across a pool of forked processes that share
+the graph's arrays copy-on-write; the parent writes each chunk's results.
+
+Between rebuilds, following or unfollowing someone rescores just that user
+with one two-hop SQL query (`refresh_user()`), as long as they follow no
+more than INLINE_LIMIT accounts. Past that, the change only drops the newly
+followed account from their list, and the next rebuild catches up. Other
+users' scores change only at the next rebuild.
+"""
+
+import heapq
+import multiprocessing
+import os
+from collections import Counter
+
+from followgraph import FollowGraph
+from models import db, Follows, Suggestion, User
+
+TOP_K = 20
+CHUNK_SIZE = 1000
+INLINE_LIMIT = 500
+
+# The graph being scored, shared with forked workers.
+_graph = None
+
+
+def top_candidates(graph, user_id, k=TOP_K):
+    """[(candidate id, score)] for `user_id`, best first."""
+
+    following = graph.following(user_id)
+    counts = Counter()
+    for followed_id in following:
+        counts.update(graph.following(followed_id))
+
+    counts.pop(user_id, None)
+    for followed_id in following:
+        counts.pop(followed_id, None)
+
+    # Ties go to the lower (older) id, so results are stable.
+    return heapq.nlargest(k, counts.items(),
+                          key=lambda item: (item[1], -item[0]))
+
+
+def _score_chunk(args):
+    user_ids, k = args
+    return [(user_id, top_candidates(_graph, user_id, k))
+            for user_id in user_ids]
+
+
+def score_users(graph, user_ids, workers=1, k=TOP_K, chunk_size=CHUNK_SIZE):
+    """Yield [(user id, candidates)] for chunks of `user_ids`, in any order.
+
+    Uses `workers` forked processes when there's more than one chunk.
+    """
+
+    global _graph
+
+    chunks = [(user_ids[i:i + chunk_size], k)
+              for i in range(0, len(user_ids), chunk_size)]
+    _graph = graph
+    try:
+        if workers > 1 and len(chunks) > 1:
+            context = multiprocessing.get_context('fork')
+            with context.Pool(min(workers, len(chunks))) as pool:
+                yield from pool.imap_unordered(_score_chunk, chunks)
+        else:
+            yield from map(_score_chunk, chunks)
+    finally:
+        _graph = None
+
+
+def _store(scored):
+    """Replace the suggestions of each user in `scored`."""
+
+    (Suggestion
+        .query
+        .filter(Suggestion.user_id.in_([user_id for user_id, _ in scored]))
+        .delete(synchronize_session=False))
+
+    rows = [{'user_id': user_id, 'suggested_id': candidate_id,
+             'score': score}
+            for user_id, candidates in scored
+            for candidate_id, score in candidates]
+    if rows:
+        db.session.execute(Suggestion.__table__.insert(), rows)
+
+
+def rebuild_suggestions(workers=None, k=TOP_K, echo=print):
+    """Recompute every user's suggestions; return how many users have some.
+
+    Scores in `workers` processes (default: one per CPU), committing after
+    each chunk of CHUNK_SIZE users.
+    """
+
+    graph = FollowGraph.from_database()
+    user_ids = graph.active_ids()
+    workers = workers or os.cpu_count() or 1
+    echo(f"Loaded {len(graph)} follows by {len(user_ids)} users.")
+
+    # Users who follow nobody have nothing to suggest.
+    (Suggestion
+        .query
+        .filter(Suggestion.user_id.notin_(
+            db.select([Follows.user_following_id])))
+        .delete(synchronize_session=False))
+    db.session.commit()
+
+    if workers > 1 and len(user_ids) > CHUNK_SIZE:
+        # Forked workers mustn't inherit the parent's connections.
+        db.engine.dispose()
+
+    suggested = scored_users = 0
+    for scored in score_users(graph, user_ids, workers, k):
+        _store(scored)
+        db.session.commit()
+        suggested += sum(1 for _, candidates in scored if candidates)
+        scored_users += len(scored)
+        echo(f"Scored {scored_users} of {len(user_ids)} users.")
+
+    return suggested
+
+
+def refresh_user(user_id, k=TOP_K):
+    """Rescore one user with SQL after their follows change."""
+
+    mine = db.aliased(Follows)
+    theirs = db.aliased(Follows)
+    already_following = (db.select([Follows.user_being_followed_id])
+                         .where(Follows.user_following_id == user_id)
+                         .where(Follows.user_being_followed_id
+                                == theirs.user_being_followed_id)
+                         .exists())
+    score = db.func.count().label('score')
+
+    candidates = (db.session
+                  .query(theirs.user_being_followed_id, score)
+                  .select_from(mine)
+                  .join(theirs, theirs.user_following_id
+                        == mine.user_being_followed_id)
+                  .filter(mine.user_following_id == user_id)
+                  .filter(theirs.user_being_followed_id != user_id)
+                  .filter(~already_following)
+                  .group_by(theirs.user_being_followed_id)
+                  .order_by(score.desc(), theirs.user_being_followed_id)
+                  .limit(k)
+                  .all())
+    _store([(user_id, candidates)])
+
+
+def follows_changed(user, followed_ids):
+    """Update `user`'s suggestions after they follow or unfollow accounts.
+
+    `user` may be the cached identity; its following_count is read fresh.
+    """
+
+    following_count = (db.session.query(User.following_count)
+                       .filter(User.id == user.id).scalar())
+    if following_count <= INLINE_LIMIT:
+        refresh_user(user.id)
+    else:
+        for followed_id in followed_ids:
+            drop([user.id], followed_id)
+
+
+def drop(user_ids, suggested_id):
+    """Stop suggesting `suggested_id` to `user_ids`, who now follow it."""
+
+    (Suggestion
+        .query
+        .filter(Suggestion.user_id.in_(user_ids))
+        .filter(Suggestion.suggested_id == suggested_id)
+        .delete(synchronize_session=False))
+
+
+def suggested_users(user):
+    """Query of (User, score) suggested to `user`, best first."""
+
+    return (db.session
+            .query(User, Suggestion.score)
+            .join(Suggestion, Suggestion.suggested_id == User.id)
+            .filter(Suggestion.user_id == user.id)
+            .order_by(Suggestion.score.desc(), User.id))
@@ -0,0 +1,181 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import timeline
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class APITestCase(TestCase):
+    """Test the /api/v1 endpoints."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        reader = User(username="reader", email="reader@test.com",
+                      password=PASSWORD)
+        author = User(username="author", email="author@test.com",
+                      password=PASSWORD, bio="Writes a lot")
+        hidden = User(username="hidden", email="hidden@test.com",
+                      password=PASSWORD, private=True)
+        db.session.add_all([reader, author, hidden])
+        db.session.flush()
+
+        reader.following.append(author)
+        db.session.add_all([Message(text=f"Post {i}", user_id=author.id)
+                            for i in range(5)])
+        db.session.add(Message(text="Secret", user_id=hidden.id))
+        db.session.commit()
+        timeline.rebuild_timelines()
+
+        self.reader_id = reader.id
+        self.author_id = author.id
+        self.hidden_id = hidden.id
+        self.message_ids = [msg.id for msg in
+                            Message.query.order_by(Message.id)]
+
+        app.extensions['identity_cache'].clear()
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.reader_id
+
+    def tearDown(self):
+        """Clean up fouled transactions and cached users."""
+
+        db.session.rollback()
+        app.extensions['identity_cache'].clear()
+
+    def get(self, url, status=200, **params):
+        resp = self.client.get(url, query_string=params)
+        self.assertEqual(resp.status_code, status, resp.json)
+        return resp.json
+
+    def test_logged_out(self):
+        with self.client.session_transaction() as sess:
+            del sess[CURR_USER_KEY]
+        resp = self.client.get("/api/v1/timeline")
+        self.assertEqual(resp.status_code, 403)
+        self.assertIn('error', resp.json)
+
+    def test_timeline_pages(self):
+        first = self.get("/api/v1/timeline", limit=3, fields="id,text")
+        self.assertEqual([msg['text'] for msg in first['data']],
+                         ["Post 4", "Post 3", "Post 2"])
+        self.assertEqual(set(first['data'][0]), {'id', 'text'})
+
+        second = self.get("/api/v1/timeline", limit=3,
+                          cursor=first['next_cursor'], fields="text")
+        self.assertEqual([msg['text'] for msg in second['data']],
+                         ["Post 1", "Post 0"])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_include_users(self):
+        body = self.get("/api/v1/timeline", include="users",
+                        user_fields="username")
+        self.assertEqual(body['users'],
+                         {str(self.author_id): {'id': self.author_id,
+                                                'username': "author"}})
+
+    def test_unknown_fields(self):
+        body = self.get("/api/v1/users/1", status=400, fields="id,password")
+        self.assertIn("password", body['error'])
+
+    def test_profile(self):
+        body = self.get(f"/api/v1/users/{self.author_id}")
+        user = body['data']
+        self.assertEqual(user['username'], "author")
+        self.assertEqual(user['bio'], "Writes a lot")
+        self.assertTrue(user['following'])
+        self.assertNotIn('password', user)
+        self.assertNotIn('email', user)
+
+    def test_private_messages(self):
+        self.get(f"/api/v1/users/{self.hidden_id}/messages", status=403)
+
+        body = self.get("/api/v1/messages",
+                        ids=",".join(map(str, self.message_ids)))
+        self.assertNotIn("Secret", [msg['text'] for msg in body['data']])
+
+    def test_followers_and_following(self):
+        body = self.get(f"/api/v1/users/{self.author_id}/followers",
+                        fields="username")
+        self.assertEqual(body['data'], [{'username': "reader"}])
+
+        body = self.get(f"/api/v1/users/{self.reader_id}/following",
+                        fields="id")
+        self.assertEqual(body['data'], [{'id': self.author_id}])
+
+    def test_batches(self):
+        ids = [self.message_ids[2], 999999, self.message_ids[0]]
+        body = self.get("/api/v1/messages", ids=",".join(map(str, ids)),
+                        fields="id")
+        self.assertEqual(body['data'], [{'id': self.message_ids[2]},
+                                        {'id': self.message_ids[0]}])
+
+        body = self.get("/api/v1/users",
+                        ids=f"{self.author_id},{self.reader_id}",
+                        fields="username")
+        self.assertEqual(body['data'], [{'username': "author"},
+                                        {'username': "reader"}])
+
+        self.get("/api/v1/users", status=400, ids="1,two")
+        self.get("/api/v1/users", status=400,
+                 ids=",".join(map(str, range(101))))
+
+    def test_like_batch(self):
+        first, second, third = self.message_ids[:3]
+        secret = self.message_ids[-1]
+
+        resp = self.client.post("/api/v1/likes",
+                                json={'like': [first, second, secret]})
+        self.assertEqual(resp.json['data'],
+                         {'liked': [first, second], 'unliked': []})
+
+        resp = self.client.post("/api/v1/likes",
+                                json={'like': [third, first],
+                                      'unlike': [second]})
+        self.assertEqual(resp.json['data'],
+                         {'liked': [third], 'unliked': [second]})
+
+        # A string isn't a list of its digits.
+        resp = self.client.post("/api/v1/likes", json={'unlike': "12"})
+        self.assertEqual(resp.status_code, 400)
+
+        body = self.get(f"/api/v1/users/{self.reader_id}/likes",
+                        fields="id,liked")
+        self.assertEqual(body['data'], [{'id': third, 'liked': True},
+                                        {'id': first, 'liked': True}])
+        self.assertEqual(User.query.get(self.reader_id).likes_count, 2)
+
+        body = self.get("/api/v1/messages", ids=f"{first},{second}",
+                        fields="like_count")
+        self.assertEqual(body['data'], [{'like_count': 1}, {'like_count': 0}])
+
+    def test_message(self):
+        msg_id = self.message_ids[0]
+        body = self.get(f"/api/v1/messages/{msg_id}")
+        self.assertEqual(body['data']['text'], "Post 0")
+        self.assertFalse(body['data']['liked'])
+
+        self.get(f"/api/v1/messages/{self.message_ids[-1]}", status=404)
@@ -0,0 +1,119 @@
+"""Bulk import/export tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_bulk.py
+
+
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import bulk
+
+app.config['TESTING'] = True
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class BulkTestCase(TestCase):
+    """Test exporting and re-importing data."""
+
+    def setUp(self):
+        self.clear()
+
+        users = [User(username=f"user{i}", email=f"user{i}@test.com",
+                      password=PASSWORD, private=(i == 0))
+                 for i in range(3)]
+        db.session.add_all(users)
+        db.session.flush()
+        for i in range(5):
+            users[i % 3].messages.append(Message(text=f"message {i}"))
+        users[0].following.append(users[1])
+        users[1].likes.append(users[0].messages[0])
+        db.session.commit()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.quiet = lambda line: None
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        self.tmp.cleanup()
+
+    def clear(self):
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def snapshot(self):
+        return (
+            [(u.id, u.username, u.private) for u in User.query.order_by(User.id)],
+            [(m.id, m.text, m.timestamp, m.user_id)
+             for m in Message.query.order_by(Message.id)],
+            db.session.query(Follows.user_following_id,
+                             Follows.user_being_followed_id).all(),
+            db.session.query(Like.user_id, Like.message_id).all(),
+        )
+
+    def index_names(self):
+        return sorted(name for name, in db.session.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"))
+
+    def test_round_trip(self):
+        """Does exporting then importing restore the same rows?"""
+
+        before = self.snapshot()
+        indexes = self.index_names()
+        self.assertEqual(bulk.export_data(self.tmp.name, self.quiet), 10)
+
+        self.clear()
+        self.assertEqual(
+            bulk.import_data(self.tmp.name, chunk_size=2, echo=self.quiet), 10)
+
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(self.index_names(), indexes)
+
+    def test_resume(self):
+        """Does a failed import pick up where it stopped?"""
+
+        before = self.snapshot()
+        indexes = self.index_names()
+        bulk.export_data(self.tmp.name, self.quiet)
+        self.clear()
+
+        path = os.path.join(self.tmp.name, 'messages.csv')
+        with open(path, newline='') as f:
+            rows = list(csv.reader(f))
+        broken = [row[:] for row in rows]
+        broken[4][rows[0].index('text')] = ''
+
+        with open(path, 'w', newline='') as f:
+            csv.writer(f).writerows(broken)
+        with self.assertRaises(IntegrityError):
+            bulk.import_data(self.tmp.name, chunk_size=2, echo=self.quiet)
+        db.session.rollback()
+        self.assertEqual(Message.query.count(), 2)
+
+        with open(path, 'w', newline='') as f:
+            csv.writer(f).writerows(rows)
+        lines = []
+        bulk.import_data(self.tmp.name, chunk_size=2, echo=lines.append)
+
+        self.assertIn("messages: resuming after 2 rows", lines)
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(self.index_names(), indexes)
@@ -0,0 +1,157 @@
+"""Denormalized counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from counters import adjust, reconcile_counters, reconcile_like_counts
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['RAISE_ON_LAZY_LOAD'] = True
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class CountersTestCase(TestCase):
+    """Test that routes keep User counters in step with the data."""
+
+    def setUp(self):
+        """Create two unconnected users."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        user = User(username="counted", email="counted@test.com",
+                    password=PASSWORD)
+        other = User(username="other", email="other@test.com",
+                     password=PASSWORD)
+        db.session.add_all([user, other])
+        db.session.commit()
+
+        self.user_id = user.id
+        self.other_id = other.id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def counts(self, user_id):
+        user = User.query.get(user_id)
+        db.session.refresh(user)
+        return (user.messages_count, user.following_count,
+                user.followers_count, user.likes_count)
+
+    def like_count(self, msg_id):
+        return (db.session.query(Message.like_count)
+                .filter(Message.id == msg_id).scalar())
+
+    def login(self, client, user_id):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_follow_counts(self):
+        """Do follow and unfollow update both users' counts?"""
+
+        with self.client as client:
+            self.login(client, self.user_id)
+
+            client.post(f"/users/follow/{self.other_id}")
+            self.assertEqual(self.counts(self.user_id), (0, 1, 0, 0))
+            self.assertEqual(self.counts(self.other_id), (0, 0, 1, 0))
+
+            client.post(f"/users/stop-following/{self.other_id}")
+            client.post(f"/users/stop-following/{self.other_id}")
+            self.assertEqual(self.counts(self.user_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.other_id), (0, 0, 0, 0))
+
+    def test_message_and_like_counts(self):
+        """Do posting, liking and deleting update counts?"""
+
+        with self.client as client:
+            self.login(client, self.other_id)
+            resp = client.post("/api/messages/new", json={"text": "hi"})
+            msg_id = resp.json['msg']['id']
+            self.assertEqual(self.counts(self.other_id), (1, 0, 0, 0))
+
+            self.login(client, self.user_id)
+            client.post(f"/api/messages/{msg_id}/like")
+            self.assertEqual(self.counts(self.user_id), (0, 0, 0, 1))
+            self.assertEqual(self.like_count(msg_id), 1)
+
+            self.login(client, self.other_id)
+            client.post(f"/messages/{msg_id}/delete")
+            self.assertEqual(self.counts(self.other_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.user_id), (0, 0, 0, 0))
+
+    def test_reconcile_counters(self):
+        """Does reconciling fix drifted counts and only those?"""
+
+        user = User.query.get(self.user_id)
+        other = User.query.get(self.other_id)
+        user.following.append(other)
+        other.messages.append(Message(text="hi"))
+        db.session.commit()
+
+        self.assertEqual(reconcile_counters(), 2)
+        self.assertEqual(self.counts(self.user_id), (0, 1, 0, 0))
+        self.assertEqual(self.counts(self.other_id), (1, 0, 1, 0))
+        self.assertEqual(reconcile_counters(), 0)
+
+    def test_like_count_on_user_delete(self):
+        """Does deleting a user take their likes off messages' counts?"""
+
+        with self.client as client:
+            self.login(client, self.other_id)
+            resp = client.post("/api/messages/new", json={"text": "hi"})
+            msg_id = resp.json['msg']['id']
+
+            self.login(client, self.user_id)
+            client.post(f"/api/messages/{msg_id}/like")
+            client.post("/users/delete")
+
+        self.assertEqual(self.like_count(msg_id), 0)
+
+    def test_reconcile_like_counts(self):
+        other = User.query.get(self.other_id)
+        liked = Message(text="liked")
+        other.messages.extend([liked, Message(text="not liked")])
+        db.session.commit()
+        db.session.add(Like(user_id=self.user_id, message_id=liked.id))
+        db.session.commit()
+
+        self.assertEqual(reconcile_like_counts(), 1)
+        self.assertEqual(self.like_count(liked.id), 1)
+        self.assertEqual(reconcile_like_counts(), 0)
+
+    def test_cache_forgotten_on_commit(self):
+        """Are cached identities only dropped once the counts commit?"""
+
+        with app.app_context():
+            cache = app.extensions['identity_cache']
+            cache.set(self.user_id, {'likes_count': 0})
+
+            adjust([self.user_id], User.likes_count, 1)
+            db.session.rollback()
+            self.assertIsNotNone(cache.get(self.user_id))
+
+            adjust([self.user_id], User.likes_count, 1)
+            self.assertIsNotNone(cache.get(self.user_id))
+            db.session.commit()
+            self.assertIsNone(cache.get(self.user_id))
@@ -0,0 +1,111 @@
+"""Connection pool configuration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_deploy.py
+
+
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import create_engine, exc
+
+import deploy
+from deploy import TimedQueuePool, engine_options, pool_metrics
+from models import db
+
+POSTGRES = "postgresql:///warbler"
+
+
+class EngineOptionsTestCase(TestCase):
+    """Test SQLALCHEMY_ENGINE_OPTIONS from the environment."""
+
+    def test_sqlite_untouched(self):
+        self.assertEqual(engine_options("sqlite://", {'DB_POOL_SIZE': '5'}),
+                         {})
+
+    def test_pool_matches_worker_concurrency(self):
+        sizes = {
+            'sync': 1,
+            'gthread': deploy.DEFAULT_THREADS,
+            'gevent': deploy.DEFAULT_GEVENT_POOL_SIZE,
+        }
+        for kind, size in sizes.items():
+            options = engine_options(POSTGRES, {'GUNICORN_WORKER_CLASS': kind})
+            self.assertEqual(options['pool_size'], size, kind)
+
+        options = engine_options(POSTGRES, {'GUNICORN_THREADS': '8',
+                                            'WRITE_BEHIND': '1'})
+        self.assertEqual(options['pool_size'], 9)
+        self.assertIs(options['poolclass'], TimedQueuePool)
+        self.assertTrue(options['pool_pre_ping'])
+
+    def test_overrides(self):
+        options = engine_options(POSTGRES, {
+            'DB_POOL_SIZE': '3', 'DB_MAX_OVERFLOW': '0',
+            'DB_POOL_TIMEOUT': '2.5', 'DB_POOL_RECYCLE': '60',
+            'DB_POOL_PRE_PING': '0', 'DB_STATEMENT_TIMEOUT': '5000'})
+        self.assertEqual(
+            {key: options[key] for key in ('pool_size', 'max_overflow',
+                                           'pool_timeout', 'pool_recycle',
+                                           'pool_pre_ping')},
+            {'pool_size': 3, 'max_overflow': 0, 'pool_timeout': 2.5,
+             'pool_recycle': 60, 'pool_pre_ping': False})
+        self.assertEqual(options['connect_args'],
+                         {'options': '-c statement_timeout=5000'})
+
+    def test_pgbouncer_no_session_settings(self):
+        """Is the statement timeout left off connections behind PgBouncer?"""
+
+        options = engine_options(POSTGRES, {'PGBOUNCER': '1',
+                                            'DB_STATEMENT_TIMEOUT': '5000'})
+        self.assertNotIn('connect_args', options)
+
+    def test_pgbouncer_timeout_on_app_engine(self):
+        """Is the per-transaction timeout only set on the app's engine?"""
+
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = POSTGRES
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(app)
+        deploy.init_app(app, {'PGBOUNCER': '1',
+                              'DB_STATEMENT_TIMEOUT': '5000'})
+
+        self.assertEqual(len(db.get_engine(app).dispatch.begin), 1)
+        self.assertEqual(len(create_engine(POSTGRES).dispatch.begin), 0)
+
+
+class TimedQueuePoolTestCase(TestCase):
+    """Test checkout wait metrics."""
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://", poolclass=TimedQueuePool,
+                                    pool_size=1, max_overflow=0,
+                                    pool_timeout=0.05)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_checkouts_and_timeouts(self):
+        pool = self.engine.pool
+        conn = self.engine.connect()
+        with self.assertRaises(exc.TimeoutError):
+            self.engine.connect()
+        conn.close()
+
+        self.assertEqual(pool.checkouts, 2)
+        self.assertEqual(pool.timeouts, 1)
+        self.assertGreaterEqual(pool.wait_seconds, 0.05)
+
+    def test_pool_metrics(self):
+        with self.engine.connect():
+            lines = pool_metrics(self.engine.pool)
+
+        self.assertIn('warbler_db_pool_size 1', lines)
+        self.assertIn('warbler_db_pool_checked_out 1', lines)
+        self.assertIn('warbler_db_pool_overflow 0', lines)
+        self.assertIn('warbler_db_pool_checkouts_total 1', lines)
+
+    def test_other_pools_skipped(self):
+        engine = create_engine("sqlite://")
+        self.assertEqual(pool_metrics(engine.pool), [])
@@ -0,0 +1,177 @@
+"""Follow request inbox tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_follow_requests.py
+
+
+import os
+from unittest import TestCase
+
+from models import (db, User, Message, Follows, FollowRequest, Like,
+                    TimelineEntry)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from counters import reconcile_counters
+from follow_requests import inbox
+from pagination import paginate_requests
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class FollowRequestTestCase(TestCase):
+    """Test asking to follow private users and deciding in bulk."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        FollowRequest.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        private = User(username="private", email="private@test.com",
+                       password=PASSWORD, private=True)
+        fans = [User(username=f"fan{i}", email=f"fan{i}@test.com",
+                     password=PASSWORD) for i in range(3)]
+        db.session.add_all([private] + fans)
+        db.session.flush()
+        db.session.add(Message(text="Members only", user_id=private.id))
+        db.session.commit()
+        reconcile_counters()
+
+        self.private_id = private.id
+        self.fan_ids = [fan.id for fan in fans]
+
+        app.extensions['identity_cache'].clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions and cached users."""
+
+        db.session.rollback()
+        app.extensions['identity_cache'].clear()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def ask(self, *fan_ids):
+        for fan_id in fan_ids:
+            self.login(fan_id)
+            self.client.post(f"/users/follow/{self.private_id}")
+
+    def decide(self, action, *fan_ids):
+        self.login(self.private_id)
+        return self.client.post("/requests", data={
+            'action': action, 'requester_id': [str(i) for i in fan_ids]},
+            follow_redirects=True)
+
+    def user(self, user_id):
+        user = User.query.get(user_id)
+        db.session.refresh(user)
+        return user
+
+    def statuses(self):
+        return {r.to_id: r.status for r in
+                FollowRequest.query.filter_by(from_id=self.private_id)}
+
+    def test_badge_and_inbox(self):
+        self.ask(*self.fan_ids)
+        self.assertEqual(self.user(self.private_id).pending_requests_count, 3)
+
+        self.login(self.private_id)
+        html = self.client.get("/requests").get_data(as_text=True)
+        self.assertIn('badge-pill badge-primary">3<', html)
+        for i in range(3):
+            self.assertIn(f"@fan{i}", html)
+
+        html = self.client.get(f"/users/{self.private_id}").get_data(
+            as_text=True)
+        self.assertNotIn("@fan0", html)
+
+    def test_inbox_pages(self):
+        self.ask(*self.fan_ids)
+        self.login(self.private_id)
+
+        html = self.client.get("/requests").get_data(as_text=True)
+        self.assertLess(html.index("@fan2"), html.index("@fan0"))
+
+        private = User.query.get(self.private_id)
+        first = paginate_requests(inbox(private), per_page=2)
+        second = paginate_requests(inbox(private), first.next_cursor,
+                                   per_page=2)
+        self.assertEqual([user.id for _, user in first.items + second.items],
+                         self.fan_ids[::-1])
+        self.assertIsNone(second.next_cursor)
+
+    def test_bulk_approve(self):
+        """Does approving several requests at once follow, count and fill
+        timelines?"""
+
+        self.ask(*self.fan_ids)
+        resp = self.decide('approve', self.fan_ids[0], self.fan_ids[1],
+                           999999)
+        self.assertIn("2 follow requests approved.",
+                      resp.get_data(as_text=True))
+
+        private = self.user(self.private_id)
+        self.assertEqual(private.pending_requests_count, 1)
+        self.assertEqual(private.followers_count, 2)
+        self.assertEqual(self.user(self.fan_ids[0]).following_count, 1)
+        self.assertEqual(
+            {f.user_following_id for f in
+             Follows.query.filter_by(user_being_followed_id=self.private_id)},
+            set(self.fan_ids[:2]))
+        self.assertEqual(self.statuses(), {self.fan_ids[0]: 'approved',
+                                           self.fan_ids[1]: 'approved',
+                                           self.fan_ids[2]: 'pending'})
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=self.fan_ids[0]).count(), 1)
+
+        # Approving again changes nothing.
+        self.decide('approve', self.fan_ids[0])
+        self.assertEqual(self.user(self.private_id).followers_count, 2)
+        self.assertEqual(reconcile_counters(), 0)
+
+        html = self.client.get("/requests?status=approved").get_data(
+            as_text=True)
+        self.assertIn("@fan0", html)
+        self.assertNotIn("@fan2", html)
+
+    def test_reject_and_ask_again(self):
+        self.ask(self.fan_ids[0])
+        self.decide('reject', self.fan_ids[0])
+
+        self.assertEqual(self.statuses(), {self.fan_ids[0]: 'rejected'})
+        self.assertEqual(self.user(self.private_id).pending_requests_count, 0)
+        self.assertEqual(self.user(self.private_id).followers_count, 0)
+
+        self.ask(self.fan_ids[0])
+        self.assertEqual(self.statuses(), {self.fan_ids[0]: 'pending'})
+        self.assertEqual(self.user(self.private_id).pending_requests_count, 1)
+
+    def test_only_own_requests(self):
+        """Can a user only decide requests sent to them?"""
+
+        self.ask(self.fan_ids[0])
+        self.login(self.fan_ids[1])
+        self.client.post("/requests", data={
+            'action': 'approve', 'requester_id': str(self.fan_ids[0])})
+
+        self.assertEqual(self.statuses(), {self.fan_ids[0]: 'pending'})
+        self.assertEqual(Follows.query.count(), 0)
+
+    def test_requester_deleted(self):
+        self.ask(self.fan_ids[0])
+        self.login(self.fan_ids[0])
+        self.client.post("/users/delete")
+
+        self.assertEqual(self.user(self.private_id).pending_requests_count, 0)
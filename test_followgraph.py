@@ -0,0 +1,191 @@
+"""Follow graph index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_followgraph.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import (db, User, Message, Follows, FollowRequest, Like,
+                    Suggestion, TimelineEntry)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from counters import reconcile_counters
+from followgraph import (FollowGraph, GraphIndex, follow_added, graph_index,
+                         intersect, read_snapshot, write_snapshot)
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+# 1 and 2 follow each other; 2 and 3 follow 4; 4 follows 1.
+EDGES = [(1, 2), (2, 1), (2, 4), (3, 4), (4, 1)]
+
+
+def graphs(edges):
+    return (FollowGraph.from_edges(sorted(edges)),
+            FollowGraph.from_edges(sorted((b, a) for a, b in edges)))
+
+
+class GraphIndexTestCase(TestCase):
+    """Test the index without the database."""
+
+    def setUp(self):
+        self.index = GraphIndex()
+        self.index.load(*graphs(EDGES))
+
+    def test_intersect(self):
+        self.assertEqual(intersect([1, 3, 5], [2, 3, 4, 5]), [3, 5])
+        self.assertEqual(intersect([7], list(range(100))), [7])
+        self.assertEqual(intersect([], [1]), [])
+
+    def test_queries(self):
+        self.assertEqual(list(self.index.followers(4)), [2, 3])
+        self.assertTrue(self.index.follows(4, 1))
+        self.assertFalse(self.index.follows(1, 4))
+        self.assertEqual(self.index.mutuals(1), [2])
+        self.assertEqual(self.index.followers_you_know(1, 4), [2])
+        self.assertEqual(self.index.followers_you_know(3, 99), [])
+
+    def test_apply(self):
+        self.index.apply([(1, 4, True), (2, 1, False)])
+        self.assertEqual(list(self.index.following(1)), [2, 4])
+        self.assertEqual(list(self.index.followers(4)), [1, 2, 3])
+        self.assertEqual(self.index.mutuals(1), [4])
+
+        self.index.apply([], removed_user_ids=[4])
+        self.assertEqual(list(self.index.following(1)), [2])
+        self.assertEqual(list(self.index.followers(1)), [])
+        self.assertEqual(list(self.index.following(3)), [])
+
+    def test_snapshot(self):
+        """Does a mapped snapshot answer like the graphs it was written
+        from?"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph')
+            write_snapshot(path, *graphs(EDGES))
+            following, followers = read_snapshot(path)
+            self.assertEqual(list(following.following(2)), [1, 4])
+            self.assertEqual(list(followers.following(1)), [2, 4])
+
+            index = GraphIndex(path)
+            self.assertFalse(index.follows(4, 1))
+            index.refresh()
+            self.assertEqual(index.followers_you_know(1, 4), [2])
+            index.apply([(3, 1, True)])
+            self.assertEqual(list(index.followers(1)), [2, 3, 4])
+
+            # Refreshing picks up a replaced snapshot.
+            write_snapshot(path, *graphs(EDGES + [(1, 3)]))
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            index.apply([(3, 1, False)])
+            index.refresh()
+            self.assertEqual(list(index.followers(3)), [1])
+
+
+class ProfileSocialTestCase(TestCase):
+    """Test the follow graph hints on profile pages."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Suggestion.query.delete()
+        Like.query.delete()
+        FollowRequest.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        users = [User(username=f"user{i}", email=f"user{i}@test.com",
+                      password=PASSWORD) for i in range(4)]
+        db.session.add_all(users)
+        db.session.flush()
+        self.ids = [user.id for user in users]
+
+        ids = [None] + self.ids
+        db.session.add_all([Follows(user_following_id=ids[a],
+                                    user_being_followed_id=ids[b])
+                            for a, b in EDGES])
+        db.session.commit()
+        reconcile_counters()
+
+        app.extensions['identity_cache'].clear()
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.ids[0]
+
+        with app.app_context():
+            self.index = graph_index()
+            self.index.load()
+
+    def tearDown(self):
+        """Clean up fouled transactions and cached users."""
+
+        db.session.rollback()
+        app.extensions['identity_cache'].clear()
+
+    def profile(self, user_id):
+        return self.client.get(f"/users/{user_id}").get_data(as_text=True)
+
+    def test_profile(self):
+        html = self.profile(self.ids[3])
+        self.assertIn("Follows you", html)
+        self.assertIn("Followed by", html)
+        self.assertIn("@user1</a>", html)
+        self.assertNotIn("other", html)
+
+        html = self.profile(self.ids[0])
+        self.assertNotIn("Follows you", html)
+        self.assertIn("1 mutual follow<", html)
+
+    def test_profile_before_load(self):
+        """Do profiles skip the hints, rather than load the graph?"""
+
+        app.extensions['follow_graph'] = GraphIndex()
+        try:
+            html = self.profile(self.ids[3])
+            self.assertNotIn("Follows you", html)
+            self.assertFalse(app.extensions['follow_graph'].loaded)
+        finally:
+            app.extensions['follow_graph'] = self.index
+
+    def test_follow_hooks(self):
+        """Are follows applied to the index when they commit?"""
+
+        self.profile(self.ids[2])
+        self.client.post(f"/users/follow/{self.ids[2]}")
+        with app.app_context():
+            self.assertTrue(graph_index().follows(self.ids[0], self.ids[2]))
+
+        self.client.post(f"/users/stop-following/{self.ids[1]}")
+        html = self.profile(self.ids[3])
+        self.assertNotIn("@user1</a>", html)
+        self.assertIn("@user2</a>", html)
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.ids[3]
+        self.client.post("/users/delete")
+        with app.app_context():
+            self.assertEqual(list(graph_index().followers(self.ids[0])),
+                             [self.ids[1]])
+            self.assertEqual(list(graph_index().following(self.ids[1])),
+                             [self.ids[0]])
+
+    def test_rollback_discards_changes(self):
+        with app.app_context():
+            index = graph_index()
+            index.load()
+            db.session.add(Follows(user_following_id=self.ids[2],
+                                   user_being_followed_id=self.ids[0]))
+            follow_added(self.ids[2], self.ids[0])
+            db.session.rollback()
+            self.assertFalse(index.follows(self.ids[2], self.ids[0]))
@@ -0,0 +1,134 @@
+"""Card fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test cached message and user cards."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        author = User(username="author", email="author@test.com",
+                      password=PASSWORD)
+        reader = User(username="reader", email="reader@test.com",
+                      password=PASSWORD)
+        db.session.add_all([author, reader])
+        db.session.flush()
+        msg = Message(text="Cache me if you can", user_id=author.id)
+        db.session.add(msg)
+        reader.following.append(author)
+        db.session.commit()
+
+        self.author_id = author.id
+        self.reader_id = reader.id
+        self.msg_id = msg.id
+
+        app.extensions['identity_cache'].clear()
+        app.extensions['fragment_cache'].clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions and cached users and cards."""
+
+        db.session.rollback()
+        app.extensions['identity_cache'].clear()
+        app.extensions['fragment_cache'].clear()
+
+    def get(self, user_id, url):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_data(as_text=True)
+
+    def test_cards_cached(self):
+        cache = app.extensions['fragment_cache']
+
+        self.get(self.reader_id, f"/users/{self.author_id}")
+        self.assertIsNotNone(cache.get(f"message:{self.msg_id}"))
+
+        self.get(self.reader_id, f"/users/{self.reader_id}/following")
+        self.assertIsNotNone(cache.get(f"user:{self.author_id}"))
+
+    def test_viewer_state_not_cached(self):
+        """Does each viewer see their own like button and follow form?"""
+
+        html = self.get(self.reader_id, f"/users/{self.author_id}")
+        self.assertIn(f"data-msg-id='{self.msg_id}'", html)
+        self.assertIn("far fa-thumbs-up", html)
+
+        reader = User.query.get(self.reader_id)
+        reader.likes.append(Message.query.get(self.msg_id))
+        db.session.commit()
+        html = self.get(self.reader_id, f"/users/{self.author_id}")
+        self.assertIn("fas fa-thumbs-up", html)
+
+        html = self.get(self.author_id, f"/users/{self.author_id}")
+        self.assertIn("Cache me if you can", html)
+        self.assertNotIn(f"data-msg-id='{self.msg_id}'", html)
+
+        html = self.get(self.reader_id, f"/users/{self.reader_id}/following")
+        self.assertIn(f'action="/users/stop-following/{self.author_id}"', html)
+        html = self.get(self.author_id, f"/users/{self.reader_id}/following")
+        self.assertNotIn(f'/users/stop-following/{self.author_id}"', html)
+
+    def test_profile_edit_refreshes_cards(self):
+        """Do message and user cards show a renamed author straight away?"""
+
+        self.get(self.reader_id, f"/users/{self.author_id}")
+        self.get(self.reader_id, f"/users/{self.reader_id}/following")
+
+        author = User.query.get(self.author_id)
+        version = author.updated_at
+        author.username = "renamed"
+        db.session.commit()
+        self.assertGreater(author.updated_at, version)
+
+        html = self.get(self.reader_id, f"/users/{self.author_id}")
+        self.assertIn('">@renamed</a>', html)
+        html = self.get(self.reader_id, f"/users/{self.reader_id}/following")
+        self.assertIn("@renamed", html)
+        self.assertNotIn("@author", html)
+
+    def test_counter_changes_keep_version(self):
+        """Are cards left cached when only counts change?"""
+
+        author = User.query.get(self.author_id)
+        version = author.updated_at
+        author.messages_count += 1
+        db.session.commit()
+        self.assertEqual(author.updated_at, version)
+
+    def test_delete_evicts(self):
+        cache = app.extensions['fragment_cache']
+        self.get(self.reader_id, f"/users/{self.author_id}")
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.author_id
+        self.client.post(f"/messages/{self.msg_id}/delete")
+
+        self.assertIsNone(cache.get(f"message:{self.msg_id}"))
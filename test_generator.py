@@ -0,0 +1,74 @@
+"""Synthetic data generator tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_generator.py
+
+
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+SCRIPT = os.path.join(os.path.dirname(__file__), 'generator', 'create_csvs.py')
+
+
+class GeneratorTestCase(TestCase):
+    """Test the CSV generator script."""
+
+    def generate(self, out, *args):
+        subprocess.run(
+            [sys.executable, SCRIPT, '--out', out, '--users', '200',
+             '--messages', '500', '--follows', '1000', '--likes', '800',
+             '--requests', '20', '--shard-size', '30', *args],
+            check=True, stdout=subprocess.DEVNULL)
+
+    def read(self, directory, table):
+        with open(os.path.join(directory, f'{table}.csv'), newline='') as f:
+            return list(csv.reader(f))
+
+    def test_deterministic_across_workers(self):
+        """Do one and three workers write identical files?"""
+
+        with tempfile.TemporaryDirectory() as one, \
+                tempfile.TemporaryDirectory() as three:
+            self.generate(one, '--workers', '1')
+            self.generate(three, '--workers', '3')
+
+            for table in ('users', 'messages', 'follows', 'likes',
+                          'requests'):
+                self.assertEqual(self.read(one, table),
+                                 self.read(three, table), table)
+            self.assertEqual(sorted(os.listdir(one)),
+                             sorted(os.listdir(three)))
+
+    def test_rows_are_valid(self):
+        """Are ids in range and follows and likes unique?"""
+
+        with tempfile.TemporaryDirectory() as out:
+            self.generate(out, '--workers', '2')
+
+            users = self.read(out, 'users')[1:]
+            messages = self.read(out, 'messages')[1:]
+            follows = self.read(out, 'follows')[1:]
+            likes = self.read(out, 'likes')[1:]
+
+        self.assertEqual([int(row[0]) for row in users], list(range(1, 201)))
+        self.assertEqual(len({row[2] for row in users}), 200)
+        self.assertEqual([int(row[0]) for row in messages],
+                         list(range(1, 501)))
+        self.assertTrue(all(len(row[1]) <= 140 for row in messages))
+
+        self.assertEqual(len(set(map(tuple, follows))), len(follows))
+        self.assertFalse([row for row in follows if row[0] == row[1]])
+        self.assertEqual(len(set(map(tuple, likes))), len(likes))
+        self.assertTrue(all(1 <= int(row[1]) <= 500 for row in likes))
+
+        # Popularity is skewed: the most followed user has far more
+        # followers than the average.
+        followers = {}
+        for followed, _ in follows:
+            followers[followed] = followers.get(followed, 0) + 1
+        self.assertGreater(max(followers.values()), 5 * len(follows) / 200)
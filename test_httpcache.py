@@ -0,0 +1,158 @@
+"""HTTP caching tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_httpcache.py
+
+
+import os
+from unittest import TestCase
+
+from flask import url_for
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from httpcache import fingerprint
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class StaticCachingTestCase(TestCase):
+    """Test fingerprinted static URLs."""
+
+    def test_fingerprinted_urls(self):
+        with app.test_request_context():
+            url = url_for('static', filename='script.js')
+
+        version = fingerprint(app, 'script.js')
+        self.assertEqual(url, f"/static/script.js?v={version}")
+
+        client = app.test_client()
+        resp = client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.cache_control.immutable)
+        self.assertEqual(resp.cache_control.max_age, 365 * 24 * 60 * 60)
+        resp.close()
+
+    def test_unversioned_urls(self):
+        """Are stale or missing versions only cached briefly?"""
+
+        client = app.test_client()
+        for url in ("/static/script.js", "/static/script.js?v=stale"):
+            resp = client.get(url)
+            self.assertFalse(resp.cache_control.immutable)
+            self.assertEqual(resp.cache_control.max_age, 60 * 60)
+            resp.close()
+
+    def test_no_traversal(self):
+        self.assertIsNone(fingerprint(app, '../app.py'))
+
+
+class ConditionalGetTestCase(TestCase):
+    """Test ETags on timeline, profile and message pages."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        author = User(username="author", email="author@test.com",
+                      password=PASSWORD)
+        reader = User(username="reader", email="reader@test.com",
+                      password=PASSWORD)
+        db.session.add_all([author, reader])
+        db.session.flush()
+        msg = Message(text="First", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.author_id = author.id
+        self.reader_id = reader.id
+        self.msg_id = msg.id
+
+        app.extensions['identity_cache'].clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions and cached users."""
+
+        db.session.rollback()
+        app.extensions['identity_cache'].clear()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def revalidate(self, url):
+        """GET `url`, then again with its ETag; return both responses."""
+
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        etag, weak = first.get_etag()
+        self.assertTrue(weak)
+        again = self.client.get(url, headers={'If-None-Match': f'W/"{etag}"'})
+        return first, again
+
+    def test_not_modified(self):
+        self.login(self.reader_id)
+
+        for url in ("/", f"/users/{self.author_id}",
+                    f"/messages/{self.msg_id}"):
+            first, again = self.revalidate(url)
+            self.assertEqual(again.status_code, 304, url)
+            self.assertEqual(again.get_data(), b"")
+            self.assertTrue(first.cache_control.private)
+            self.assertTrue(first.cache_control.no_cache)
+            self.assertIn('Cookie', first.vary)
+
+    def test_changes_make_new_etag(self):
+        """Do a new message, a profile edit and a new viewer change ETags?"""
+
+        self.login(self.author_id)
+        first = self.client.get(f"/users/{self.author_id}")
+        headers = {'If-None-Match': first.headers['ETag']}
+
+        self.client.post("/api/messages/new", json={"text": "Second"})
+        resp = self.client.get(f"/users/{self.author_id}", headers=headers)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Second", resp.get_data(as_text=True))
+
+        headers = {'If-None-Match': resp.headers['ETag']}
+        author = User.query.get(self.author_id)
+        author.bio = "Now with a bio"
+        db.session.commit()
+        resp = self.client.get(f"/users/{self.author_id}", headers=headers)
+        self.assertEqual(resp.status_code, 200)
+
+        headers = {'If-None-Match': resp.headers['ETag']}
+        self.login(self.reader_id)
+        resp = self.client.get(f"/users/{self.author_id}", headers=headers)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_flashes_not_skipped(self):
+        """Is a page with a pending flash message rendered, not a 304?"""
+
+        self.login(self.reader_id)
+        first = self.client.get("/")
+        with self.client.session_transaction() as sess:
+            sess['_flashes'] = [('success', "Hello again")]
+
+        resp = self.client.get("/", headers={'If-None-Match':
+                                             first.headers['ETag']})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Hello again", resp.get_data(as_text=True))
+
+    def test_other_pages_not_stored(self):
+        resp = self.client.get("/login")
+        self.assertTrue(resp.cache_control.no_store)
+        self.assertIsNone(resp.headers.get('ETag'))
@@ -0,0 +1,121 @@
+"""Identity cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_identity.py
+
+
+import os
+import time
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from identity import MemoryCache
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['RAISE_ON_LAZY_LOAD'] = True
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class MemoryCacheTestCase(TestCase):
+    """Test the in-process identity cache backend."""
+
+    def test_ttl(self):
+        """Do entries expire after their TTL?"""
+
+        cache = MemoryCache(ttl=0.01)
+        cache.set(1, ('a',))
+        self.assertEqual(cache.get(1), ('a',))
+
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(1))
+
+    def test_lru_bound(self):
+        """Is the least recently used entry evicted first?"""
+
+        cache = MemoryCache(max_entries=2)
+        cache.set(1, ('a',))
+        cache.set(2, ('b',))
+        cache.get(1)
+        cache.set(3, ('c',))
+
+        self.assertEqual(cache.get(1), ('a',))
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(3), ('c',))
+
+
+class IdentityViewTestCase(TestCase):
+    """Test the cached g.user in requests."""
+
+    def setUp(self):
+        """Create a logged-in user and empty the identity cache."""
+
+        TimelineEntry.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        user = User.signup(username="cached", email="cached@test.com",
+                           password="password", image_url=None)
+        db.session.commit()
+        self.user_id = user.id
+
+        app.extensions['identity_cache'].clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def test_cached_user_skips_users_query(self):
+        """Does a cached snapshot avoid reading the users table?"""
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            client.get("/")
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                resp = client.get("/")
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+            self.assertIn("@cached", resp.get_data(as_text=True))
+
+        self.assertFalse(any("users.password" in sql for sql in statements))
+        self.assertFalse(any(sql.lstrip().startswith("SELECT users.id")
+                             for sql in statements))
+
+    def test_profile_edit_invalidates(self):
+        """Does editing the profile show the new username right away?"""
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            client.get("/")
+
+            client.post("/users/profile", data={
+                "username": "renamed",
+                "email": "cached@test.com",
+                "password": "password",
+            })
+            resp = client.get("/")
+
+            self.assertIn("@renamed", resp.get_data(as_text=True))
@@ -0,0 +1,155 @@
+"""Query plan tests for the hot query paths.
+
+These need PostgreSQL (its planner is what we care about) and are skipped on
+other databases. They load a million messages, so they take a while.
+"""
+
+# run these tests like:
+#
+#    python -m unittest test_indexes.py
+
+
+import os
+from unittest import TestCase, SkipTest
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import timeline
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+USERS = 1000
+MESSAGES = 1000000
+FOLLOWED = 50
+
+BIG_TABLES = ('messages', 'timelines')
+
+
+def plan_nodes(plan):
+    """Yield every node of an EXPLAIN (FORMAT JSON) plan."""
+
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+class QueryPlanTestCase(TestCase):
+    """Test that homepage and profile queries use indexes at scale."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Load USERS users and MESSAGES messages; the first follows some."""
+
+        if db.engine.dialect.name != 'postgresql':
+            raise SkipTest("query plan tests need PostgreSQL")
+
+        cls.clear()
+
+        db.session.execute(
+            """INSERT INTO users (id, email, username, password)
+               SELECT n, 'user' || n || '@test.com', 'user' || n, :password
+               FROM generate_series(1, :users) AS n""",
+            {'password': PASSWORD, 'users': USERS})
+        db.session.execute(
+            """INSERT INTO messages (text, timestamp, user_id)
+               SELECT 'warble ' || n,
+                      now() - n * interval '1 second',
+                      1 + n % :users
+               FROM generate_series(1, :messages) AS n""",
+            {'users': USERS, 'messages': MESSAGES})
+        db.session.execute(
+            """INSERT INTO follows (user_following_id, user_being_followed_id)
+               SELECT 1, n FROM generate_series(2, :followed + 1) AS n""",
+            {'followed': FOLLOWED})
+        db.session.commit()
+
+        timeline.rebuild_timelines()
+
+        for table in ('users', 'messages', 'follows', 'timelines'):
+            db.session.execute(f"ANALYZE {table}")
+        db.session.commit()
+
+        cls.viewer_id = 1
+        cls.author_id = 2
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.clear()
+
+    @staticmethod
+    def clear():
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def plans_for(self, url):
+        """Return EXPLAIN plans for statements run to render `url`."""
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, *args):
+            statements.append((statement, parameters))
+
+        app.extensions['identity_cache'].clear()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                resp = client.get(url)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+            self.assertEqual(resp.status_code, 200)
+
+        plans = []
+        conn = db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            for statement, parameters in statements:
+                if not statement.lstrip().upper().startswith('SELECT'):
+                    continue
+                cursor.execute("EXPLAIN (FORMAT JSON) " + statement,
+                               parameters)
+                plans.append(cursor.fetchone()[0][0]['Plan'])
+        finally:
+            conn.close()
+
+        return plans
+
+    def assertNoSeqScans(self, url):
+        """Assert no query for `url` scans a whole big table."""
+
+        scanned = set()
+        for plan in self.plans_for(url):
+            scanned.update(node.get('Relation Name')
+                           for node in plan_nodes(plan)
+                           if node['Node Type'] == 'Seq Scan')
+
+        self.assertFalse(scanned & set(BIG_TABLES),
+                         f"sequential scan of {scanned} for {url}")
+
+    def test_homepage_uses_indexes(self):
+        """Is the home timeline read through indexes?"""
+
+        self.assertNoSeqScans("/")
+
+    def test_profile_uses_indexes(self):
+        """Are a user's messages read through indexes?"""
+
+        self.assertNoSeqScans(f"/users/{self.author_id}")
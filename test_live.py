@@ -0,0 +1,177 @@
+"""Live timeline update tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_live.py
+
+
+import json
+import os
+import threading
+from unittest import TestCase
+
+from models import (db, User, Message, Follows, FollowRequest, Like,
+                    TimelineEntry, TrendCount)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from counters import reconcile_counters
+from live import MemoryBroker, default_max_streams
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+def events(chunks):
+    """[(id, data)] for the message events in `chunks` of a stream."""
+
+    found = []
+    for chunk in chunks:
+        lines = dict(line.split(': ', 1) for line in
+                     chunk.decode().splitlines() if ': ' in line)
+        if lines.get('event') == 'message':
+            found.append((int(lines['id']), json.loads(lines['data'])))
+    return found
+
+
+class BrokerTestCase(TestCase):
+    """Test the in-process broker without the database."""
+
+    def test_publish(self):
+        broker = MemoryBroker()
+        first = broker.subscribe([1, 2])
+        second = broker.subscribe([2])
+
+        broker.publish({'id': 10, 'author_id': 2, 'data': '{}'})
+        broker.publish({'id': 11, 'author_id': 3, 'data': '{}'})
+        self.assertEqual(first.get(0)['id'], 10)
+        self.assertEqual(second.get(0)['id'], 10)
+        self.assertIsNone(first.get(0))
+
+        first.close()
+        self.assertEqual(broker.subscribed(1), 0)
+        self.assertEqual(broker.subscribed(2), 1)
+
+    def test_max_streams(self):
+        self.assertEqual(default_max_streams({'GUNICORN_THREADS': '8'}), 4)
+        self.assertEqual(default_max_streams(
+            {'GUNICORN_WORKER_CLASS': 'gevent',
+             'GUNICORN_WORKER_CONNECTIONS': '1000'}), 900)
+        self.assertEqual(default_max_streams(
+            {'GUNICORN_WORKER_CLASS': 'sync'}), 0)
+
+
+class StreamTestCase(TestCase):
+    """Test the timeline stream."""
+
+    def setUp(self):
+        TrendCount.query.delete()
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        FollowRequest.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        users = [User(username=f"user{i}", email=f"user{i}@test.com",
+                      password=PASSWORD) for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.ids = [user.id for user in users]
+        db.session.add(Follows(user_following_id=self.ids[0],
+                               user_being_followed_id=self.ids[1]))
+        db.session.commit()
+        reconcile_counters()
+
+        app.config['LIVE_HEARTBEAT'] = 0.05
+        app.config['LIVE_STREAM_SECONDS'] = 0.2
+        app.extensions['live_broker'] = MemoryBroker()
+        app.extensions['live_streams'] = threading.BoundedSemaphore(1)
+        app.extensions['identity_cache'].clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions and cached users."""
+
+        db.session.rollback()
+        app.extensions['identity_cache'].clear()
+
+    def login(self, client, user_id):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def post(self, user_id, text):
+        client = app.test_client()
+        self.login(client, user_id)
+        resp = client.post("/api/messages/new", json={'text': text})
+        return resp.json['msg']['id']
+
+    def test_resume(self):
+        """Are messages after Last-Event-ID sent when a stream opens?"""
+
+        seen = self.post(self.ids[1], "Seen already")
+        missed = self.post(self.ids[1], "Missed it")
+        self.post(self.ids[2], "Not followed")
+
+        self.login(self.client, self.ids[0])
+        resp = self.client.get("/api/v1/timeline/stream",
+                               headers={'Last-Event-ID': str(seen)})
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        body = resp.get_data(as_text=True)
+        self.assertTrue(body.startswith("retry: "))
+        self.assertIn(": heartbeat", body)
+
+        [(event_id, data)] = events([resp.get_data()])
+        self.assertEqual(event_id, missed)
+        self.assertEqual(data['message']['text'], "Missed it")
+        self.assertEqual(data['user']['username'], "user1")
+        self.assertIn("Missed it", data['html'])
+        self.assertIn("messages-like-bottom", data['html'])
+
+        resp = self.client.get("/api/v1/timeline/stream?last_event_id=x")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_live(self):
+        """Are new messages from followed users pushed to an open stream?"""
+
+        self.login(self.client, self.ids[0])
+        resp = self.client.get("/api/v1/timeline/stream", buffered=False)
+        chunks = iter(resp.response)
+        self.assertTrue(next(chunks).startswith(b"retry: "))
+
+        # The stream holds the only slot.
+        other = app.test_client()
+        self.login(other, self.ids[1])
+        self.assertEqual(
+            other.get("/api/v1/timeline/stream").status_code, 503)
+
+        self.post(self.ids[2], "Not followed")
+        posted = self.post(self.ids[1], "Hot off the press")
+        [(event_id, data)] = events(chunks)
+        self.assertEqual(event_id, posted)
+        self.assertEqual(data['message']['text'], "Hot off the press")
+
+        resp.close()
+        self.assertEqual(
+            app.extensions['live_broker'].subscribed(self.ids[1]), 0)
+        self.assertTrue(app.extensions['live_streams'].acquire(
+            blocking=False))
+
+    def test_no_subscribers(self):
+        """Are messages nobody's streaming skipped without rendering?"""
+
+        published = []
+
+        class Broker(MemoryBroker):
+            def publish(self, event):
+                published.append(event['id'])
+                super().publish(event)
+
+        app.extensions['live_broker'] = Broker()
+        self.post(self.ids[1], "Nobody's listening")
+        self.assertEqual(published, [])
@@ -0,0 +1,120 @@
+"""Query count tests for rendered pages."""
+
+# run these tests like:
+#
+#    python -m unittest test_loaders.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import timeline
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['RAISE_ON_LAZY_LOAD'] = True
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class QueryCountTestCase(TestCase):
+    """Test that list pages run a fixed number of queries."""
+
+    def setUp(self):
+        """Create a viewer who follows and likes posts from other users."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        viewer = User(username="viewer", email="viewer@test.com",
+                      password=PASSWORD)
+        db.session.add(viewer)
+        db.session.commit()
+        self.viewer_id = viewer.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def add_authors(self, count):
+        """Add `count` followed authors with one liked message each."""
+
+        viewer = User.query.get(self.viewer_id)
+        start = User.query.count()
+        for i in range(start, start + count):
+            author = User(username=f"author{i}", email=f"author{i}@test.com",
+                          password=PASSWORD)
+            viewer.following.append(author)
+            msg = Message(text=f"post {i}")
+            author.messages.append(msg)
+            viewer.likes.append(msg)
+            db.session.flush()
+            timeline.follow_added(viewer, author)
+        db.session.commit()
+
+    def count_queries(self, url):
+        """Return the number of SQL statements run to render `url`."""
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        app.extensions['identity_cache'].clear()
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                resp = client.get(url)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+            self.assertEqual(resp.status_code, 200)
+        return len(statements)
+
+    def test_homepage_queries_do_not_grow(self):
+        """Does the homepage query count stay flat as messages are added?"""
+
+        self.add_authors(2)
+        few = self.count_queries("/")
+
+        self.add_authors(10)
+        self.assertEqual(self.count_queries("/"), few)
+
+    def test_following_queries_do_not_grow(self):
+        """Does the following page query count stay flat as users are added?"""
+
+        self.add_authors(2)
+        few = self.count_queries(f"/users/{self.viewer_id}/following")
+
+        self.add_authors(10)
+        self.assertEqual(
+            self.count_queries(f"/users/{self.viewer_id}/following"), few)
+
+    def test_likes_queries_do_not_grow(self):
+        """Does the likes page query count stay flat as likes are added?"""
+
+        self.add_authors(2)
+        few = self.count_queries(f"/users/{self.viewer_id}/likes")
+
+        self.add_authors(10)
+        self.assertEqual(
+            self.count_queries(f"/users/{self.viewer_id}/likes"), few)
@@ -30,6 +30,7 @@ db.create_all()
 # Don't have WTForms use CSRF at all, since it's a pain to test
 
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['RAISE_ON_LAZY_LOAD'] = True
 
 
 class MessageViewTestCase(TestCase):
@@ -0,0 +1,115 @@
+"""Request metrics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from metrics import metrics
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class MetricsTestCase(TestCase):
+    """Test request instrumentation and the /metrics endpoint."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        user = User(username="metered", email="metered@test.com",
+                    password=PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        app.extensions['identity_cache'].clear()
+        metrics.reset()
+        self.sample_rate = metrics.sample_rate
+        metrics.sample_rate = 1
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions and cached users."""
+
+        db.session.rollback()
+        app.extensions['identity_cache'].clear()
+        metrics.sample_rate = self.sample_rate
+        metrics.token = None
+
+    def test_server_timing(self):
+        """Do sampled responses report their queries and template time?"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+        resp = self.client.get(f"/users/{self.user_id}")
+
+        timing = resp.headers['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        self.assertRegex(timing, r'total;dur=[\d.]+')
+
+    def test_unsampled(self):
+        """Are unsampled requests counted without the detail?"""
+
+        metrics.sample_rate = 0
+        resp = self.client.get("/login")
+        self.assertNotIn('Server-Timing', resp.headers)
+
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn('warbler_requests_total{endpoint="login",method="GET",'
+                      'status="200"} 1', text)
+        self.assertIn('warbler_request_duration_seconds_count'
+                      '{endpoint="login"} 1', text)
+        self.assertNotIn('warbler_sampled_requests_total{endpoint="login"}'
+                         ' 1', text)
+
+    def test_metrics(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+        self.client.get(f"/users/{self.user_id}")
+        self.client.get(f"/users/{self.user_id}")
+
+        resp = self.client.get("/metrics")
+        text = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('warbler_requests_total{endpoint="users_show",'
+                      'method="GET",status="200"} 2', text)
+        self.assertIn('warbler_sampled_requests_total{endpoint="users_show"}'
+                      ' 2', text)
+        self.assertRegex(text, r'warbler_db_queries_total'
+                               r'\{endpoint="users_show"\} [1-9]')
+        self.assertRegex(text, r'warbler_slow_query_seconds'
+                               r'\{endpoint="users_show",statement="SELECT ')
+
+    def test_metrics_token(self):
+        metrics.token = "scrape-me"
+
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        resp = self.client.get(
+            "/metrics", headers={'Authorization': "Bearer scrape-me"})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_metrics_remote(self):
+        """Without a token, is /metrics refused to other machines?"""
+
+        resp = self.client.get(
+            "/metrics", environ_base={'REMOTE_ADDR': '203.0.113.9'})
+        self.assertEqual(resp.status_code, 403)
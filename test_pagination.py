@@ -0,0 +1,127 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from pagination import (
+    MESSAGES_PER_PAGE, USERS_PER_PAGE, encode_cursor, message_cursor)
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['RAISE_ON_LAZY_LOAD'] = True
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class PaginationTestCase(TestCase):
+    """Test cursor pagination of list views."""
+
+    def setUp(self):
+        """Create a user with more than a page of messages and followers."""
+
+        TimelineEntry.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.user = User(username="paged", email="paged@test.com",
+                         password=PASSWORD)
+        db.session.add(self.user)
+
+        now = datetime.utcnow()
+        for i in range(MESSAGES_PER_PAGE + 5):
+            self.user.messages.append(
+                Message(text=f"message {i}",
+                        timestamp=now - timedelta(minutes=i)))
+
+        for i in range(USERS_PER_PAGE + 1):
+            follower = User(username=f"follower{i}",
+                            email=f"follower{i}@test.com",
+                            password=PASSWORD)
+            self.user.followers.append(follower)
+
+        db.session.commit()
+        self.user_id = self.user.id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def test_cursor_round_trip(self):
+        """Does a message cursor decode to the key it was made from?"""
+
+        key = (datetime(2021, 4, 1, 12, 30), 42)
+        self.assertEqual(message_cursor(encode_cursor(*key)), key)
+
+    def test_messages_paginate(self):
+        """Do profile pages return every message exactly once?"""
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = client.get(f"/users/{self.user_id}")
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("message 0<", html)
+            self.assertNotIn(f"message {MESSAGES_PER_PAGE}<", html)
+            self.assertIn("load-more", html)
+
+            cursor = client.get(
+                f"/users/{self.user_id}?format=json").json['next_cursor']
+            resp = client.get(f"/users/{self.user_id}?cursor={cursor}&format=json")
+            data = resp.json
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f"message {MESSAGES_PER_PAGE}<", data['html'])
+            self.assertNotIn("message 0<", data['html'])
+            self.assertIsNone(data['next_cursor'])
+
+    def test_followers_paginate(self):
+        """Does the followers page hand out a cursor to the next page?"""
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = client.get(f"/users/{self.user_id}/followers?format=json")
+            data = resp.json
+            self.assertEqual(data['html'].count('card-link'), USERS_PER_PAGE)
+
+            resp = client.get(data['next_url'] + "&format=json")
+            data = resp.json
+            self.assertEqual(data['html'].count('card-link'), 1)
+            self.assertIsNone(data['next_url'])
+
+    def test_bad_cursor(self):
+        """Is a malformed cursor rejected?"""
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = client.get("/?cursor=not-a-cursor")
+            self.assertEqual(resp.status_code, 400)
+
+            # Valid JSON, but no int() can hold the id.
+            infinite = float('inf')
+            resp = client.get(
+                f"/?cursor={encode_cursor('2020-01-01T00:00:00', infinite)}")
+            self.assertEqual(resp.status_code, 400)
+            resp = client.get(f"/users/{self.user_id}/followers"
+                              f"?cursor={encode_cursor(infinite)}")
+            self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,115 @@
+"""Password hashing and login rate limit tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from passwords import (HasherBusy, PasswordHasher, RateLimiter, attempt_limiter,
+                       hasher)
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test the bcrypt hashing service."""
+
+    def test_hash_and_check(self):
+        """Do hashes made in the process pool check correctly?"""
+
+        pooled = PasswordHasher(rounds=4, workers=1)
+        hashed = pooled.hash("password")
+
+        self.assertTrue(hashed.startswith("$2b$04$"))
+        self.assertTrue(pooled.check(hashed, "password"))
+        self.assertFalse(pooled.check(hashed, "wrong"))
+
+    def test_busy(self):
+        """Is a hash refused at once when the queue is full?"""
+
+        full = PasswordHasher(rounds=4, workers=1, queue=0)
+        with self.assertRaises(HasherBusy):
+            full.hash("password")
+
+    def test_needs_rehash(self):
+        """Are hashes with a different cost flagged for rehashing?"""
+
+        inline = PasswordHasher(rounds=4)
+
+        self.assertFalse(inline.needs_rehash(inline.hash("password")))
+        self.assertTrue(inline.needs_rehash(
+            PasswordHasher(rounds=5).hash("password")))
+
+    def test_rate_limiter(self):
+        """Are hits over the limit refused?"""
+
+        limiter = RateLimiter(limit=2, window=60)
+
+        self.assertTrue(limiter.hit("key"))
+        self.assertTrue(limiter.hit("key"))
+        self.assertFalse(limiter.hit("key"))
+        self.assertTrue(limiter.hit("other"))
+
+
+class LoginTestCase(TestCase):
+    """Test rehash-on-login and login rate limiting."""
+
+    def setUp(self):
+        """Create a user whose hash uses a cheaper cost than configured."""
+
+        TimelineEntry.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        user = User(username="hashed", email="hashed@test.com",
+                    password=PasswordHasher(rounds=4).hash("password"))
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        attempt_limiter.reset()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        attempt_limiter.reset()
+
+    def test_login_rehashes(self):
+        """Is a hash made with an old cost upgraded on login?"""
+
+        resp = self.client.post("/login", data={"username": "hashed",
+                                                "password": "password"})
+        self.assertEqual(resp.status_code, 302)
+
+        user = User.query.get(self.user_id)
+        db.session.refresh(user)
+        self.assertFalse(hasher.needs_rehash(user.password))
+        self.assertTrue(hasher.check(user.password, "password"))
+
+    def test_login_rate_limited(self):
+        """Are repeated logins for one username refused?"""
+
+        limit = attempt_limiter.usernames.limit
+        for _ in range(limit):
+            resp = self.client.post("/login", data={"username": "HASHED",
+                                                    "password": "wrong-pw"})
+            self.assertEqual(resp.status_code, 200)
+
+        resp = self.client.post("/login", data={"username": "hashed",
+                                                "password": "password"})
+        self.assertEqual(resp.status_code, 429)
+        self.assertIn("Too many attempts", resp.get_data(as_text=True))
@@ -0,0 +1,325 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import search
+from search import (MemoryMessageIndex, MemoryUserIndex, find_users,
+                    parse_terms, visible_messages)
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class MemoryUserIndexTestCase(TestCase):
+    """Test the in-process user index on its own."""
+
+    def setUp(self):
+        self.index = MemoryUserIndex()
+        self.index.loaded = True
+        self.index.add(1, "birdwatcher", "I watch birds", "Oakland")
+        self.index.add(2, "bird", None, None)
+        self.index.add(3, "robin", "early bird", "Birdsville")
+        self.index.add(4, "sparrow", "tweets", "Berkeley")
+
+    def test_search_ranking(self):
+        """Are exact, prefix, substring and bio matches ranked in order?"""
+
+        self.assertEqual(self.index.search("bird"), [2, 1, 3])
+
+    def test_search_limit(self):
+        self.assertEqual(self.index.search("bird", limit=2), [2, 1])
+
+    def test_autocomplete(self):
+        self.assertEqual(self.index.autocomplete("bi"), [2, 1])
+        self.assertEqual(self.index.autocomplete("z"), [])
+
+    def test_short_queries_match_prefixes(self):
+        self.assertEqual(self.index.search("sp"), [4])
+
+    def test_update_and_remove(self):
+        """Does re-adding replace old text, and removing drop the user?"""
+
+        self.index.add(4, "sparrow", "tweets", "Birdland")
+        self.assertEqual(self.index.search("birdl"), [4])
+        self.assertEqual(self.index.search("berkeley"), [])
+
+        self.index.remove(2)
+        self.assertEqual(self.index.search("bird"), [1, 3, 4])
+        self.assertEqual(self.index.autocomplete("b"), [1])
+
+
+class UserSearchTestCase(TestCase):
+    """Test searching users through the app."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        users = [
+            User(username="bird_fan", email="fan@test.com", password=PASSWORD,
+                 location="Oakland"),
+            User(username="robin", email="robin@test.com", password=PASSWORD,
+                 bio="Bird enthusiast"),
+            User(username="crow", email="crow@test.com", password=PASSWORD),
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        self.ids = {user.username: user.id for user in users}
+
+        app.extensions['identity_cache'].clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions and cached users."""
+
+        db.session.rollback()
+        app.extensions['identity_cache'].clear()
+
+    def login(self, client):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.ids['crow']
+
+    def test_find_users(self):
+        """Are username matches ranked above bio matches?"""
+
+        with app.test_request_context():
+            found = [user.username for user in find_users("BIRD")]
+        self.assertEqual(found, ["bird_fan", "robin"])
+
+    def test_find_users_escapes_wildcards(self):
+        with app.test_request_context():
+            self.assertEqual(find_users("%"), [])
+            self.assertEqual([u.username for u in find_users("d_f")],
+                             ["bird_fan"])
+
+    def test_search_page(self):
+        with self.client as client:
+            self.login(client)
+            resp = client.get("/users?q=oakland")
+            html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("bird_fan", html)
+        self.assertNotIn("@robin", html)
+
+    def test_search_sees_profile_changes(self):
+        """Is an edited bio searchable straight away?"""
+
+        crow = User.query.get(self.ids['crow'])
+        crow.bio = "Mostly ravens"
+        db.session.commit()
+
+        with app.test_request_context():
+            self.assertEqual([u.username for u in find_users("ravens")],
+                             ["crow"])
+
+    def test_autocomplete(self):
+        with self.client as client:
+            self.login(client)
+            resp = client.get("/api/users/autocomplete?q=Ro")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([user['username'] for user in resp.json['users']],
+                         ["robin"])
+
+    def test_autocomplete_logged_out(self):
+        resp = self.client.get("/api/users/autocomplete?q=ro")
+        self.assertEqual(resp.status_code, 403)
+
+
+class MemoryMessageIndexTestCase(TestCase):
+    """Test the in-process message index on its own."""
+
+    def setUp(self):
+        self.index = MemoryMessageIndex()
+        self.index.load([
+            (1, "The early bird catches the worm"),
+            (2, "A bird in the hand, a bird in the bush"),
+            (3, "Birdwatching at dawn"),
+            (4, "Worms are early risers"),
+        ])
+
+    def matches(self, query):
+        return sorted(self.index.scores(parse_terms(query)))
+
+    def test_parse_terms(self):
+        self.assertEqual(parse_terms('Early "the BIRD" bird* "worm" -'),
+                         [('word', 'early'), ('phrase', ('the', 'bird')),
+                          ('prefix', 'bird'), ('word', 'worm')])
+
+    def test_words(self):
+        """Must every word appear?"""
+
+        self.assertEqual(self.matches("bird"), [1, 2])
+        self.assertEqual(self.matches("early bird"), [1])
+        self.assertEqual(self.matches("early"), [1, 4])
+
+    def test_phrases(self):
+        self.assertEqual(self.matches('"early bird"'), [1])
+        self.assertEqual(self.matches('"bird early"'), [])
+        self.assertEqual(self.matches('"the hand"'), [2])
+
+    def test_prefixes(self):
+        self.assertEqual(self.matches("bird*"), [1, 2, 3])
+        self.assertEqual(self.matches("worm*"), [1, 4])
+
+    def test_scores(self):
+        """Do more occurrences in fewer words score higher?"""
+
+        scores = self.index.scores(parse_terms("bird"))
+        self.assertGreater(scores[2], scores[1])
+
+    def test_add_and_remove(self):
+        self.index.add(5, "A birdhouse for every bird")
+        self.assertEqual(self.matches("birdh*"), [5])
+
+        self.index.add(5, "Nothing to see here")
+        self.assertEqual(self.matches("birdh*"), [])
+
+        self.index.remove(1)
+        self.assertEqual(self.matches("bird"), [2])
+        self.assertEqual(self.matches("catches"), [])
+
+
+class MessageSearchTestCase(TestCase):
+    """Test searching messages through the app."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        viewer = User(username="viewer", email="viewer@test.com",
+                      password=PASSWORD)
+        public = User(username="public", email="public@test.com",
+                      password=PASSWORD)
+        hidden = User(username="hidden", email="hidden@test.com",
+                      password=PASSWORD, private=True)
+        db.session.add_all([viewer, public, hidden])
+        db.session.flush()
+
+        db.session.add_all([
+            Message(text="Spotted a heron today", user_id=public.id),
+            Message(text="Heron heron heron", user_id=public.id),
+            Message(text="A secret heron", user_id=hidden.id),
+        ])
+        db.session.commit()
+
+        self.viewer_id = viewer.id
+        self.public_id = public.id
+        self.hidden_id = hidden.id
+
+        app.extensions['identity_cache'].clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions and cached users."""
+
+        db.session.rollback()
+        app.extensions['identity_cache'].clear()
+
+    def search(self, client, query, order='recent'):
+        resp = client.get("/api/messages/search",
+                          query_string={'q': query, 'order': order})
+        self.assertEqual(resp.status_code, 200)
+        return [msg['text'] for msg in resp.json['messages']]
+
+    def login(self, client, user_id):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_private_messages_hidden(self):
+        """Are private accounts' messages only found by their followers?"""
+
+        with self.client as client:
+            self.login(client, self.viewer_id)
+            self.assertNotIn("A secret heron", self.search(client, "heron"))
+
+            viewer = User.query.get(self.viewer_id)
+            viewer.following.append(User.query.get(self.hidden_id))
+            db.session.commit()
+            self.assertIn("A secret heron", self.search(client, "heron"))
+
+            self.login(client, self.hidden_id)
+            self.assertIn("A secret heron", self.search(client, "secret"))
+
+    def test_orders(self):
+        with self.client as client:
+            self.login(client, self.viewer_id)
+            self.assertEqual(self.search(client, "heron", order='rank'),
+                             ["Heron heron heron", "Spotted a heron today"])
+            self.assertEqual(self.search(client, "heron"),
+                             ["Heron heron heron", "Spotted a heron today"])
+            self.assertEqual(self.search(client, '"a heron"'),
+                             ["Spotted a heron today"])
+
+    def test_index_follows_posts_and_deletes(self):
+        """Are new and deleted messages reflected straight away?"""
+
+        with self.client as client:
+            self.login(client, self.public_id)
+            self.search(client, "heron")
+
+            resp = client.post("/api/messages/new",
+                               json={"text": "An egret, not a heron"})
+            msg_id = resp.json['msg']['id']
+            self.assertEqual(self.search(client, "egret"),
+                             ["An egret, not a heron"])
+
+            client.post(f"/messages/{msg_id}/delete")
+            self.assertEqual(self.search(client, "egret"), [])
+
+    def test_many_matches(self):
+        """Are matches looked up MAX_MATCHES ids at a time?"""
+
+        index = MemoryMessageIndex()
+        index.load()
+        terms = parse_terms("heron")
+        viewer = User.query.get(self.viewer_id)
+
+        max_matches = search.MAX_MATCHES
+        search.MAX_MATCHES = 1
+        try:
+            ranked = index.best(terms, visible_messages(viewer))
+            newest = Message.query.filter(index.matching(terms)).all()
+        finally:
+            search.MAX_MATCHES = max_matches
+
+        self.assertEqual([Message.query.get(message_id).text
+                          for message_id in ranked],
+                         ["Heron heron heron", "Spotted a heron today"])
+        self.assertEqual([msg.text for msg in newest], ["A secret heron"])
+
+    def test_search_page(self):
+        with self.client as client:
+            self.login(client, self.viewer_id)
+            resp = client.get("/messages/search?q=spot*")
+            html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Spotted a heron today", html)
+        self.assertNotIn("Heron heron heron", html)
+
+    def test_search_logged_out(self):
+        resp = self.client.get("/api/messages/search?q=heron")
+        self.assertEqual(resp.status_code, 403)
@@ -0,0 +1,120 @@
+"""Who-to-follow suggestion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_suggestions.py
+
+
+import os
+from unittest import TestCase
+
+from models import (db, User, Message, Follows, FollowRequest, Like,
+                    Suggestion, TimelineEntry)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from counters import reconcile_counters
+from followgraph import FollowGraph
+from suggestions import rebuild_suggestions, score_users, top_candidates
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+# 1 follows 2 and 3; 2 and 3 both follow 4, and 3 also follows 1 and 5.
+EDGES = [(1, 2), (1, 3), (2, 4), (3, 1), (3, 4), (3, 5)]
+
+
+class FollowGraphTestCase(TestCase):
+    """Test CSR adjacency and scoring without the database."""
+
+    def setUp(self):
+        self.graph = FollowGraph.from_edges(EDGES)
+
+    def test_adjacency(self):
+        self.assertEqual(len(self.graph), 6)
+        self.assertEqual(list(self.graph.following(3)), [1, 4, 5])
+        self.assertEqual(list(self.graph.following(4)), [])
+        self.assertEqual(list(self.graph.following(99)), [])
+        self.assertEqual(self.graph.active_ids(), [1, 2, 3])
+
+    def test_top_candidates(self):
+        """Are candidates ranked by follows in common, excluding follows?"""
+
+        self.assertEqual(top_candidates(self.graph, 1), [(4, 2), (5, 1)])
+        self.assertEqual(top_candidates(self.graph, 1, k=1), [(4, 2)])
+        self.assertEqual(top_candidates(self.graph, 3), [(2, 1)])
+
+    def test_parallel_matches_serial(self):
+        user_ids = self.graph.active_ids()
+        serial = dict(sum(score_users(self.graph, user_ids), []))
+        parallel = dict(sum(score_users(self.graph, user_ids, workers=2,
+                                        chunk_size=1), []))
+        self.assertEqual(parallel, serial)
+
+
+class SuggestionViewTestCase(TestCase):
+    """Test storing, serving and updating suggestions."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Suggestion.query.delete()
+        Like.query.delete()
+        FollowRequest.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        users = [User(username=f"user{i}", email=f"user{i}@test.com",
+                      password=PASSWORD) for i in range(5)]
+        db.session.add_all(users)
+        db.session.flush()
+        self.ids = [user.id for user in users]
+
+        ids = [None] + self.ids
+        db.session.add_all([Follows(user_following_id=ids[a],
+                                    user_being_followed_id=ids[b])
+                            for a, b in EDGES])
+        db.session.commit()
+        reconcile_counters()
+
+        app.extensions['identity_cache'].clear()
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.ids[0]
+
+    def tearDown(self):
+        """Clean up fouled transactions and cached users."""
+
+        db.session.rollback()
+        app.extensions['identity_cache'].clear()
+
+    def suggested(self, user_id):
+        return [(row.suggested_id, row.score) for row in
+                Suggestion.query.filter_by(user_id=user_id)
+                .order_by(Suggestion.score.desc(), Suggestion.suggested_id)]
+
+    def test_rebuild_and_view(self):
+        self.assertEqual(rebuild_suggestions(workers=1, echo=lambda _: None),
+                         2)
+        self.assertEqual(self.suggested(self.ids[0]),
+                         [(self.ids[3], 2), (self.ids[4], 1)])
+
+        html = self.client.get("/users/suggestions").get_data(as_text=True)
+        self.assertLess(html.index("@user3"), html.index("@user4"))
+        self.assertIn("Followed by 2 people you follow", html)
+        self.assertNotIn("@user1", html)
+
+    def test_follow_updates_suggestions(self):
+        """Does following someone rescore the follower right away?"""
+
+        rebuild_suggestions(workers=1, echo=lambda _: None)
+        self.client.post(f"/users/follow/{self.ids[3]}")
+        self.assertEqual(self.suggested(self.ids[0]), [(self.ids[4], 1)])
+
+        self.client.post(f"/users/stop-following/{self.ids[2]}")
+        self.assertEqual(self.suggested(self.ids[0]), [])
@@ -0,0 +1,166 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import timeline
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['RAISE_ON_LAZY_LOAD'] = True
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class TimelineTestCase(TestCase):
+    """Test materialized home timelines."""
+
+    def setUp(self):
+        """Create two users where `follower` follows `author`."""
+
+        TimelineEntry.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.author = User(username="author", email="a@test.com",
+                           password=PASSWORD)
+        self.follower = User(username="follower", email="f@test.com",
+                             password=PASSWORD)
+        self.follower.following.append(self.author)
+        db.session.add_all([self.author, self.follower])
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def post(self, user, text, minutes_ago=0):
+        msg = Message(text=text,
+                      timestamp=datetime.utcnow() - timedelta(minutes=minutes_ago))
+        user.messages.append(msg)
+        timeline.message_posted(msg)
+        db.session.commit()
+        return msg
+
+    def test_message_fans_out_to_followers(self):
+        """Does posting write to the author's and followers' timelines?"""
+
+        msg = self.post(self.author, "hello")
+
+        self.assertEqual(timeline.get_timeline(self.follower), [msg])
+        self.assertEqual(timeline.get_timeline(self.author), [msg])
+
+    def test_homepage_reads_timeline(self):
+        """Does the homepage show messages from the timeline store?"""
+
+        self.post(self.author, "from the store")
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.follower.id
+            resp = client.get("/")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("from the store", resp.get_data(as_text=True))
+
+    def test_unfollow_and_follow_update_timeline(self):
+        """Do unfollowing and following prune and back-fill the timeline?"""
+
+        msg = self.post(self.author, "hello")
+
+        self.follower.following.remove(self.author)
+        timeline.follow_removed(self.follower, self.author)
+        db.session.commit()
+        self.assertEqual(timeline.get_timeline(self.follower), [])
+
+        self.follower.following.append(self.author)
+        timeline.follow_added(self.follower, self.author)
+        db.session.commit()
+        self.assertEqual(timeline.get_timeline(self.follower), [msg])
+
+    def count(self, user):
+        return TimelineEntry.query.filter_by(user_id=user.id).count()
+
+    def test_timeline_is_capped(self):
+        """Are followers' timelines trimmed to TIMELINE_LENGTH once they pass
+        TRIM_THRESHOLD, and authors' on every post?
+        """
+
+        for i in range(timeline.TRIM_THRESHOLD):
+            self.post(self.author, f"msg {i}", minutes_ago=i)
+        self.assertEqual(self.count(self.author), timeline.TIMELINE_LENGTH)
+        self.assertEqual(self.count(self.follower), timeline.TRIM_THRESHOLD)
+
+        self.post(self.author, "one too many")
+        self.assertEqual(self.count(self.follower), timeline.TIMELINE_LENGTH)
+
+    def test_unfollow_prolific_account(self):
+        """Is the timeline back-filled from the remaining follows?"""
+
+        other = User(username="other", email="o@test.com", password=PASSWORD)
+        self.follower.following.append(other)
+        db.session.commit()
+
+        older = self.post(other, "older", minutes_ago=1000)
+        for i in range(timeline.TRIM_THRESHOLD + 1):
+            self.post(self.author, f"msg {i}", minutes_ago=i)
+
+        self.follower.following.remove(self.author)
+        timeline.follow_removed(self.follower, self.author)
+        db.session.commit()
+
+        self.assertEqual(
+            [entry.message_id for entry in
+             TimelineEntry.query.filter_by(user_id=self.follower.id)],
+            [older.id])
+        self.assertEqual(timeline.get_timeline(self.follower), [older])
+
+    def test_short_timeline_reads_follows(self):
+        """Are followed accounts read directly when the store comes up short?"""
+
+        msg = self.post(self.author, "hello")
+        TimelineEntry.query.delete()
+        db.session.commit()
+
+        self.assertEqual(timeline.get_timeline(self.follower), [msg])
+
+    def test_fanout_on_read(self):
+        """Are flagged accounts merged into timelines at read time?"""
+
+        self.author.fanout_on_read = True
+        db.session.commit()
+
+        msg = self.post(self.author, "hello")
+
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=self.follower.id).count(), 0)
+        self.assertEqual(timeline.get_timeline(self.follower), [msg])
+
+    def test_rebuild_timelines(self):
+        """Does rebuilding restore timelines from follows and messages?"""
+
+        msg = self.post(self.author, "hello")
+        TimelineEntry.query.delete()
+        db.session.commit()
+
+        timeline.rebuild_timelines()
+
+        self.assertEqual(timeline.get_timeline(self.follower), [msg])
+        self.assertEqual(timeline.get_timeline(self.author), [msg])
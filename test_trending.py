@@ -0,0 +1,171 @@
+"""Trending messages and hashtags tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import os
+from unittest import TestCase
+
+from models import (db, User, Message, Follows, FollowRequest, Like,
+                    TimelineEntry, TrendCount)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from counters import reconcile_counters
+from trending import (BUCKET_SECONDS, HASHTAG, MESSAGE, TrendCounter, Trends,
+                      hashtags)
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class TrendCounterTestCase(TestCase):
+    """Test decayed, windowed counting without the database."""
+
+    def test_hashtags(self):
+        self.assertEqual(hashtags("#Birds and #birds, a#b ##x #ok!"),
+                         ['birds', 'ok'])
+        self.assertEqual(hashtags(None), [])
+
+    def test_decay_and_window(self):
+        counter = TrendCounter(bucket_seconds=60, window=10, half_life=120)
+        counter.add('old', 4, 0)
+        counter.add('new', 3, 2)
+        self.assertEqual(counter.top(), [('new', 3.0), ('old', 2.0)])
+
+        counter.advance(11)
+        [(key, score)] = counter.top()
+        self.assertEqual(key, 'new')
+        self.assertAlmostEqual(score, 3 * 2 ** -4.5)
+
+        # Taking events back, or counting ones outside the window, doesn't
+        # trend.
+        counter.add('new', -3, 11)
+        counter.add('stale', 1, 1)
+        self.assertEqual(counter.top(), [])
+
+    def test_rescale(self):
+        """Do scores survive weights being rescaled to a new landmark?"""
+
+        counter = TrendCounter(bucket_seconds=60, window=1000, half_life=60)
+        counter.add('a', 1, 0)
+        counter.add('a', 1, 100)
+        counter.add('b', 3, 100)
+        self.assertEqual(counter.landmark, 100)
+        self.assertEqual(counter.top(), [('b', 3.0), ('a', 1.0 + 2 ** -100)])
+
+    def test_capacity(self):
+        counter = TrendCounter(capacity=2)
+        for count, key in enumerate('abcde', 1):
+            counter.add(key, count, 0)
+        self.assertLessEqual(len(counter.weights), 4)
+        self.assertEqual([key for key, _ in counter.top(2)], ['e', 'd'])
+        self.assertNotIn('a', counter.buckets[0])
+
+
+class TrendsTestCase(TestCase):
+    """Test checkpointing and the trending page."""
+
+    def setUp(self):
+        TrendCount.query.delete()
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        FollowRequest.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        users = [User(username=f"user{i}", email=f"user{i}@test.com",
+                      password=PASSWORD, private=i == 2) for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.ids = [user.id for user in users]
+        reconcile_counters()
+
+        # One bucket for the whole test, so scores don't decay mid-test.
+        app.extensions['trends'] = Trends(bucket_seconds=10 ** 9)
+        app.extensions['identity_cache'].clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions and cached users."""
+
+        db.session.rollback()
+        app.extensions['identity_cache'].clear()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def post(self, user_id, text):
+        self.login(user_id)
+        resp = self.client.post("/api/messages/new", json={'text': text})
+        return resp.json['msg']['id']
+
+    def test_checkpoint_merges_workers(self):
+        """Does each worker see the others' counts after a checkpoint?"""
+
+        first, second = Trends(), Trends()
+        first.record(MESSAGE, [1, 2], now=1000)
+        second.record(MESSAGE, [2], now=1000)
+        second.record(HASHTAG, ['birds'], now=1000)
+        first.checkpoint(now=1000)
+        second.checkpoint(now=1000)
+        first.checkpoint(now=1000)
+
+        self.assertEqual(first.top(MESSAGE, now=1000),
+                         [('2', 2.0), ('1', 1.0)])
+        self.assertEqual(first.top(HASHTAG, now=1000), [('birds', 1.0)])
+        self.assertEqual(TrendCount.query.count(), 3)
+
+        # A day later the window has moved past every saved count.
+        later = Trends()
+        later.checkpoint(now=1000 + 86400)
+        self.assertEqual(later.top(MESSAGE, now=1000 + 86400), [])
+        self.assertEqual(TrendCount.query.count(), 0)
+
+    def test_checkpoint_keeps_heaviest(self):
+        """Does the table only keep the heaviest `capacity` keys?"""
+
+        trends = Trends(capacity=1)
+        trends.record(MESSAGE, [1, 2], now=0)
+        trends.record(MESSAGE, [1], now=BUCKET_SECONDS)
+        # Older likes count for less, so 3's two new ones beat 1's two.
+        trends.record(MESSAGE, [3], count=2, now=BUCKET_SECONDS * 3)
+        trends.checkpoint(now=BUCKET_SECONDS * 3)
+
+        self.assertEqual({row.key for row in TrendCount.query}, {'3'})
+        self.assertEqual(
+            [key for key, _ in trends.top(MESSAGE, now=BUCKET_SECONDS * 3)],
+            ['3'])
+
+    def test_trending_page(self):
+        popular = self.post(self.ids[0], "Look up! #Birds")
+        quiet = self.post(self.ids[1], "Just me #birds #quiet")
+        private = self.post(self.ids[2], "Secret #birds")
+
+        self.login(self.ids[1])
+        self.client.post(f"/api/messages/{popular}/like")
+        self.client.post(f"/api/messages/{private}/like")
+        self.login(self.ids[2])
+        self.client.post(f"/api/messages/{popular}/like")
+        self.client.post(f"/api/messages/{quiet}/like")
+        self.client.post(f"/api/messages/{quiet}/like")
+
+        self.login(self.ids[0])
+        html = self.client.get("/trending").get_data(as_text=True)
+        self.assertIn("Look up!", html)
+        self.assertNotIn("Just me", html)
+        self.assertNotIn("Secret", html)
+        self.assertLess(html.index("#birds"), html.index("#quiet"))
+
+        data = self.client.get("/api/v1/trending?fields=id").json
+        self.assertEqual(data['data'], [{'id': popular, 'score': 2.0}])
+        self.assertEqual(data['hashtags'][0], {'tag': 'birds', 'score': 3.0})
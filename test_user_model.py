@@ -8,6 +8,8 @@
 import os
 from unittest import TestCase
 
+from sqlalchemy import event
+
 from models import db, User, Message, Follows
 
 # BEFORE we import our app, let's set an environmental variable
@@ -96,6 +98,28 @@ class UserModelTestCase(TestCase):
         self.assertEqual(self.user2.is_following(self.user), True)
         self.assertEqual(self.user.is_following(self.user2), False)
 
+    def test_following_ids(self):
+        """Does following_ids answer for many users in one query?"""
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        ids = [self.user.id, self.user2.id, -1]
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                self.assertEqual(self.user2.following_ids(ids), {ids[0]})
+                self.assertEqual(self.user2.following_ids(ids), {ids[0]})
+                self.assertTrue(self.user2.is_following(self.user))
+                self.assertTrue(self.user.is_followed_by(self.user2))
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(len(statements), 1)
+
     def test_is_followed_by(self):
         """Does is_followed_by work?"""
 
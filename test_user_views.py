@@ -8,7 +8,7 @@
 import os
 from unittest import TestCase
 
-from models import db, User, Message, Follows
+from models import db, User, Message, Follows, FollowRequest
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -22,6 +22,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 from app import app, CURR_USER_KEY
 app.config['TESTING'] = True
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['RAISE_ON_LAZY_LOAD'] = True
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -47,6 +48,7 @@ class UserViewTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
+        FollowRequest.query.delete()
         User.query.delete()
         Message.query.delete()
         Follows.query.delete()
@@ -159,3 +161,20 @@ class UserViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 403)
     
 
+    def test_follow_request_not_duplicated(self):
+        """Does asking to follow a private user twice send one request?"""
+
+        self.user2.private = True
+        db.session.commit()
+        user_id, private_id = self.user.id, self.user2.id
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            client.post(f"/users/follow/{private_id}")
+            resp = client.post(f"/users/follow/{private_id}")
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(
+                FollowRequest.query.filter_by(from_id=private_id).count(), 1)
@@ -0,0 +1,189 @@
+"""Write-behind queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_writebehind.py
+
+
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from writebehind import LeaseHeld, WriteQueue
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+PASSWORD = "$2b$12$l1tVCOm8Kit0adveLw61yOMqYPvIqpyB7kXT3UooJjdPQBjFLpfZS"
+
+
+class WriteBehindTestCase(TestCase):
+    """Test queued likes and fan-out."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        author = User(username="author", email="author@test.com",
+                      password=PASSWORD)
+        reader = User(username="reader", email="reader@test.com",
+                      password=PASSWORD)
+        db.session.add_all([author, reader])
+        db.session.flush()
+        reader.following.append(author)
+        msg = Message(text="Like me", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.author_id = author.id
+        self.reader_id = reader.id
+        self.msg_id = msg.id
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.queue = WriteQueue(os.path.join(self.tmp.name, 'writes.sqlite'))
+        app.extensions['write_queue'] = self.queue
+        app.extensions['identity_cache'].clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions, cached users and the queue."""
+
+        db.session.rollback()
+        app.extensions['write_queue'] = None
+        app.extensions['identity_cache'].clear()
+        self.tmp.cleanup()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def likes(self):
+        return db.session.query(Like.user_id, Like.message_id).all()
+
+    def likes_count(self):
+        return (db.session.query(User.likes_count)
+                .filter(User.id == self.reader_id).scalar())
+
+    def test_like_reads_own_writes(self):
+        """Is a queued like shown to its user before it's applied?"""
+
+        self.login(self.reader_id)
+        etag = self.client.get("/").headers['ETag']
+        resp = self.client.post(f"/api/messages/{self.msg_id}/like")
+        self.assertTrue(resp.json['liked'])
+        self.assertEqual(self.likes(), [])
+
+        html = self.client.get(f"/users/{self.author_id}").get_data(
+            as_text=True)
+        self.assertIn("fas fa-thumbs-up", html)
+
+        # Nor is an earlier copy of the page revalidated while it's queued.
+        resp = self.client.get("/", headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+
+        self.assertEqual(self.queue.drain(), 1)
+        self.assertEqual(self.likes(), [(self.reader_id, self.msg_id)])
+        self.assertEqual(self.likes_count(), 1)
+        self.assertEqual(Message.query.get(self.msg_id).like_count, 1)
+        self.assertEqual(len(self.queue), 0)
+
+    def test_toggles_collapse(self):
+        self.login(self.reader_id)
+        for liked in (True, False, True):
+            resp = self.client.post(f"/api/messages/{self.msg_id}/like")
+            self.assertEqual(resp.json['liked'], liked)
+
+        self.queue.drain()
+        self.assertEqual(self.likes(), [(self.reader_id, self.msg_id)])
+        self.assertEqual(self.likes_count(), 1)
+
+    def test_idempotent(self):
+        """Does applying the same writes again change nothing?"""
+
+        self.queue.like(self.reader_id, [self.msg_id])
+        self.queue.drain()
+        self.queue.like(self.reader_id, [self.msg_id])
+        self.queue.drain()
+
+        self.assertEqual(self.likes(), [(self.reader_id, self.msg_id)])
+        self.assertEqual(self.likes_count(), 1)
+
+        self.queue.unlike(self.reader_id, [self.msg_id])
+        self.queue.unlike(self.reader_id, [self.msg_id])
+        self.queue.drain()
+        self.assertEqual(self.likes(), [])
+        self.assertEqual(self.likes_count(), 0)
+
+    def test_fan_out_deferred(self):
+        """Does the author see a new post at once, and followers later?"""
+
+        self.login(self.author_id)
+        resp = self.client.post("/api/messages/new", json={"text": "Later"})
+        msg_id = resp.json['msg']['id']
+
+        def timeline_of(user_id):
+            return {entry.message_id for entry in
+                    TimelineEntry.query.filter_by(user_id=user_id)}
+
+        self.assertIn(msg_id, timeline_of(self.author_id))
+        self.assertNotIn(msg_id, timeline_of(self.reader_id))
+
+        self.queue.drain()
+        self.assertIn(msg_id, timeline_of(self.reader_id))
+
+        self.queue.fan_out(msg_id)
+        self.queue.drain()
+        self.assertEqual(TimelineEntry.query.filter_by(
+            user_id=self.reader_id, message_id=msg_id).count(), 1)
+
+    def test_deleted_before_applied(self):
+        self.queue.like(self.reader_id, [self.msg_id])
+        self.queue.fan_out(self.msg_id)
+        Message.query.filter_by(id=self.msg_id).delete()
+        db.session.commit()
+
+        self.queue.drain()
+        self.assertEqual(self.likes(), [])
+        self.assertEqual(len(self.queue), 0)
+
+    def test_lease(self):
+        """Does only one process apply writes at a time?"""
+
+        self.assertTrue(self.queue.acquire_lease())
+        self.assertTrue(self.queue.acquire_lease())
+
+        self.queue._connection().execute(
+            "UPDATE lease SET owner = 'elsewhere:1', expires = ?",
+            (time.time() + 60,))
+        self.assertFalse(self.queue.acquire_lease())
+
+        self.queue._connection().execute(
+            "UPDATE lease SET expires = ?", (time.time() - 1,))
+        self.assertTrue(self.queue.acquire_lease())
+
+    def test_drain_takes_lease(self):
+        """Does draining by hand wait its turn, and then let go?"""
+
+        self.queue.like(self.reader_id, [self.msg_id])
+        self.queue._connection().execute(
+            "INSERT INTO lease (id, owner, expires) VALUES (1, ?, ?)",
+            ('elsewhere:1', time.time() + 60))
+        with self.assertRaises(LeaseHeld):
+            self.queue.drain()
+        self.assertEqual(len(self.queue), 1)
+
+        self.queue._connection().execute("DELETE FROM lease")
+        self.assertEqual(self.queue.drain(), 1)
+        self.assertIsNone(self.queue._connection().execute(
+            "SELECT owner FROM lease").fetchone())
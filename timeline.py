@@ -0,0 +1,312 @@
+"""Materialized home timelines for Warbler.
+
+Each user has a capped list of recent message ids from themselves and the
+accounts they follow, stored in the `timelines` table. New messages are
+fanned out to followers when they are posted, and the follow routes back-fill
+or prune a timeline when the follow graph changes, so the homepage only needs
+one indexed lookup.
+
+Accounts with FANOUT_FOLLOWER_LIMIT or more followers are flagged with
+`User.fanout_on_read`; their messages are not copied to followers and are
+merged into the timeline when it is read instead.
+"""
+
+import loaders
+from models import db, User, Message, Follows, TimelineEntry
+
+TIMELINE_LENGTH = 100
+FANOUT_FOLLOWER_LIMIT = 10000
+REBUILD_BATCH_SIZE = 1000
+TRIM_BATCH_SIZE = 1000
+TRIM_THRESHOLD = 2 * TIMELINE_LENGTH
+
+TIMELINE_COLUMNS = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+
+def follower_count(user_id):
+    """Return how many users follow `user_id`, from its maintained counter."""
+
+    return (db.session
+            .query(User.followers_count)
+            .filter(User.id == user_id)
+            .scalar())
+
+
+def _insert_entries(select):
+    """Insert timeline rows for a select of TIMELINE_COLUMNS."""
+
+    db.session.execute(
+        TimelineEntry.__table__.insert().from_select(TIMELINE_COLUMNS, select))
+
+
+def trim_timelines(user_ids=None):
+    """Drop entries past TIMELINE_LENGTH for `user_ids` (or every user).
+
+    `user_ids` may be a list or a select of ids.
+    """
+
+    ranked = db.select([
+        TimelineEntry.id,
+        db.func.row_number().over(
+            partition_by=TimelineEntry.user_id,
+            order_by=(TimelineEntry.timestamp.desc(),
+                      TimelineEntry.message_id.desc()),
+        ).label('position'),
+    ])
+    if user_ids is not None:
+        ranked = ranked.where(TimelineEntry.user_id.in_(user_ids))
+    ranked = ranked.subquery()
+
+    stale = db.select([ranked.c.id]).where(ranked.c.position > TIMELINE_LENGTH)
+    (TimelineEntry
+        .query
+        .filter(TimelineEntry.id.in_(stale))
+        .delete(synchronize_session=False))
+
+
+def message_posted(msg, fan_out=True):
+    """Write a newly posted message to its author's and followers' timelines.
+
+    Followers' timelines are only trimmed once they pass TRIM_THRESHOLD
+    entries (or by `flask trim-timelines`), since trimming every follower on
+    every post would cost more than the fan-out itself; reads never depend on
+    the cap.
+
+    With `fan_out` False only the author's timeline is written, and
+    `fan_out_message()` must be called later (see writebehind.py).
+    """
+
+    db.session.flush()
+
+    _insert_entries(db.select([db.literal(msg.user_id),
+                               db.literal(msg.id),
+                               db.literal(msg.user_id),
+                               db.literal(msg.timestamp, db.DateTime)]))
+    if fan_out:
+        fan_out_message(msg.id)
+
+    trim_timelines([msg.user_id])
+
+
+def fan_out_message(message_id):
+    """Copy a message to its author's followers' timelines, and trim those
+    past TRIM_THRESHOLD back to TIMELINE_LENGTH.
+
+    Safe to repeat: followers who already have it are skipped, and nothing
+    happens if the message is gone or its author fans out on read.
+    """
+
+    already_present = (db.select([TimelineEntry.id])
+                       .where(TimelineEntry.user_id
+                              == Follows.user_following_id)
+                       .where(TimelineEntry.message_id == message_id)
+                       .exists())
+    _insert_entries(
+        db.select([Follows.user_following_id,
+                   Message.id,
+                   Message.user_id,
+                   Message.timestamp])
+        .select_from(Message.__table__
+                     .join(User, User.id == Message.user_id)
+                     .join(Follows,
+                           Follows.user_being_followed_id == Message.user_id))
+        .where(Message.id == message_id)
+        .where(User.fanout_on_read.isnot(True))
+        .where(~already_present))
+
+    follower_ids = [user_id for (user_id,) in
+                    db.session
+                    .query(Follows.user_following_id)
+                    .join(Message,
+                          Message.user_id == Follows.user_being_followed_id)
+                    .join(User, User.id == Message.user_id)
+                    .filter(Message.id == message_id)
+                    .filter(User.fanout_on_read.isnot(True))]
+    for start in range(0, len(follower_ids), TRIM_BATCH_SIZE):
+        overfull = [user_id for (user_id,) in
+                    db.session
+                    .query(TimelineEntry.user_id)
+                    .filter(TimelineEntry.user_id.in_(
+                        follower_ids[start:start + TRIM_BATCH_SIZE]))
+                    .group_by(TimelineEntry.user_id)
+                    .having(db.func.count(TimelineEntry.id) > TRIM_THRESHOLD)]
+        if overfull:
+            trim_timelines(overfull)
+
+
+def message_deleted(msg):
+    """Remove a message from every timeline it was written to."""
+
+    (TimelineEntry
+        .query
+        .filter_by(message_id=msg.id)
+        .delete(synchronize_session=False))
+
+
+def follow_added(follower, followed):
+    """Back-fill `follower`'s timeline with `followed`'s recent messages.
+
+    Also flags `followed` for fan-out on read once they reach
+    FANOUT_FOLLOWER_LIMIT followers.
+    """
+
+    followers_added([follower.id], followed)
+
+
+def followers_added(follower_ids, followed):
+    """Back-fill several new followers' timelines at once (see above)."""
+
+    db.session.flush()
+
+    if not followed.fanout_on_read:
+        if follower_count(followed.id) >= FANOUT_FOLLOWER_LIMIT:
+            followed.fanout_on_read = True
+            return
+
+        recent = (db.select([Message.id, Message.user_id, Message.timestamp])
+                  .where(Message.user_id == followed.id)
+                  .order_by(Message.timestamp.desc())
+                  .limit(TIMELINE_LENGTH)
+                  .subquery())
+        already_present = (db.select([TimelineEntry.id])
+                           .where(TimelineEntry.user_id == User.id)
+                           .where(TimelineEntry.message_id == recent.c.id)
+                           .exists())
+        _insert_entries(
+            db.select([User.id, recent.c.id, recent.c.user_id,
+                       recent.c.timestamp])
+            .select_from(User.__table__.join(recent, db.true()))
+            .where(User.id.in_(follower_ids))
+            .where(~already_present))
+        trim_timelines(follower_ids)
+
+
+def follow_removed(follower, followed):
+    """Rebuild `follower`'s timeline without `followed`'s messages, so it's
+    back-filled from the accounts they still follow.
+    """
+
+    db.session.flush()
+    _rebuild([follower.id])
+
+
+def get_timeline(user, before=None, limit=TIMELINE_LENGTH, query=None):
+    """Return up to `limit` messages for `user`'s home timeline, newest first.
+
+    `before` is an optional (timestamp, message id) key; only older messages
+    are returned. Pages the stored timeline can't fill fall back to reading
+    the followed accounts' messages directly.
+
+    `query` selects what to load for each message (default: message cards);
+    it must include Message.id and Message.timestamp.
+    """
+
+    if query is None:
+        query = loaders.message_cards(Message.query)
+
+    stored = (query
+              .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+              .filter(TimelineEntry.user_id == user.id))
+    if before:
+        stored = stored.filter(
+            db.tuple_(TimelineEntry.timestamp, TimelineEntry.message_id)
+            < before)
+    messages = (stored
+                .order_by(TimelineEntry.timestamp.desc(),
+                          TimelineEntry.message_id.desc())
+                .limit(limit)
+                .all())
+
+    followed_ids = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == user.id))
+
+    if len(messages) < limit:
+        # Short of the capped timeline: read everything followed.
+        author_ids = followed_ids.union(db.session.query(db.literal(user.id)))
+    else:
+        author_ids = (followed_ids
+                      .join(User, User.id == Follows.user_being_followed_id)
+                      .filter(User.fanout_on_read.is_(True)))
+
+    pulled = (query
+              .filter(Message.user_id.in_(author_ids)))
+    if before:
+        pulled = pulled.filter(db.tuple_(Message.timestamp, Message.id) < before)
+    pulled = (pulled
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(limit)
+              .all())
+
+    if pulled:
+        merged = {msg.id: msg for msg in messages + pulled}
+        messages = sorted(merged.values(),
+                          key=lambda msg: (msg.timestamp, msg.id),
+                          reverse=True)[:limit]
+
+    return messages
+
+
+def rebuild_timelines():
+    """Rebuild every timeline from the follows and messages tables.
+
+    Recomputes `User.fanout_on_read` first, then rewrites timelines in
+    batches of REBUILD_BATCH_SIZE users, committing after each batch.
+    """
+
+    follower_counts = (db.select([db.func.count(Follows.user_following_id)])
+                       .where(Follows.user_being_followed_id == User.id)
+                       .scalar_subquery())
+    (User
+        .query
+        .update({User.fanout_on_read: follower_counts >= FANOUT_FOLLOWER_LIMIT},
+                synchronize_session=False))
+    db.session.commit()
+
+    user_ids = [user_id for (user_id,) in
+                db.session.query(User.id).order_by(User.id)]
+
+    for start in range(0, len(user_ids), REBUILD_BATCH_SIZE):
+        _rebuild(user_ids[start:start + REBUILD_BATCH_SIZE])
+        db.session.commit()
+
+
+def _rebuild(user_ids):
+    """Rewrite `user_ids`' timelines from the follows and messages tables."""
+
+    (TimelineEntry
+        .query
+        .filter(TimelineEntry.user_id.in_(user_ids))
+        .delete(synchronize_session=False))
+
+    followed = (db.select([Follows.user_following_id.label('user_id'),
+                           Message.id.label('message_id'),
+                           Message.user_id.label('author_id'),
+                           Message.timestamp.label('timestamp')])
+                .join_from(Follows, Message,
+                           Message.user_id == Follows.user_being_followed_id)
+                .join(User, User.id == Message.user_id)
+                .where(Follows.user_following_id.in_(user_ids))
+                .where(User.fanout_on_read.isnot(True)))
+    own = (db.select([Message.user_id.label('user_id'),
+                      Message.id.label('message_id'),
+                      Message.user_id.label('author_id'),
+                      Message.timestamp.label('timestamp')])
+           .where(Message.user_id.in_(user_ids)))
+    candidates = db.union_all(followed, own).subquery()
+
+    ranked = db.select([
+        candidates,
+        db.func.row_number().over(
+            partition_by=candidates.c.user_id,
+            order_by=(candidates.c.timestamp.desc(),
+                      candidates.c.message_id.desc()),
+        ).label('position'),
+    ]).subquery()
+
+    _insert_entries(
+        db.select([ranked.c.user_id,
+                   ranked.c.message_id,
+                   ranked.c.author_id,
+                   ranked.c.timestamp])
+        .where(ranked.c.position <= TIMELINE_LENGTH))
@@ -0,0 +1,359 @@
+"""Trending messages and hashtags.
+
+Messages trend by how fast they're being liked and hashtags by how often
+they're used in new messages, with recent events counting most: an event's
+weight halves every HALF_LIFE seconds and it stops counting after a window
+of WINDOW_BUCKETS buckets of BUCKET_SECONDS each (a day by default).
+
+Each worker counts the events it handles in a `TrendCounter` per kind,
+in memory, so /trending never scans messages or likes. Counters keep exact
+counts per time bucket, but only for the heaviest CAPACITY keys; rarely
+liked messages and rarely used tags are dropped, which doesn't change what
+trends.
+
+A background thread in each worker checkpoints on its first request and
+every TRENDING_CHECKPOINT_INTERVAL seconds after: it adds the counts it
+recorded since the last checkpoint to the `trend_counts` table, deletes
+buckets that have left the window and all but the heaviest CAPACITY keys
+of each kind, so the table stays as small as the counters, and reloads its
+counters from what's left, which picks up the other workers' counts and
+survives restarts. Requests never checkpoint; between checkpoints (and
+before the first) a worker only sees its own new events.
+"""
+
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from operator import itemgetter
+
+from flask import current_app, has_app_context
+from sqlalchemy.dialects import postgresql, sqlite
+
+import loaders
+from models import db, Message, TrendCount
+from search import by_ids, visible_messages
+
+log = logging.getLogger(__name__)
+
+MESSAGE = 'message'
+HASHTAG = 'hashtag'
+KINDS = (MESSAGE, HASHTAG)
+
+BUCKET_SECONDS = 600
+WINDOW_BUCKETS = 144
+HALF_LIFE = 7200
+CAPACITY = 2000
+TOP_K = 20
+DEFAULT_CHECKPOINT_INTERVAL = 60
+
+# Weights grow by 2 ** (age / HALF_LIFE); rescale them before they get this
+# big, long before a float overflows.
+MAX_EXPONENT = 64
+# Weights this small, relative to a new event's, are zero.
+EPSILON = 1e-9
+
+HASHTAG_PATTERN = re.compile(r'(?<![\w#])#(\w{1,50})')
+
+
+def hashtags(text):
+    """Distinct hashtags in `text`, lowercased, in order of appearance."""
+
+    return list(dict.fromkeys(tag.lower() for tag in
+                              HASHTAG_PATTERN.findall(text or '')))
+
+
+class TrendCounter:
+    """Time-decayed counts over a sliding window of time buckets.
+
+    Scores use forward decay: an event in bucket `b` adds
+    2 ** ((b - landmark) * bucket_seconds / half_life) to its key's weight,
+    so existing weights never need decaying, and dividing by the newest
+    bucket's weight gives what a key's events are worth now. When a bucket
+    leaves the window its counts are subtracted again.
+    """
+
+    def __init__(self, bucket_seconds=BUCKET_SECONDS, window=WINDOW_BUCKETS,
+                 half_life=HALF_LIFE, capacity=CAPACITY):
+        self.bucket_seconds = bucket_seconds
+        self.window = window
+        self.half_life = half_life
+        self.capacity = capacity
+        self.buckets = {}
+        self.weights = {}
+        self.landmark = None
+        self.newest = None
+
+    def _weight(self, bucket):
+        return 2.0 ** ((bucket - self.landmark) * self.bucket_seconds
+                       / self.half_life)
+
+    def advance(self, bucket):
+        """Move the end of the window up to `bucket`."""
+
+        if self.newest is not None and bucket <= self.newest:
+            return
+        if self.landmark is None:
+            self.landmark = bucket
+        self.newest = bucket
+
+        oldest = bucket - self.window + 1
+        for expired in [b for b in self.buckets if b < oldest]:
+            self._subtract(expired, self.buckets.pop(expired))
+
+        if (bucket - self.landmark) * self.bucket_seconds / self.half_life \
+                > MAX_EXPONENT:
+            scale = 1 / self._weight(bucket)
+            self.weights = {key: weight * scale
+                            for key, weight in self.weights.items()}
+            self.landmark = bucket
+
+    def add(self, key, count, bucket):
+        """Count `count` events for `key` in `bucket`; negative takes some
+        back. Events from before the window are ignored.
+        """
+
+        self.advance(bucket)
+        if bucket <= self.newest - self.window:
+            return
+
+        self.buckets.setdefault(bucket, Counter())[key] += count
+        self.weights[key] = (self.weights.get(key, 0.0)
+                             + count * self._weight(bucket))
+        if len(self.weights) > 2 * self.capacity:
+            self._prune()
+
+    def _subtract(self, bucket, counts):
+        weight = self._weight(bucket)
+        floor = EPSILON * self._weight(self.newest)
+        for key, count in counts.items():
+            if key in self.weights:
+                self.weights[key] -= count * weight
+                if self.weights[key] <= floor:
+                    del self.weights[key]
+
+    def _prune(self):
+        """Keep only the heaviest `capacity` keys."""
+
+        self.weights = dict(heapq.nlargest(self.capacity,
+                                           self.weights.items(),
+                                           key=itemgetter(1)))
+        for counts in self.buckets.values():
+            for key in [key for key in counts if key not in self.weights]:
+                del counts[key]
+
+    def top(self, k=TOP_K):
+        """[(key, score)] for the `k` hottest keys, hottest first; a score
+        is the number of events, decayed to the newest bucket.
+        """
+
+        if self.newest is None:
+            return []
+        now = self._weight(self.newest)
+        return [(key, weight / now) for key, weight in
+                heapq.nlargest(k, self.weights.items(), key=itemgetter(1))
+                if weight / now > EPSILON]
+
+
+class Trends:
+    """A worker's trend counters, checkpointed to the trend_counts table."""
+
+    def __init__(self, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 **options):
+        self.checkpoint_interval = checkpoint_interval
+        self.options = options
+        self.bucket_seconds = options.get('bucket_seconds', BUCKET_SECONDS)
+        self.window = options.get('window', WINDOW_BUCKETS)
+        self.half_life = options.get('half_life', HALF_LIFE)
+        self.capacity = options.get('capacity', CAPACITY)
+        self.counters = self._counters()
+        # (kind, bucket, key): count recorded since the last checkpoint.
+        self.pending = Counter()
+        self._lock = threading.Lock()
+        self._worker_pid = None
+
+    def _counters(self):
+        return {kind: TrendCounter(**self.options) for kind in KINDS}
+
+    def _bucket(self, now):
+        return int((time.time() if now is None else now)
+                   // self.bucket_seconds)
+
+    def record(self, kind, keys, count=1, now=None):
+        """Count `count` events for each of `keys`."""
+
+        bucket = self._bucket(now)
+        with self._lock:
+            for key in keys:
+                key = str(key)
+                self.counters[kind].add(key, count, bucket)
+                self.pending[(kind, bucket, key)] += count
+
+    def top(self, kind, k=TOP_K, now=None):
+        """[(key, score)] for the `k` hottest keys of `kind`."""
+
+        with self._lock:
+            counter = self.counters[kind]
+            counter.advance(self._bucket(now))
+            return counter.top(k)
+
+    def checkpoint(self, now=None):
+        """Save counts recorded since the last checkpoint, expire old ones,
+        drop all but the heaviest `capacity` keys of each kind and reload
+        everyone's from the database. Commits.
+        """
+
+        with self._lock:
+            pending, self.pending = self.pending, Counter()
+
+        newest = self._bucket(now)
+        oldest = newest - self.window + 1
+        try:
+            _increment([{'kind': kind, 'bucket': bucket, 'key': key,
+                         'count': count}
+                        for (kind, bucket, key), count in pending.items()
+                        if count and bucket >= oldest])
+            (TrendCount
+                .query
+                .filter(TrendCount.bucket < oldest)
+                .delete(synchronize_session=False))
+            for kind in KINDS:
+                self._prune(kind, oldest, newest)
+            saved = (db.session
+                     .query(TrendCount.kind, TrendCount.bucket,
+                            TrendCount.key, TrendCount.count)
+                     .filter(TrendCount.bucket >= oldest)
+                     .order_by(TrendCount.bucket)
+                     .all())
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                self.pending.update(pending)
+            raise
+
+        counters = self._counters()
+        for kind, bucket, key, count in saved:
+            if kind in counters:
+                counters[kind].add(key, count, bucket)
+
+        with self._lock:
+            # Counts recorded while this ran aren't saved yet.
+            for (kind, bucket, key), count in self.pending.items():
+                counters[kind].add(key, count, bucket)
+            self.counters = counters
+
+    def _prune(self, kind, oldest, newest):
+        """Delete `kind`'s rows for all but its heaviest `capacity` keys,
+        scored as TrendCounter scores them.
+        """
+
+        weight = db.case(
+            *[(bucket, 2.0 ** ((bucket - newest) * self.bucket_seconds
+                               / self.half_life))
+              for bucket in range(oldest, newest + 1)],
+            value=TrendCount.bucket, else_=0.0)
+        heaviest = (db.session
+                    .query(TrendCount.key)
+                    .filter(TrendCount.kind == kind)
+                    .group_by(TrendCount.key)
+                    .order_by(db.func.sum(TrendCount.count * weight).desc(),
+                              TrendCount.key)
+                    .limit(self.capacity)
+                    .subquery())
+        (TrendCount
+            .query
+            .filter(TrendCount.kind == kind)
+            .filter(TrendCount.key.notin_(db.select([heaviest.c.key])))
+            .delete(synchronize_session=False))
+
+    def start_worker(self):
+        """Start this process's checkpoint thread, once per process."""
+
+        if (self._worker_pid == os.getpid() or not has_app_context()
+                or current_app.testing):
+            return
+
+        with self._lock:
+            if self._worker_pid != os.getpid():
+                self._worker_pid = os.getpid()
+                threading.Thread(
+                    target=self._work,
+                    args=(current_app._get_current_object(),),
+                    name='trends', daemon=True).start()
+
+    def _work(self, app):
+        while True:
+            try:
+                with app.app_context():
+                    self.checkpoint()
+            except Exception:
+                log.exception("Checkpointing trends failed")
+            time.sleep(self.checkpoint_interval)
+
+
+def _increment(rows):
+    """Add each row's count to trend_counts, inserting missing rows."""
+
+    if not rows:
+        return
+
+    insert = {'postgresql': postgresql.insert,
+              'sqlite': sqlite.insert}[db.engine.dialect.name]
+    statement = insert(TrendCount.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['kind', 'bucket', 'key'],
+        set_={'count': TrendCount.__table__.c.count
+              + statement.excluded['count']})
+    db.session.execute(statement, rows)
+
+
+def connect_trends(app):
+    """Set up this process's trend counters for `app`."""
+
+    trends = Trends(app.config.get('TRENDING_CHECKPOINT_INTERVAL',
+                                   DEFAULT_CHECKPOINT_INTERVAL))
+    app.extensions['trends'] = trends
+    app.before_request(trends.start_worker)
+
+
+def get_trends():
+    return current_app.extensions['trends']
+
+
+def message_posted(msg):
+    """Count the hashtags in a new message."""
+
+    get_trends().record(HASHTAG, hashtags(msg.text))
+
+
+def likes_changed(liked_ids=(), unliked_ids=()):
+    """Count messages just liked, and take back ones just unliked."""
+
+    trends = get_trends()
+    trends.record(MESSAGE, liked_ids)
+    trends.record(MESSAGE, unliked_ids, -1)
+
+
+def trending_message_ids(k=TOP_K):
+    """[(message id, score)] for the hottest messages, visible or not."""
+
+    return [(int(key), score) for key, score in get_trends().top(MESSAGE, k)]
+
+
+def trending_messages(viewer, k=TOP_K):
+    """[(Message, score)] for the hottest messages `viewer` may see."""
+
+    scores = dict(trending_message_ids(k))
+    messages = by_ids(loaders.message_cards(visible_messages(viewer)),
+                      list(scores), Message)
+    return [(msg, scores[msg.id]) for msg in messages]
+
+
+def trending_hashtags(k=TOP_K):
+    """[(tag, score)] for the hottest hashtags."""
+
+    return get_trends().top(HASHTAG, k)
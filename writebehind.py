@@ -0,0 +1,324 @@
+"""Optional write-behind queue for likes and timeline fan-out.
+
+With WRITE_BEHIND set, likes, unlikes and the fan-out of new messages to
+followers' timelines aren't written to the database by the request that
+makes them. They are appended to a queue in a local SQLite file
+(WRITE_BEHIND_PATH), which is durable once the request returns, and a
+background thread applies them in batches: one transaction per batch, with
+repeated likes and unlikes of the same message collapsed to the last one.
+Applying a batch twice changes nothing, so a crash between committing a
+batch and removing it from the queue is harmless.
+
+Gunicorn workers on one machine share the file. Each runs a worker thread,
+and a lease in the file lets only one of them apply batches at a time, so
+operations are applied in the order they were queued.
+
+The acting user sees their own writes straight away: `User.liked_message_ids`
+overlays their queued likes, and a new message is written to its author's
+timeline immediately. Other users, and counters, catch up within
+WRITE_BEHIND_INTERVAL or so. `flask apply-writes` drains the queue by hand,
+under the same lease.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app, has_app_context
+
+import counters
+from models import db, Like, Message, User
+import timeline
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_INTERVAL = 0.5
+LEASE_SECONDS = 30
+
+LIKE = 'like'
+UNLIKE = 'unlike'
+FAN_OUT = 'fan_out'
+
+log = logging.getLogger(__name__)
+
+
+class LeaseHeld(Exception):
+    """Raised when another process holds the lease to apply writes."""
+
+    def __init__(self, applied):
+        super().__init__(f"another process is applying queued writes "
+                         f"(applied {applied} first)")
+        self.applied = applied
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ops (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    user_id INTEGER,
+    message_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_ops_user_id ON ops (user_id);
+CREATE TABLE IF NOT EXISTS lease (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+
+class WriteQueue:
+    """A queue of pending writes in a SQLite file, and its applier."""
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE,
+                 interval=DEFAULT_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self._local = threading.local()
+        self._worker_pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads or a fork.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # Producing
+
+    def put(self, kind, message_ids, user_id=None):
+        """Queue `kind` for each of `message_ids`."""
+
+        self._connection().executemany(
+            "INSERT INTO ops (kind, user_id, message_id) VALUES (?, ?, ?)",
+            [(kind, user_id, message_id) for message_id in message_ids])
+        self.start_worker()
+
+    def like(self, user_id, message_ids):
+        self.put(LIKE, message_ids, user_id)
+
+    def unlike(self, user_id, message_ids):
+        self.put(UNLIKE, message_ids, user_id)
+
+    def fan_out(self, message_id):
+        self.put(FAN_OUT, [message_id])
+
+    def pending_likes(self, user_id, message_ids):
+        """{message id: liked?} for `user_id`'s queued likes and unlikes."""
+
+        if not message_ids:
+            return {}
+
+        placeholders = ', '.join('?' for _ in message_ids)
+        rows = self._connection().execute(
+            f"""SELECT message_id, kind FROM ops
+                WHERE user_id = ? AND kind IN (?, ?)
+                AND message_id IN ({placeholders})
+                ORDER BY seq""",
+            [user_id, LIKE, UNLIKE, *message_ids])
+        return {message_id: kind == LIKE for message_id, kind in rows}
+
+    def has_pending(self, user_id):
+        """Has `user_id` queued likes or unlikes that aren't applied yet?"""
+
+        return self._connection().execute(
+            "SELECT 1 FROM ops WHERE user_id = ? LIMIT 1",
+            (user_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT count(*) FROM ops").fetchone()[0]
+
+    # Applying
+
+    def _owner(self):
+        return f"{os.uname().nodename}:{os.getpid()}"
+
+    def acquire_lease(self):
+        """Take or renew the lease to apply batches; False if it's taken."""
+
+        owner = self._owner()
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT owner, expires FROM lease WHERE id = 1").fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO lease (id, owner, expires) "
+                "VALUES (1, ?, ?)", (owner, now + LEASE_SECONDS))
+            return True
+        finally:
+            conn.execute("COMMIT")
+
+    def apply_batch(self):
+        """Apply the oldest batch of queued writes; return how many."""
+
+        ops = self._connection().execute(
+            "SELECT seq, kind, user_id, message_id FROM ops "
+            "ORDER BY seq LIMIT ?", (self.batch_size,)).fetchall()
+        if not ops:
+            return 0
+
+        likes = {}
+        fan_outs = set()
+        for _, kind, user_id, message_id in ops:
+            if kind == FAN_OUT:
+                fan_outs.add(message_id)
+            else:
+                likes[(user_id, message_id)] = kind == LIKE
+
+        try:
+            apply_likes(likes)
+            for message_id in sorted(fan_outs):
+                timeline.fan_out_message(message_id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        self._connection().execute(
+            "DELETE FROM ops WHERE seq <= ?", (ops[-1][0],))
+        return len(ops)
+
+    def release_lease(self):
+        """Give up the lease, if this process holds it."""
+
+        self._connection().execute("DELETE FROM lease WHERE owner = ?",
+                                   (self._owner(),))
+
+    def drain(self):
+        """Apply batches until the queue is empty; return how many writes.
+
+        Holds the lease like the worker threads, renewing it for every
+        batch, and raises LeaseHeld if another process has it.
+        """
+
+        total = 0
+        try:
+            while True:
+                if not self.acquire_lease():
+                    raise LeaseHeld(total)
+                applied = self.apply_batch()
+                if not applied:
+                    return total
+                total += applied
+        finally:
+            self.release_lease()
+
+    def start_worker(self):
+        """Start this process's worker thread, once per process."""
+
+        if (self._worker_pid == os.getpid() or not has_app_context()
+                or current_app.testing):
+            return
+
+        with self._lock:
+            if self._worker_pid != os.getpid():
+                self._worker_pid = os.getpid()
+                threading.Thread(
+                    target=self._work,
+                    args=(current_app._get_current_object(),),
+                    name='write-behind', daemon=True).start()
+
+    def _work(self, app):
+        while True:
+            time.sleep(self.interval)
+            try:
+                # Renew the lease for every batch, so it can't lapse while
+                # this worker is still applying.
+                with app.app_context():
+                    while self.acquire_lease() and self.apply_batch():
+                        pass
+            except Exception:
+                log.exception("Applying queued writes failed")
+
+
+def apply_likes(likes):
+    """Make each (user id, message id) in `likes` liked or not, as given."""
+
+    if not likes:
+        return
+
+    pairs = list(likes)
+    existing = set(db.session.query(Like.user_id, Like.message_id)
+                   .filter(db.tuple_(Like.user_id, Like.message_id)
+                           .in_(pairs)))
+    messages = {message_id for (message_id,) in
+                db.session.query(Message.id)
+                .filter(Message.id.in_({m for _, m in pairs}))}
+
+    added = [pair for pair, liked in likes.items()
+             if liked and pair not in existing and pair[1] in messages]
+    removed = [pair for pair, liked in likes.items()
+               if not liked and pair in existing]
+
+    if added:
+        db.session.execute(Like.__table__.insert(), [
+            {'user_id': user_id, 'message_id': message_id}
+            for user_id, message_id in added])
+    if removed:
+        (Like.query
+            .filter(db.tuple_(Like.user_id, Like.message_id).in_(removed))
+            .delete(synchronize_session=False))
+
+    for delta, user_ids in _by_delta(added, removed, 0).items():
+        counters.adjust(user_ids, User.likes_count, delta)
+    for delta, message_ids in _by_delta(added, removed, 1).items():
+        counters.adjust_like_counts(message_ids, delta)
+
+
+def _by_delta(added, removed, index):
+    """{delta: ids} for the ids at `index` in added and removed pairs."""
+
+    deltas = defaultdict(int)
+    for pair in added:
+        deltas[pair[index]] += 1
+    for pair in removed:
+        deltas[pair[index]] -= 1
+
+    by_delta = defaultdict(list)
+    for id_, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(id_)
+    return by_delta
+
+
+def connect_write_queue(app):
+    """Set up the write-behind queue for `app` if WRITE_BEHIND is set."""
+
+    if not app.config.get('WRITE_BEHIND'):
+        app.extensions['write_queue'] = None
+        return
+
+    path = (app.config.get('WRITE_BEHIND_PATH')
+            or os.path.join(app.instance_path, 'writes.sqlite'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    queue = WriteQueue(
+        path,
+        batch_size=app.config.get('WRITE_BEHIND_BATCH', DEFAULT_BATCH_SIZE),
+        interval=app.config.get('WRITE_BEHIND_INTERVAL', DEFAULT_INTERVAL))
+    app.extensions['write_queue'] = queue
+
+    # Every process applies writes, including ones queued before it started.
+    app.before_request(queue.start_worker)
+
+
+def get_queue():
+    """The app's WriteQueue, or None when writing through."""
+
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('write_queue')